@@ -7,17 +7,35 @@ ongoing_event = False
 last_detect_row = None
 meteor_treshold = 0.7
 
-def lin_spectrum_pass(row, spectrum):
+band("signal", 10500, 10700, ["argpeak"])
+band("noise", 11000, 11500, ["q25"])
+
+# bins of the signal band widened by the spread, over which the average
+# around the peak is taken
+wide_a, wide_b = freq2bin(10500) - avg_spread_bin, freq2bin(10700) + avg_spread_bin
+
+def lin_spectrum_block_pass(first_row, block, bands):
     global ongoing_event, last_detect_row
 
-    (peak_pow, peak_bin) = peak(freq2bin(10500), freq2bin(10700), spectrum)
-    avg_pow = np.average(spectrum[peak_bin - avg_spread_bin:peak_bin + avg_spread_bin])
-    noise_pow = noise(spectrum[freq2bin(11000):freq2bin(11500)])
+    peak_bins = bands["signal"]["argpeak"]
+    noise_pow = bands["noise"]["q25"] * 2
+
+    # the average over peak_bin +- avg_spread_bin of each row, from cumulative sums
+    sums = np.zeros((len(block), wide_b - wide_a + 1))
+    np.cumsum(block[:, wide_a:wide_b], axis=1, out=sums[:, 1:])
+    rows = np.arange(len(block))
+    avg_pow = (sums[rows, peak_bins - wide_a + avg_spread_bin]
+               - sums[rows, peak_bins - wide_a - avg_spread_bin]) / (2 * avg_spread_bin)
 
     sn = np.log(avg_pow / noise_pow)
     plot("sn", sn)
 
-    if sn > meteor_treshold:
+    for i in np.flatnonzero(sn > meteor_treshold):
+        row, peak_bin = first_row + i, peak_bins[i]
+
+        if ongoing_event and (row - last_detect_row) > timeout_nrows:
+            ongoing_event = None
+
         last_detect_row = row
         if not ongoing_event:
             ongoing_event = (row - int(0.5 / row_duration), row + timeout_nrows,
@@ -26,5 +44,3 @@ def lin_spectrum_pass(row, spectrum):
         ongoing_event = (ongoing_event[0], row + timeout_nrows) + ongoing_event[2:5]
 
         emit_event("mlab.aabb_event.meteor_echo", ongoing_event)
-    elif ongoing_event and (row - last_detect_row) > timeout_nrows:
-        ongoing_event = None
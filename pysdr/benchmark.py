@@ -0,0 +1,289 @@
+#!/usr/bin/python
+
+"""Microbenchmarks of the signal processing paths, run as
+
+    $ python -m pysdr.benchmark [-b BINS] [-o OVERLAP] [-B N] [--fft-backend NAME] [-t SECONDS] [NAME ...]
+"""
+
+import sys
+import time
+import threading
+import argparse
+import numpy as np
+
+import pysdr.fft
+from pysdr.spectral import SpectralEngine, hann_window, frames_view
+from pysdr.pipeline import SpectralPipeline
+from pysdr.input import RawSigInput
+from pysdr.dsp import lowpass, FIRFilter, FIRDecimator, FIRInterpolator, OverlapSaveFIR, DDC
+
+TEX_RANGE = (-100., 60.)
+
+def _signal(nsamples):
+    rand = np.random.RandomState(0)
+    return (rand.randn(nsamples) + 1j * rand.randn(nsamples)).astype(np.complex64)
+
+def _rows_per_second(step, duration):
+    nrows, start = 0, time.time()
+
+    while True:
+        for i in xrange(16):
+            step(nrows + i)
+        nrows += 16
+
+        elapsed = time.time() - start
+        if elapsed >= duration:
+            return nrows / elapsed
+
+def bench_rows_legacy(bins, overlap, batch, duration):
+    """per-row path as it was before SpectralEngine"""
+    window = hann_window(bins)
+    hop = bins - overlap
+    sig = _signal(bins * 64)
+    nframes = (len(sig) - bins) / hop
+
+    def step(row):
+        a = (row % nframes) * hop
+        signal = sig[a:a + bins]
+        spectrum = np.absolute(np.fft.fft(np.multiply(signal, window)))
+        spectrum = np.concatenate((spectrum[bins/2:bins], spectrum[0:bins/2]))
+        spectrum = np.log10(spectrum) * 10
+        line = ((spectrum - TEX_RANGE[0]) / (TEX_RANGE[1] - TEX_RANGE[0])).astype('f')
+
+    return _rows_per_second(step, duration)
+
+def bench_rows_engine(bins, overlap, batch, duration):
+    """per-row path through SpectralEngine"""
+    engine = SpectralEngine(bins)
+    hop = bins - overlap
+    sig = _signal(bins * 64)
+    nframes = (len(sig) - bins) / hop
+
+    def step(row):
+        a = (row % nframes) * hop
+        engine.process(sig[a:a + bins])
+        spectrum = engine.log_spectrum()
+        line = np.subtract(spectrum, TEX_RANGE[0])
+        line /= TEX_RANGE[1] - TEX_RANGE[0]
+
+    return _rows_per_second(step, duration)
+
+def bench_rows_batched(bins, overlap, batch, duration):
+    """batched path through SpectralEngine.process_block"""
+    engine = SpectralEngine(bins, batch=batch)
+    hop = bins - overlap
+    sig = _signal(bins * 64 + hop * batch)
+    nblocks = (len(sig) - overlap) / (hop * batch)
+
+    def step(block):
+        a = (block % nblocks) * hop * batch
+        engine.process_block(frames_view(sig[a:], bins, hop, batch))
+        spectra = engine.log_spectrum_block()
+        lines = np.subtract(spectra, TEX_RANGE[0])
+        lines /= TEX_RANGE[1] - TEX_RANGE[0]
+
+    return _rows_per_second(step, duration) * batch
+
+def bench_rows_real(bins, overlap, batch, duration):
+    """per-row path through SpectralEngine with real input"""
+    engine = SpectralEngine(bins, real=True)
+    hop = bins - overlap
+    sig = _signal(bins * 64).real.copy()
+    nframes = (len(sig) - bins) / hop
+
+    def step(row):
+        a = (row % nframes) * hop
+        engine.process(sig[a:a + bins])
+        spectrum = engine.log_spectrum()
+
+    return _rows_per_second(step, duration)
+
+class _LoopInput:
+    is_real = False
+
+    def __init__(self, signal):
+        self.signal = signal
+        self.pos = 0
+
+    def read_into(self, out):
+        frames = len(out)
+
+        if self.pos + frames > len(self.signal):
+            self.pos = 0
+
+        self.pos += frames
+        out[:] = self.signal[self.pos - frames:self.pos]
+
+class _LoopFile:
+    """File-like object replaying a buffer forever in reads of at most 4096 bytes"""
+    name = 'benchmark'
+
+    def __init__(self, data):
+        self.data = np.frombuffer(data, dtype=np.uint8)
+        self.pos = 0
+
+    def readinto(self, buf):
+        n = min(len(buf), 4096, len(self.data) - self.pos)
+        buf[:n] = self.data[self.pos:self.pos + n]
+        self.pos = (self.pos + n) % len(self.data)
+        return n
+
+def bench_read_cs16(bins, overlap, batch, duration):
+    """RawSigInput.read_into of 16-bit integer I/Q in short reads"""
+    raw = (_signal(bins * 16).view(np.float32) * 1000).astype(np.int16)
+    sig_input = RawSigInput(48000, 2, np.dtype(np.int16), _LoopFile(raw.tostring()))
+    out = np.zeros(bins - overlap, dtype=np.complex64)
+
+    def step(row):
+        sig_input.read_into(out)
+
+    return _rows_per_second(step, duration)
+
+def bench_rows_workers(bins, overlap, batch, duration, workers=4):
+    """batched path through a SpectralPipeline of 4 worker threads"""
+    counter = [0]
+
+    def consumer(lin, log):
+        counter[0] += len(log)
+
+    pipeline = SpectralPipeline(_LoopInput(_signal(bins * 64)), bins, overlap, batch,
+                                workers, hann_window(bins), consumer)
+    thread = threading.Thread(target=pipeline.run)
+    thread.setDaemon(True)
+    thread.start()
+
+    time.sleep(duration / 4)
+    start, start_rows = time.time(), counter[0]
+    time.sleep(duration)
+    rate = (counter[0] - start_rows) / (time.time() - start)
+
+    pipeline.stop()
+    thread.join()
+    return rate
+
+def _filter_rows(filt, bins, overlap, batch, duration):
+    """Return the rows of input per second `filt` goes through, in blocks of `batch` rows"""
+    hop = bins - overlap
+    sig = _signal(hop * batch * 16)
+
+    def step(block):
+        a = (block % 16) * hop * batch
+        filt.process(sig[a:a + hop * batch])
+
+    return _rows_per_second(step, duration) * batch
+
+def bench_fir_direct(bins, overlap, batch, duration):
+    """FIRFilter of 64 taps"""
+    return _filter_rows(FIRFilter(lowpass(64, 0.1)), bins, overlap, batch, duration)
+
+def bench_fir_long_direct(bins, overlap, batch, duration):
+    """FIRFilter of 1024 taps"""
+    return _filter_rows(FIRFilter(lowpass(1024, 0.01)), bins, overlap, batch, duration)
+
+def bench_fir_long_fft(bins, overlap, batch, duration):
+    """OverlapSaveFIR of 1024 taps"""
+    return _filter_rows(OverlapSaveFIR(lowpass(1024, 0.01)), bins, overlap, batch, duration)
+
+def bench_decim_8(bins, overlap, batch, duration):
+    """FIRDecimator by 8 with 256 taps"""
+    return _filter_rows(FIRDecimator(lowpass(256, 0.0625), 8), bins, overlap, batch, duration)
+
+def bench_decim_ddc(bins, overlap, batch, duration):
+    """DDC decimating by 96 with 16 taps per phase"""
+    return _filter_rows(DDC(96000, 1000, 96), bins, overlap, batch, duration)
+
+class _LegacyInterpolator:
+    """interpolation as tools/3dwf.py did it before pysdr.dsp"""
+    def __init__(self, taps, interp):
+        self.interp = interp
+        self.nhistory = (len(taps) - 1) // interp
+        padlen = (self.nhistory + 1) * interp - len(taps)
+        self.taps = np.concatenate((np.zeros(padlen, dtype=taps.dtype), taps))
+        self.last = np.zeros(self.nhistory, dtype=np.complex64)
+
+    def process(self, samples):
+        inp = np.concatenate((self.last, samples))
+        self.last = inp[len(inp) - self.nhistory:]
+        res = np.zeros((len(inp) - self.nhistory) * self.interp, dtype=inp.dtype)
+
+        for i in range(self.interp):
+            res[i::self.interp] = np.convolve(inp, self.taps[i::self.interp], mode='valid')
+
+        return res
+
+def bench_interp_legacy(bins, overlap, batch, duration):
+    """interpolation by 4 with 512 taps as in tools/3dwf.py before"""
+    taps = lowpass(512, 0.125).astype(np.float32) * 4
+    return _filter_rows(_LegacyInterpolator(taps, 4), bins, overlap, batch, duration)
+
+def bench_interp_4(bins, overlap, batch, duration):
+    """FIRInterpolator by 4 with 512 taps"""
+    return _filter_rows(FIRInterpolator(lowpass(512, 0.125) * 4, 4),
+                        bins, overlap, batch, duration)
+
+def bench_interp_legacy_short(bins, overlap, batch, duration):
+    """interpolation by 4 with 64 taps as in tools/3dwf.py before"""
+    taps = lowpass(64, 0.125).astype(np.float32) * 4
+    return _filter_rows(_LegacyInterpolator(taps, 4), bins, overlap, batch, duration)
+
+def bench_interp_4_short(bins, overlap, batch, duration):
+    """FIRInterpolator by 4 with 64 taps"""
+    return _filter_rows(FIRInterpolator(lowpass(64, 0.125) * 4, 4),
+                        bins, overlap, batch, duration)
+
+BENCHMARKS = [
+    ('rows_legacy', bench_rows_legacy),
+    ('rows_engine', bench_rows_engine),
+    ('rows_batched', bench_rows_batched),
+    ('rows_real', bench_rows_real),
+    ('rows_workers', bench_rows_workers),
+    ('read_cs16', bench_read_cs16),
+    ('fir_direct', bench_fir_direct),
+    ('fir_long_direct', bench_fir_long_direct),
+    ('fir_long_fft', bench_fir_long_fft),
+    ('decim_8', bench_decim_8),
+    ('decim_ddc', bench_decim_ddc),
+    ('interp_legacy', bench_interp_legacy),
+    ('interp_4', bench_interp_4),
+    ('interp_legacy_short', bench_interp_legacy_short),
+    ('interp_4_short', bench_interp_4_short),
+]
+
+def main():
+    parser = argparse.ArgumentParser(description='Run PySDR signal processing microbenchmarks.')
+    parser.add_argument('-b', '--bins', type=int, default=4096,
+                        help='number of FFT bins (default: %(default)s)')
+    parser.add_argument('-o', '--overlap', type=float, default=0.75,
+                        help='overlap between consecutive windows as a proportion \
+                                of the number of bins (default: %(default)s)')
+    parser.add_argument('-B', '--batch', metavar='N', type=int, default=16,
+                        help='number of windows per block in batched benchmarks \
+                                (default: %(default)s)')
+    parser.add_argument('--fft-backend', metavar='NAME', choices=pysdr.fft.BACKEND_NAMES,
+                        help='force the given FFT backend, one of %s \
+                                (by default, the fastest one available)'
+                                % ', '.join(pysdr.fft.BACKEND_NAMES))
+    parser.add_argument('--fft-threads', metavar='N', type=int, default=1,
+                        help='number of threads used by a single FFT, \
+                                if supported by the backend (default: %(default)s)')
+    parser.add_argument('-t', '--time', type=float, default=2.0,
+                        help='duration of each benchmark in seconds (default: %(default)s)')
+    parser.add_argument('names', metavar='NAME', nargs='*',
+                        help='benchmarks to run (default: all)')
+
+    args = parser.parse_args()
+    overlap_bins = int(args.bins * args.overlap)
+
+    backend = pysdr.fft.select_backend(args.fft_backend, threads=args.fft_threads)
+    print "FFT backend: %s (%d threads)" % (backend.name, backend.threads)
+
+    for name, func in BENCHMARKS:
+        if args.names and name not in args.names:
+            continue
+
+        rate = func(args.bins, overlap_bins, args.batch, args.time)
+        print "%-24s %10.1f rows/s  (%s)" % (name, rate, func.__doc__)
+        sys.stdout.flush()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,627 @@
+import traceback
+import sys
+import os
+import math
+import time
+import heapq
+import itertools
+import signal
+import collections
+import threading
+import tempfile
+import subprocess
+import cPickle as pickle
+import Queue
+
+import numpy as np
+
+from pysdr.spectral import BandReducer
+
+SCRIPT_API_METHODS = []
+
+class TaskRuntime:
+    """Scheduler of the tasks of a detector script, run along the rows of one spectrum
+
+    Tasks are generators yielding what they wait for:
+
+     - `('rows', n)` for the n-th row from the current one, None for the next,
+     - `('seconds', t)` for the row `t` seconds of the signal later,
+     - `('until', t)` for the first row after the UTC timestamp `t`,
+     - `('event', prefix)` for an event whose id starts with `prefix`.
+
+    Waits for rows are resumed with `(row, spectrum)`, waits for events
+    with `(event_id, payload)`. Rows are counted from the one at which
+    the task was spawned or last resumed. Waits on rows are kept in a hashed
+    timer wheel of WHEEL_SLOTS slots indexed by the row, so the cost of a row
+    doesn't grow with the number of tasks waiting. Tasks woken by events
+    are resumed on the next row, wall-clock deadlines are checked once per
+    block by `expire`. Tasks due on rows which were skipped, e.g. dropped
+    by a DetectorProcess, are resumed on the next row advanced to.
+    """
+    WHEEL_SLOTS = 1024
+
+    def __init__(self, row_duration):
+        self.row_duration = row_duration
+        self.wheel = [[] for i in xrange(self.WHEEL_SLOTS)]
+        self.timers = 0
+        self.deadlines = []
+        self.event_waits = []
+        # tasks to be resumed on the next row, along with the value to pass,
+        # and tasks past their deadlines
+        self.woken = []
+        self.expired = []
+        self.seq = itertools.count()
+        # the row being processed
+        self.row = 0
+
+    def __len__(self):
+        return self.timers + len(self.deadlines) + len(self.event_waits) \
+                + len(self.woken) + len(self.expired)
+
+    def spawn(self, task, row):
+        """Start the generator `task` at `row`, it runs up to its first wait right away"""
+        self.row = row
+        self.resume(task, None)
+
+    def resume(self, task, value):
+        try:
+            wait = task.send(value)
+        except StopIteration:
+            return
+
+        if wait is None:
+            wait = ('rows', 1)
+
+        kind, arg = wait
+
+        if kind == 'rows' or kind == 'seconds':
+            n = arg if kind == 'rows' else int(math.ceil(float(arg) / self.row_duration))
+            due = self.row + max(1, int(n))
+            self.wheel[due % self.WHEEL_SLOTS].append((due, task))
+            self.timers += 1
+        elif kind == 'until':
+            heapq.heappush(self.deadlines, (arg, next(self.seq), task))
+        elif kind == 'event':
+            self.event_waits.append((arg, task))
+        else:
+            raise ValueError("unknown wait '%s'" % kind)
+
+    def on_event(self, event_id, payload):
+        waits = self.event_waits
+        self.event_waits = [(prefix, task) for (prefix, task) in waits
+                            if not event_id.startswith(prefix)]
+        self.woken += [(task, (event_id, payload)) for (prefix, task) in waits
+                       if event_id.startswith(prefix)]
+
+    def expire(self):
+        """Take the tasks past their deadlines, to be resumed on the next row"""
+        now = time.time()
+
+        while self.deadlines and self.deadlines[0][0] <= now:
+            self.expired.append(heapq.heappop(self.deadlines)[2])
+
+    def advance(self, row, spectrum):
+        """Resume the tasks due at `row`, handing them `spectrum`"""
+        if self.row + 1 < row and self.timers:
+            # rows were skipped, the tasks due on them are late
+            if row - self.row > self.WHEEL_SLOTS:
+                slots = self.wheel
+            else:
+                slots = [self.wheel[r % self.WHEEL_SLOTS] for r in xrange(self.row + 1, row + 1)]
+        else:
+            slots = [self.wheel[row % self.WHEEL_SLOTS]]
+
+        self.row = row
+        due = []
+
+        for slot in slots:
+            if slot and any(r <= row for (r, task) in slot):
+                due += [task for (r, task) in slot if r <= row]
+                slot[:] = [(r, task) for (r, task) in slot if r > row]
+
+        self.timers -= len(due)
+        expired, self.expired = self.expired, []
+        woken, self.woken = self.woken, []
+
+        for task in expired + due:
+            self.resume(task, (row, spectrum))
+
+        for task, value in woken:
+            self.resume(task, value)
+
+class DetectorScript:
+    """Layer running a detector script on the spectra
+
+    The script is executed in a namespace with `args` and the functions
+    marked by `script_api`, and may define `lin_spectrum_pass(row, spectrum)`
+    and `log_spectrum_pass(row, spectrum)`, called for every row. Events it
+    emits are passed on to `listeners`.
+
+    The script can also run tasks, generators started by `spawn(task,
+    spectrum)` which wait for rows, time or events by yielding
+    `wait_rows(n)`, `wait_seconds(t)`, `wait_until(t)` or `wait_event(prefix)`,
+    see TaskRuntime. Events reach the tasks if the script is among
+    the listeners. A script done with its work calls `finish()`, which stops
+    it for good.
+
+    Instead, the script may declare bands of frequencies with `band` when
+    loaded and define `lin_spectrum_block_pass(row, block, bands)` and
+    `log_spectrum_block_pass(row, block, bands)`, called with blocks of rows
+    starting at `row` and with the statistics of the bands of that spectrum,
+    as `bands[name][stat]` arrays of one value per row. The statistics are
+    computed once for all the scripts by the viewer's BandReducer, and have
+    to be treated as read-only. `plot` and `plot_bin` take arrays of values
+    for the rows of a block as well.
+
+    The plotting functions do nothing here, plots are drawn by the subclass
+    in pysdr.events, so that scripts run unchanged without a display.
+
+    A script raising an exception, when loaded or later, is disabled, with
+    the other layers running on.
+    """
+    def script_api(func):
+        SCRIPT_API_METHODS.append(func.func_name)
+        return func
+
+    @script_api
+    def peak(self, a, b, s):
+        bin = np.argmax(s[a:b])
+        return (s[bin], bin + a)
+
+    @script_api
+    def noise(self, a):
+        return np.partition(a, len(a) / 4)[len(a) / 4] * 2
+
+    @script_api
+    def band(self, name, freq_a, freq_b, stats, spectrum='lin'):
+        """Declare the band freq_a...freq_b of `spectrum` ('lin' or 'log') for `stats`"""
+        if spectrum not in ('lin', 'log'):
+            raise ValueError("unknown spectrum '%s'" % spectrum)
+
+        key = self.viewer.bands.register(spectrum, self.viewer.freq_to_bin(freq_a),
+                                         self.viewer.freq_to_bin(freq_b), stats)
+        self.bands[spectrum][name] = key
+
+    @script_api
+    def spawn(self, task, spectrum='log'):
+        """Start the generator `task`, which is resumed along the rows of `spectrum`"""
+        self.runtimes[spectrum].spawn(task, self.viewer.process_row)
+
+    @script_api
+    def wait_rows(self, n=1):
+        return ('rows', n)
+
+    @script_api
+    def wait_seconds(self, t):
+        return ('seconds', t)
+
+    @script_api
+    def wait_until(self, t):
+        return ('until', t)
+
+    @script_api
+    def wait_event(self, prefix):
+        return ('event', prefix)
+
+    @script_api
+    def plot(self, name, value):
+        pass
+
+    @script_api
+    def plot_bin(self, name, value):
+        pass
+
+    @script_api
+    def plot_freq(self, name, value):
+        self.namespace['plot_bin'](name, self.viewer.freq_to_bin(value))
+
+    @script_api
+    def emit_event(self, event_id, payload):
+        [l.on_event(event_id, payload) for l in self.listeners]
+
+    @script_api
+    def finish(self):
+        if not self.finished:
+            print "%s finished" % self.filename
+
+        self.finished = True
+        self.disabled = True
+
+    def __init__(self, viewer, listeners, args):
+        self.viewer = viewer
+        self.filename = args[0]
+        self.disabled = False
+        self.finished = False
+
+        self.listeners = listeners
+        # keys of the declared bands, by spectrum and name
+        self.bands = {'lin': dict(), 'log': dict()}
+        self.runtimes = {'lin': TaskRuntime(viewer.row_duration),
+                         'log': TaskRuntime(viewer.row_duration)}
+
+        self.namespace = {
+            'args': args[1:],
+            'freq2bin': self.viewer.freq_to_bin,
+            'bin2freq': self.viewer.bin_to_freq,
+            'row_duration': self.viewer.row_duration
+        }
+
+        for name in SCRIPT_API_METHODS:
+            self.namespace[name] = getattr(self, name)
+
+        try:
+            execfile(self.filename, self.namespace)
+        except Exception:
+            print "exception in %s, disabling:" % self.filename
+            traceback.print_exc(file=sys.stdout)
+            self.disabled = True
+
+    def on_lin_spectrum_block(self, block):
+        self.call_script_passes('lin', block)
+
+    def on_log_spectrum_block(self, block):
+        self.call_script_passes('log', block)
+
+    def on_event(self, event_id, payload):
+        for runtime in self.runtimes.values():
+            runtime.on_event(event_id, payload)
+
+    def call_script_passes(self, spectrum, block):
+        block_pass = self.namespace.get(spectrum + '_spectrum_block_pass')
+        row_pass = self.namespace.get(spectrum + '_spectrum_pass')
+        runtime = self.runtimes[spectrum]
+
+        if self.disabled or (block_pass is None and row_pass is None and not len(runtime)):
+            return
+
+        viewer = self.viewer
+        base_row = viewer.process_row
+
+        try:
+            if block_pass is not None:
+                reduced = viewer.bands.reduce(spectrum, base_row, block)
+                bands = dict((name, reduced[key])
+                             for name, key in self.bands[spectrum].iteritems())
+                block_pass(base_row, block, bands)
+
+            if len(runtime):
+                runtime.expire()
+
+            # tasks are resumed row by row along with the row pass, so that
+            # those spawned by either start counting from the row at hand
+            if row_pass is not None or len(runtime):
+                for i in xrange(len(block)):
+                    if self.disabled:
+                        break
+
+                    row = viewer.process_row = base_row + i
+
+                    if len(runtime):
+                        runtime.advance(row, block[i])
+
+                    if row_pass is not None:
+                        row_pass(row, block[i])
+        except Exception:
+            print "exception in %s, disabling:" % self.filename
+            traceback.print_exc(file=sys.stdout)
+            self.disabled = True
+        finally:
+            viewer.process_row = base_row
+
+class _DetectorHost:
+    """Stand-in for the viewer in the process of a DetectorProcess"""
+    def __init__(self, bins, sample_rate, row_duration):
+        self.bins = bins
+        self.sample_rate = sample_rate
+        self.row_duration = row_duration
+        self.process_row = 0
+        self.bands = BandReducer()
+
+    def freq_to_bin(self, freq):
+        return int(freq * self.bins / self.sample_rate + self.bins / 2)
+
+    def bin_to_freq(self, bin):
+        return float(bin - self.bins / 2) / self.bins * self.sample_rate
+
+class _ChildScript(DetectorScript):
+    """DetectorScript collecting its plots and events to be sent back"""
+    def __init__(self, host, args):
+        self.messages = []
+        DetectorScript.__init__(self, host, [], args)
+
+    def plot(self, name, value):
+        self.messages.append(('plot', self.viewer.process_row, name, value))
+
+    def plot_bin(self, name, value):
+        self.messages.append(('plot_bin', self.viewer.process_row, name, value))
+
+    def emit_event(self, event_id, payload):
+        self.messages.append(('event', event_id, payload))
+
+# exit status of the process of a DetectorProcess whose script failed to load
+_LOAD_FAILED = 2
+
+def _run_detector():
+    """Main of the process of a DetectorProcess, talking to it over stdin and stdout
+
+    The parent sends the parameters of the host and the ring, then the jobs
+    `('job', row, pos, n)` and the events `('event', event_id, payload)`,
+    and closes stdin when done. Results are pickled to what was stdout, which
+    is then pointed at stderr, so that the script can print. The process
+    exits with 0 once the script finishes, with 1 when it is disabled by
+    an exception and with _LOAD_FAILED when it can't be loaded.
+    """
+    # interrupts are for the parent, which takes the process down with it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    jobs = sys.stdin
+    results = os.fdopen(os.dup(1), 'wb')
+    os.dup2(2, 1)
+
+    host_params, args, ring_name, ring_rows = pickle.load(jobs)
+    host = _DetectorHost(*host_params)
+    ring = np.memmap(ring_name, dtype=np.float32, mode='r', shape=(ring_rows, host.bins))
+    script = _ChildScript(host, args)
+
+    if script.disabled and not script.finished:
+        sys.exit(_LOAD_FAILED)
+
+    log_passes = any(name in script.namespace for name in
+                     ('log_spectrum_pass', 'log_spectrum_block_pass'))
+
+    while True:
+        try:
+            message = pickle.load(jobs)
+        except EOFError:
+            return
+
+        if message[0] == 'event':
+            script.on_event(*message[1:])
+            continue
+
+        _job, row, pos, n = message
+        block = ring[pos:pos + n]
+        host.process_row = row
+        script.on_lin_spectrum_block(block)
+
+        if log_passes or len(script.runtimes['log']):
+            log = np.log10(block)
+            log *= 10
+            script.on_log_spectrum_block(log)
+
+        try:
+            pickle.dump((n, script.messages), results, pickle.HIGHEST_PROTOCOL)
+            results.flush()
+        except IOError:
+            # the parent is gone
+            return
+
+        script.messages = []
+
+        if script.finished:
+            return
+        elif script.disabled:
+            sys.exit(1)
+
+class DetectorProcess:
+    """Layer running a detector script in a process of its own
+
+    The linear spectra are copied into a ring of RING_ROWS rows in a mapped
+    temporary file, with the blocks announced to the process over a pipe, so
+    a slow script holds up only itself. The process is a fresh interpreter
+    rather than a fork, as forking the signal processing thread along with
+    the other threads' locks could deadlock the child. The process computes the logarithmic
+    spectra itself and the script's bands are reduced there too. Plots and
+    events come back with the acknowledgement of each block and are passed
+    on as if by an in-process DetectorScript, with the delay of the process.
+    Events from the listeners are sent to the process for the script's tasks.
+
+    When the process falls more than RING_ROWS rows behind, new blocks are
+    dropped for it. A watchdog restarts the process RESTART_DELAY seconds after
+    it exits, e.g. after an exception in the script, or right away when it
+    doesn't acknowledge a block for `timeout` seconds. The backlog in rows,
+    the latency of the last block acknowledged, and the counts of dropped
+    rows and restarts are kept for `status`. A process whose script finishes
+    or fails to load is not restarted, the layer is then `disabled`, and
+    `finished` in the former case.
+    """
+    RING_ROWS = 1024
+    RESTART_DELAY = 5.0
+
+    def __init__(self, viewer, listeners, args, timeout=10.0):
+        self.viewer = viewer
+        self.listeners = listeners
+        self.args = args
+        self.name = os.path.basename(args[0])
+        self.timeout = timeout
+
+        self.ring_file = tempfile.NamedTemporaryFile(prefix='pysdr-detector-')
+        self.ring = np.memmap(self.ring_file.name, dtype=np.float32, mode='w+',
+                              shape=(self.RING_ROWS, viewer.bins))
+        self.latency = 0.0
+        self.dropped = 0
+        self.restarts = 0
+        self.disabled = False
+        self.finished = False
+
+        self.process = None
+        self.start_process()
+
+    def start_process(self):
+        # a fresh queue, the thread reading the results of a terminated
+        # process may still be putting into the old one
+        self.results = Queue.Queue()
+        # rows written into the ring and rows acknowledged, with (rows
+        # written, time) of the blocks in flight
+        self.written = 0
+        self.acked = 0
+        self.in_flight = collections.deque()
+        self.last_ack = time.time()
+
+        viewer = self.viewer
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        self.process = subprocess.Popen([sys.executable, '-c',
+                                         'import pysdr.detector; pysdr.detector._run_detector()'],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        close_fds=True, env=env)
+        self.send((viewer.bins, viewer.sig_input.sample_rate, viewer.row_duration),
+                  self.args, self.ring_file.name, self.RING_ROWS)
+
+        thread = threading.Thread(target=self.read_results,
+                                  args=(self.process.stdout, self.results))
+        thread.setDaemon(True)
+        thread.start()
+
+    def send(self, *message):
+        """Send `message` to the process, a process which exited is left to the watchdog"""
+        try:
+            pickle.dump(message, self.process.stdin, pickle.HIGHEST_PROTOCOL)
+            self.process.stdin.flush()
+        except IOError:
+            pass
+
+    @staticmethod
+    def read_results(stdout, results):
+        # bound here, as the module's globals are cleared when the interpreter exits
+        load, errors = pickle.load, (EOFError, IOError, pickle.UnpicklingError)
+
+        while True:
+            try:
+                results.put(load(stdout))
+            except errors:
+                return
+
+    def backlog(self):
+        return self.written - self.acked
+
+    def on_lin_spectrum_block(self, block):
+        self.collect()
+
+        if self.disabled:
+            return
+
+        self.watchdog()
+        n = len(block)
+
+        if self.process is None or self.backlog() + n > self.RING_ROWS:
+            self.dropped += n
+            return
+
+        if not self.backlog():
+            self.last_ack = time.time()
+
+        row = self.viewer.process_row
+        pos = self.written % self.RING_ROWS
+        first = min(n, self.RING_ROWS - pos)
+        self.ring[pos:pos + first] = block[:first]
+        self.send('job', row, pos, first)
+
+        if first < n:
+            self.ring[0:n - first] = block[first:]
+            self.send('job', row + first, 0, n - first)
+
+        self.written += n
+        self.in_flight.append((self.written, time.time()))
+
+    def on_event(self, event_id, payload):
+        if self.process is not None and not self.disabled:
+            self.send('event', event_id, payload)
+
+    def collect(self):
+        """Take in the acknowledgements, passing on the plots and events"""
+        while True:
+            try:
+                n, messages = self.results.get_nowait()
+            except Queue.Empty:
+                return
+
+            now = time.time()
+            self.acked += n
+            self.last_ack = now
+
+            while self.in_flight and self.in_flight[0][0] <= self.acked:
+                self.latency = now - self.in_flight.popleft()[1]
+
+            for message in messages:
+                if message[0] == 'plot':
+                    self.on_plot(*message[1:])
+                elif message[0] == 'plot_bin':
+                    self.on_plot_bin(*message[1:])
+                elif message[0] == 'event':
+                    [l.on_event(*message[1:]) for l in self.listeners]
+
+    def watchdog(self):
+        now = time.time()
+
+        if self.process is None:
+            if now - self.stopped >= self.RESTART_DELAY:
+                self.restarts += 1
+                self.start_process()
+            return
+
+        stuck = self.backlog() and now - self.last_ack > self.timeout
+
+        if stuck:
+            print "detector %s is stuck, restarting" % self.name
+            self.process.terminate()
+        elif self.process.poll() is None:
+            return
+        elif self.process.returncode == 0:
+            print "detector %s finished" % self.name
+            self.disabled = self.finished = True
+        elif self.process.returncode == _LOAD_FAILED:
+            print "detector %s failed to load, disabling" % self.name
+            self.disabled = True
+        else:
+            print "detector %s exited, restarting in %.0f s" % (self.name, self.RESTART_DELAY)
+
+        try:
+            self.process.stdin.close()
+        except IOError:
+            pass
+
+        self.process.wait()
+        self.process = None
+        self.stopped = now
+
+        if stuck:
+            self.stopped -= self.RESTART_DELAY
+
+    def on_plot(self, row, name, value):
+        pass
+
+    def on_plot_bin(self, row, name, value):
+        pass
+
+    def status(self):
+        if self.disabled:
+            return "%s: %s" % (self.name, "finished" if self.finished else "disabled")
+
+        return "%s: backlog %d rows, latency %.0f ms, dropped %d, restarts %d" \
+                % (self.name, self.backlog(), self.latency * 1000, self.dropped, self.restarts)
+
+class MIDIEventGatherer:
+    def __init__(self, viewer, listeners):
+        self.viewer = viewer
+        self.listeners = listeners
+
+    def on_log_spectrum(self, spectrum):
+        for frame, message in self.viewer.sig_input.get_midi_events():
+            if len(message) > 3 and message[0:2] == "\xf0\x7d" and message[-1] == "\xf7":
+                try:
+                    event_id, payload = message[2:-1].split(':', 1)
+                    payload = tuple(payload.split(','))
+
+                    if event_id.startswith('mlab.aabb_event.'):
+                        rel_frame_a, rel_frame_b, freq_a, freq_b, desc = payload
+
+                        row_range = tuple([(frame + int(x)) / self.viewer.row_hop
+                                           for x in (rel_frame_a, rel_frame_b)])
+                        bin_range = tuple([self.viewer.freq_to_bin(float(x)) for x in (freq_a, freq_b)])
+
+                        payload = row_range + bin_range + (desc,)
+
+                    [l.on_event(event_id, payload) for l in self.listeners]
+                except (ValueError, TypeError) as e:
+                    print "failed to parse MIDI message '%s': %s" % (message[2:-1], e)
+            else:
+                print "unknown MIDI message at frame %d: %s" % (frame, message.encode("hex"))
@@ -0,0 +1,346 @@
+"""Streaming filters processing a signal block by block
+
+The filters are causal FIR filters starting from a zero state, they keep
+the history needed to continue with the next block, so that a signal cut
+into blocks of any lengths comes out the same as if it was processed at
+once. Arrays returned by the `process` methods are owned by the filter,
+they are preallocated (and grown for larger blocks) and are overwritten
+by the next call. Apart from FIRFilter and the convolutions of FIRDecimator,
+the filters compute into preallocated buffers as well.
+
+ - FIRFilter filters sample by sample, by direct convolution,
+ - FIRDecimator computes only every `factor`-th output, by polyphase
+   decomposition,
+ - FIRInterpolator inserts `factor - 1` zeros between the samples and
+   filters them, again by polyphase decomposition, without the zeros,
+   as a matrix product or by FFT for long filters,
+ - OverlapSaveFIR filters by FFT, which pays off for long filters,
+ - NCO and DDC shift a frequency to zero and decimate around it.
+
+Filters take complex64 samples by default. This module only depends on numpy
+and the FFT backends, so that the tools outside the pysdr package can use it
+as well. Their throughput is measured by `python -m pysdr.benchmark`.
+"""
+
+import math
+import numpy as np
+
+import pysdr.fft
+
+def lowpass(ntaps, cutoff):
+    """Return a windowed-sinc lowpass filter of `ntaps` taps with unity gain at DC
+
+    The cutoff frequency, at which the gain falls to one half, is given
+    as a fraction of the sample-rate.
+    """
+    x = np.arange(ntaps, dtype=np.float64) - (ntaps - 1) / 2.0
+    taps = np.sinc(2 * cutoff * x) * np.hanning(ntaps + 2)[1:-1]
+    return taps / np.sum(taps)
+
+def _grown(buf, n):
+    """Return `buf` if it holds `n` items, or a larger zeroed array in its place"""
+    if len(buf) >= n:
+        return buf
+
+    return np.zeros(max(n, 2 * len(buf)), dtype=buf.dtype)
+
+class _History:
+    """Input buffer of a filter, holding the samples kept from the previous blocks"""
+    def __init__(self, kept, dtype):
+        self.buffer = np.zeros(max(kept, 1), dtype=dtype)
+        self.kept = kept
+
+    def append(self, samples):
+        """Return the kept samples followed by `samples`"""
+        n = self.kept + len(samples)
+
+        if len(self.buffer) < n:
+            buffer = _grown(self.buffer, n)
+            buffer[:self.kept] = self.buffer[:self.kept]
+            self.buffer = buffer
+
+        self.buffer[self.kept:n] = samples
+        self.kept = n
+        return self.buffer[:n]
+
+    def consume(self, used):
+        """Drop the first `used` samples, keeping the rest for the next block"""
+        self.buffer[:self.kept - used] = self.buffer[used:self.kept].copy()
+        self.kept -= used
+
+class FIRFilter:
+    """FIR filter producing an output sample for every input sample
+
+    The filter is applied by direct convolution, which is faster than
+    the matrix product of FIRInterpolator for a single phase, but leaves
+    numpy a temporary array to allocate for every block.
+    """
+    def __init__(self, taps, dtype=np.complex64):
+        self.taps = np.asarray(taps, dtype=np.float32)
+        self.history = _History(len(taps) - 1, dtype)
+        self.out = np.zeros(0, dtype=dtype)
+
+    def process(self, samples):
+        n = len(samples)
+        self.out = _grown(self.out, n)
+        out = self.out[:n]
+        out[:] = np.convolve(self.history.append(samples), self.taps, mode='valid')
+        self.history.consume(n)
+        return out
+
+class FIRDecimator:
+    """FIR filter keeping every `factor`-th output, as a polyphase decimator
+
+    Only the outputs which are kept are computed, `len(taps) / factor`
+    multiplications per input sample. The taps are split into `factor`
+    phases of `len(taps) / factor` taps; with more phases than taps per phase
+    the sum goes over the taps, each term being a matrix-vector product
+    of the input laid out in rows of `factor` samples, otherwise over
+    the phases, each being a convolution of every `factor`-th sample.
+    The output `m` is the filter's output for the input sample `m * factor`.
+    """
+    def __init__(self, taps, factor, dtype=np.complex64):
+        self.factor = factor
+        self.phase_taps = -(-len(taps) // factor)
+        padded = np.zeros(self.phase_taps * factor, dtype=np.float32)
+        padded[:len(taps)] = taps
+
+        if self.phase_taps < factor:
+            # for each tap of the phases, the factors of a row of input samples
+            self.rows = [padded[q * factor:(q + 1) * factor][::-1].astype(dtype)
+                         for q in range(self.phase_taps)]
+        else:
+            self.phases = [padded[r::factor].copy() for r in range(factor)]
+
+        self.history = _History(len(padded) - 1, dtype)
+        self.out = np.zeros(0, dtype=dtype)
+        self.term = np.zeros(0, dtype=dtype)
+
+    def process(self, samples):
+        factor, ntaps = self.factor, self.phase_taps
+        buf = self.history.append(samples)
+        nout = (len(buf) - ntaps * factor) // factor + 1 if len(buf) >= ntaps * factor else 0
+
+        self.out = _grown(self.out, nout)
+        out = self.out[:nout]
+        out[:] = 0
+
+        if nout and ntaps < factor:
+            self.term = _grown(self.term, nout)
+            term = self.term[:nout]
+            rows = buf[:(nout + ntaps - 1) * factor].reshape(-1, factor)
+
+            for q in range(ntaps):
+                np.dot(rows[ntaps - 1 - q:ntaps - 1 - q + nout], self.rows[q], out=term)
+                out += term
+        elif nout:
+            for r in range(factor):
+                out += np.convolve(buf[factor - 1 - r::factor][:nout + ntaps - 1],
+                                   self.phases[r], mode='valid')
+
+        self.history.consume(nout * factor)
+        return out
+
+class FIRInterpolator:
+    """Polyphase interpolator, `factor` output samples for every input sample
+
+    Equivalent to filtering the input with `factor - 1` zeros inserted after
+    every sample, without multiplying the zeros. For the signal to keep its
+    amplitude, the taps should sum up to `factor`.
+
+    The `factor` outputs of an input sample are a row of a matrix product:
+    the input laid out in overlapping rows of `len(taps) / factor` samples
+    times the matrix of the taps of the phases. With up to MATRIX_TAPS taps
+    per phase, the product is taken directly, with the rows copied into
+    a preallocated buffer, otherwise the phases are applied by overlap-save
+    FFT convolution, one forward transform for all of them. The plan of the
+    transforms is the instance's own, rebuilt only when a block needs more
+    segments than it holds.
+    """
+    MATRIX_TAPS = 32
+
+    def __init__(self, taps, factor, dtype=np.complex64):
+        self.factor = factor
+        self.phase_taps = phase_taps = -(-len(taps) // factor)
+        padded = np.zeros(phase_taps * factor, dtype=np.float32)
+        padded[:len(taps)] = taps
+        # the taps of the phases in columns, last tap first
+        phases = padded.reshape(phase_taps, factor)[::-1]
+
+        if phase_taps <= self.MATRIX_TAPS:
+            self.matrix = phases.astype(dtype)
+            self.rows = np.zeros(0, dtype=dtype)
+        else:
+            self.matrix = None
+            self.nfft = max(256, 1 << int(math.ceil(math.log(4 * phase_taps, 2))))
+            self.step = self.nfft - phase_taps + 1
+            response = np.zeros((factor, self.nfft), dtype=np.complex64)
+            response[:, :phase_taps] = phases[::-1].T
+            # scaled by the inverse transform's 1 / nfft, done here once
+            self.response = (np.fft.fft(response, axis=1) / self.nfft).astype(np.complex64)
+            self.segments = np.zeros(0, dtype=np.complex64)
+            self.plan = None
+
+        self.history = _History(phase_taps - 1, dtype)
+        self.out = np.zeros(0, dtype=dtype)
+
+    def process(self, samples):
+        n = len(samples)
+        buf = self.history.append(samples)
+
+        if self.matrix is not None:
+            out = self.process_matrix(buf, n)
+        else:
+            out = self.process_fft(buf, n)
+
+        self.history.consume(n)
+        return out
+
+    def process_matrix(self, buf, n):
+        ntaps, factor = self.phase_taps, self.factor
+        self.rows = _grown(self.rows, n * ntaps)
+        rows = self.rows[:n * ntaps].reshape(n, ntaps)
+        rows[...] = np.lib.stride_tricks.as_strided(buf, (n, ntaps), (buf.itemsize,) * 2)
+
+        self.out = _grown(self.out, n * factor)
+        out = self.out[:n * factor]
+        np.dot(rows, self.matrix, out=out.reshape(n, factor))
+        return out
+
+    def process_fft(self, buf, n):
+        ntaps, factor, nfft, step = self.phase_taps, self.factor, self.nfft, self.step
+        # whole segments, the input past the end taken as zeros
+        nseg = -(-n // step)
+        self.segments = _grown(self.segments, nseg * step + ntaps - 1)
+        segments = self.segments[:nseg * step + ntaps - 1]
+        segments[:len(buf)] = buf
+        segments[len(buf):] = 0
+
+        if self.plan is None or len(self.plan.input) < nseg:
+            self.plan = pysdr.fft.new_plan(nfft, batch=nseg)
+            self.spectra = np.zeros((nseg, nfft), dtype=np.complex64)
+
+        # rows of the plan past `nseg` are left over from larger blocks
+        plan, spectra = self.plan, self.spectra
+        plan.input[:nseg] = np.lib.stride_tricks.as_strided(segments, (nseg, nfft),
+                                                            (step * segments.itemsize,
+                                                             segments.itemsize))
+        spectra[...] = plan()
+
+        self.out = _grown(self.out, nseg * step * factor)
+        out = self.out[:nseg * step * factor].reshape(nseg, step, factor)
+
+        for p in range(factor):
+            # the inverse transform as the conjugate of the forward one
+            np.multiply(spectra, self.response[p], out=plan.input)
+            np.conjugate(plan.input, out=plan.input)
+            np.conjugate(plan()[:nseg, ntaps - 1:], out=out[:, :, p])
+
+        return self.out[:n * factor]
+
+class OverlapSaveFIR:
+    """FIR filter computed by FFT over segments of `nfft` samples (overlap-save)
+
+    Each segment yields `nfft - len(taps) + 1` output samples for two FFTs
+    of `nfft` samples, which costs less than direct convolution once the filter
+    is longer than some tens of taps. The output comes in whole segments,
+    so it can be shorter or longer than the block of input. The transforms
+    go through `pysdr.fft` plans, taken in the calling thread.
+    """
+    def __init__(self, taps, nfft=None):
+        ntaps = len(taps)
+
+        if nfft is None:
+            nfft = max(1024, 1 << int(math.ceil(math.log(4 * ntaps, 2))))
+
+        if nfft < ntaps:
+            raise ValueError("FFT of %d samples is shorter than %d taps" % (nfft, ntaps))
+
+        self.nfft = nfft
+        self.ntaps = ntaps
+        self.step = nfft - ntaps + 1
+        padded = np.zeros(nfft, dtype=np.complex64)
+        padded[:ntaps] = taps
+        # scaled by the inverse transform's 1 / nfft, done here once
+        self.response = (np.fft.fft(padded) / nfft).astype(np.complex64)
+
+        self.history = _History(ntaps - 1, np.complex64)
+        self.out = np.zeros(0, dtype=np.complex64)
+
+    def process(self, samples):
+        buf = self.history.append(samples)
+        nseg = (len(buf) - self.nfft) // self.step + 1 if len(buf) >= self.nfft else 0
+        self.out = _grown(self.out, nseg * self.step)
+        plan = pysdr.fft.plan(self.nfft)
+
+        for s in range(nseg):
+            plan.input[:] = buf[s * self.step:s * self.step + self.nfft]
+            spectrum = plan()
+
+            # the inverse transform as the conjugate of the forward one
+            np.multiply(spectrum, self.response, out=plan.input)
+            np.conjugate(plan.input, out=plan.input)
+            np.conjugate(plan()[self.ntaps - 1:],
+                         out=self.out[s * self.step:(s + 1) * self.step])
+
+        self.history.consume(nseg * self.step)
+        return self.out[:nseg * self.step]
+
+class NCO:
+    """Numerically controlled oscillator mixing a signal down by `freq`
+
+    The phase carries over between blocks and over changes of the frequency,
+    so retuning doesn't leave a discontinuity in the mixed signal.
+    """
+    def __init__(self, sample_rate, freq=0.0):
+        self.sample_rate = sample_rate
+        self.phase = 0.0
+        self.ramp = np.zeros(0)
+        self.phases = np.zeros(0)
+        self.osc = np.zeros(0, dtype=np.complex64)
+        self.out = np.zeros(0, dtype=np.complex64)
+        self.tune(freq)
+
+    def tune(self, freq):
+        self.freq = freq
+        self.step = -2 * math.pi * freq / self.sample_rate
+
+    def process(self, samples):
+        n = len(samples)
+        # taken once, the frequency can be changed from another thread
+        step = self.step
+
+        if len(self.ramp) < n:
+            self.ramp = np.arange(n, dtype=np.float64)
+            self.phases = np.zeros(n)
+            self.osc = np.zeros(n, dtype=np.complex64)
+            self.out = np.zeros(n, dtype=np.complex64)
+
+        phases = np.multiply(self.ramp[:n], step, out=self.phases[:n])
+        phases += self.phase
+        osc = self.osc[:n]
+        np.cos(phases, out=osc.real)
+        np.sin(phases, out=osc.imag)
+
+        self.phase = (self.phase + step * n) % (2 * math.pi)
+        return np.multiply(samples, osc, out=self.out[:n])
+
+class DDC:
+    """Digital down-converter, shifting `freq` to zero and decimating by `decimation`
+
+    The lowpass before the decimation has `taps_per_phase` taps for each
+    of the `decimation` phases and cuts off at the edges of the decimated
+    band.
+    """
+    def __init__(self, sample_rate, freq, decimation, taps_per_phase=16):
+        self.sample_rate = sample_rate
+        self.decimation = decimation
+        self.nco = NCO(sample_rate, freq)
+        self.decimator = FIRDecimator(lowpass(decimation * taps_per_phase, 0.5 / decimation),
+                                      decimation)
+
+    def tune(self, freq):
+        self.nco.tune(freq)
+
+    def process(self, samples):
+        return self.decimator.process(self.nco.process(samples))
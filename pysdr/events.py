@@ -1,9 +1,8 @@
-import traceback
-import sys
-
 from OpenGL.GL import *
 
 from pysdr.graph import *
+from pysdr.detector import MIDIEventGatherer
+import pysdr.detector as detector
 
 class EventMarker:
     def __init__(self, viewer, mark_color=None):
@@ -43,7 +42,7 @@ class EventMarker:
             glColor4f(1.0, 1.0, 1.0, 1.0)
             self.viewer.overlay.draw_text(xb, ya, desc)
 
-    def on_texture_insert(self):
+    def on_texture_insert(self, nrows):
         self.marks = [(a, b, c, d) for (a, b, c, d) in self.marks \
                       if b[1] > self.viewer.texture_row - self.viewer.multitexture.get_height()]
 
@@ -82,7 +81,11 @@ class TemporalPlot(PlotLine):
                                                 self.title)
 
     def set(self, row, value):
-        self.data[row % self.points] = value
+        """Set the value at `row`, or the values of the rows from `row` on to an array"""
+        if np.ndim(value):
+            self.data[np.arange(row, row + len(value)) % self.points] = value
+        else:
+            self.data[row % self.points] = value
 
 class TemporalFreqPlot(TemporalPlot):
     def __init__(self, viewer, title):
@@ -102,64 +105,24 @@ class TemporalFreqPlot(TemporalPlot):
                               self.viewer.texture_row - 1)
         glPopMatrix()
 
-SCRIPT_API_METHODS = dict()
-
-class DetectorScript:
-    def script_api(func):
-        SCRIPT_API_METHODS[func.func_name] = func
-
-    @script_api
-    def peak(self, a, b, s):
-        bin = np.argmax(s[a:b])
-        return (s[bin], bin + a)
-
-    @script_api
-    def noise(self, a):
-        return np.sort(a)[len(a) / 4] * 2
+class ScriptPlots:
+    """Plots of a detector script, drawn over the waterfall"""
+    def __init__(self):
+        self.plots = dict()
+        self.plot_x_offset = 100
 
-    @script_api
-    def plot(self, name, value):
+    def plot_at(self, row, name, value):
         if not name in self.plots:
             self.plots[name] = TemporalPlot(self.viewer, self.plot_x_offset, name)
             self.plot_x_offset = self.plot_x_offset + 120
 
-        self.plots[name].set(self.viewer.process_row, value)
+        self.plots[name].set(row, value)
 
-    @script_api
-    def plot_bin(self, name, value):
+    def plot_bin_at(self, row, name, value):
         if not name in self.plots:
             self.plots[name] = TemporalFreqPlot(self.viewer, name)
 
-        self.plots[name].set(self.viewer.process_row, (float(value) / self.viewer.bins) * 2 - 1)
-
-    @script_api
-    def plot_freq(self, name, value):
-        self.namespace['plot_bin'](name, self.viewer.freq_to_bin(value))
-
-    @script_api
-    def emit_event(self, event_id, payload):
-        [l.on_event(event_id, payload) for l in self.listeners]
-
-    def __init__(self, viewer, listeners, args):
-        self.viewer = viewer
-        self.filename = args[0]
-        self.plots = dict()
-        self.plot_x_offset = 100
-        self.disabled = False
-
-        self.listeners = listeners
-
-        self.namespace = {
-            'args': args[1:],
-            'freq2bin': self.viewer.freq_to_bin,
-            'bin2freq': self.viewer.bin_to_freq,
-            'row_duration': self.viewer.row_duration
-        }
-
-        for name, func in SCRIPT_API_METHODS.items():
-            self.namespace[name] = func.__get__(self, DetectorScript)
-
-        execfile(self.filename, self.namespace)
+        self.plots[name].set(row, np.divide(value, float(self.viewer.bins)) * 2 - 1)
 
     def draw_screen(self):
         for plot in self.plots.values():
@@ -171,46 +134,26 @@ class DetectorScript:
             if hasattr(plot.__class__, 'draw_content'):
                 plot.draw_content()
 
-    def on_lin_spectrum(self, spectrum):
-        self.call_script_pass('lin_spectrum_pass', spectrum)
-
-    def on_log_spectrum(self, spectrum):
-        self.call_script_pass('log_spectrum_pass', spectrum)
-
-    def call_script_pass(self, name, spectrum):
-        if name not in self.namespace or self.disabled:
-            return
-
-        try:
-            self.namespace[name](self.viewer.process_row, spectrum)
-        except Exception:
-            print "exception in %s, disabling:" % self.filename
-            traceback.print_exc(file=sys.stdout)
-            self.disabled = True
-
-class MIDIEventGatherer:
-    def __init__(self, viewer, listeners):
-        self.viewer = viewer
-        self.listeners = listeners
+class DetectorScript(ScriptPlots, detector.DetectorScript):
+    """DetectorScript drawing the plots of the script"""
+    def __init__(self, viewer, listeners, args):
+        ScriptPlots.__init__(self)
+        detector.DetectorScript.__init__(self, viewer, listeners, args)
 
-    def on_log_spectrum(self, spectrum):
-        for frame, message in self.viewer.sig_input.get_midi_events():
-            if len(message) > 3 and message[0:2] == "\xf0\x7d" and message[-1] == "\xf7":
-                try:
-                    event_id, payload = message[2:-1].split(':', 1)
-                    payload = tuple(payload.split(','))
+    def plot(self, name, value):
+        self.plot_at(self.viewer.process_row, name, value)
 
-                    if event_id.startswith('mlab.aabb_event.'):
-                        rel_frame_a, rel_frame_b, freq_a, freq_b, desc = payload
+    def plot_bin(self, name, value):
+        self.plot_bin_at(self.viewer.process_row, name, value)
 
-                        row_range = tuple([(frame + int(x)) / (self.viewer.bins - self.viewer.overlap)
-                                           for x in (rel_frame_a, rel_frame_b)])
-                        bin_range = tuple([self.viewer.freq_to_bin(float(x)) for x in (freq_a, freq_b)])
+class DetectorProcess(ScriptPlots, detector.DetectorProcess):
+    """DetectorProcess drawing the plots of the script"""
+    def __init__(self, viewer, listeners, args, timeout=10.0):
+        ScriptPlots.__init__(self)
+        detector.DetectorProcess.__init__(self, viewer, listeners, args, timeout=timeout)
 
-                        payload = row_range + bin_range + (desc,)
+    def on_plot(self, row, name, value):
+        self.plot_at(row, name, value)
 
-                    [l.on_event(event_id, payload) for l in self.listeners]
-                except (ValueError, TypeError) as e:
-                    print "failed to parse MIDI message '%s': %s" % (message[2:-1], e)
-            else:
-                print "unknown MIDI message at frame %d: %s" % (frame, message.encode("hex"))
+    def on_plot_bin(self, row, name, value):
+        self.plot_bin_at(row, name, value)
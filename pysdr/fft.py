@@ -0,0 +1,197 @@
+"""FFT backends with cached plans
+
+The backend is picked on import from the ones available, preferring pyFFTW,
+then scipy.fftpack and falling back to numpy.fft. `select_backend` forces
+a particular one, e.g. for benchmarking.
+
+Two ways of computing transforms are offered. `plan` returns a reusable
+transform with preallocated input and output buffers for streaming use,
+plans are cached per (size, dtype, batch) and per thread, since a plan must
+not be executed from two threads at once. `new_plan` returns an uncached
+one, for callers whose batch varies. `fft` and `rfft` are one-off calls
+which do not keep any buffers around.
+
+Real input (float32) is transformed with a real-input FFT, its output then
+holds only the `n // 2 + 1` non-negative frequencies.
+"""
+
+import threading
+import numpy as np
+
+BACKEND_NAMES = ['pyfftw', 'scipy', 'numpy']
+
+def _out_shape(n, batch, real):
+    m = n // 2 + 1 if real else n
+    return (m,) if batch is None else (batch, m)
+
+def _is_real(dtype):
+    return np.dtype(dtype).kind == 'f'
+
+def _out_dtype(dtype):
+    return np.result_type(np.dtype(dtype), np.complex64)
+
+class NumpyPlan:
+    def __init__(self, n, dtype, batch, threads):
+        self.real = _is_real(dtype)
+        self.input = np.zeros((n,) if batch is None else (batch, n), dtype=dtype)
+        self.output = np.zeros(_out_shape(n, batch, self.real), dtype=_out_dtype(dtype))
+
+    def __call__(self):
+        if self.real:
+            self.output[...] = np.fft.rfft(self.input, axis=-1)
+        else:
+            self.output[...] = np.fft.fft(self.input, axis=-1)
+
+        return self.output
+
+class NumpyBackend:
+    name = 'numpy'
+    # the module whose import tells whether the backend is available
+    requires = 'numpy.fft'
+    plan_class = NumpyPlan
+
+    def __init__(self, threads=1):
+        self.threads = threads
+
+    def fft(self, x, axis=-1):
+        return np.fft.fft(x, axis=axis)
+
+    def rfft(self, x, axis=-1):
+        return np.fft.rfft(x, axis=axis)
+
+class ScipyPlan(NumpyPlan):
+    """Plan computing complex transforms by scipy.fftpack
+
+    scipy.fftpack has no real-input FFT in numpy's layout, nor threads,
+    real input is left to numpy.fft.
+    """
+    def __init__(self, n, dtype, batch, threads):
+        import scipy.fftpack
+        NumpyPlan.__init__(self, n, dtype, batch, threads)
+        self.module = scipy.fftpack
+
+    def __call__(self):
+        if self.real:
+            self.output[...] = np.fft.rfft(self.input, axis=-1)
+        else:
+            self.output[...] = self.module.fft(self.input, axis=-1)
+
+        return self.output
+
+class ScipyBackend(NumpyBackend):
+    name = 'scipy'
+    requires = 'scipy.fftpack'
+    plan_class = ScipyPlan
+
+    def __init__(self, threads=1):
+        import scipy.fftpack
+        NumpyBackend.__init__(self, threads)
+        self.module = scipy.fftpack
+
+    def fft(self, x, axis=-1):
+        return self.module.fft(x, axis=axis)
+
+class FFTWPlan:
+    def __init__(self, n, dtype, batch, threads):
+        import pyfftw
+
+        self.real = _is_real(dtype)
+        self.input = pyfftw.empty_aligned((n,) if batch is None else (batch, n), dtype=dtype)
+        self.output = pyfftw.empty_aligned(_out_shape(n, batch, self.real),
+                                           dtype=_out_dtype(dtype))
+        # planning with FFTW_MEASURE scribbles over the buffers
+        self.fftw = pyfftw.FFTW(self.input, self.output, axes=(-1,),
+                                direction='FFTW_FORWARD', flags=('FFTW_MEASURE',),
+                                threads=threads)
+        self.input[...] = 0
+
+    def __call__(self):
+        self.fftw()
+        return self.output
+
+class FFTWBackend(NumpyBackend):
+    name = 'pyfftw'
+    requires = 'pyfftw.interfaces.numpy_fft'
+    plan_class = FFTWPlan
+
+    def __init__(self, threads=1):
+        import pyfftw.interfaces.numpy_fft
+        import pyfftw.interfaces.cache
+        NumpyBackend.__init__(self, threads)
+        self.module = pyfftw.interfaces.numpy_fft
+        pyfftw.interfaces.cache.enable()
+
+    def fft(self, x, axis=-1):
+        return self.module.fft(x, axis=axis, threads=self.threads)
+
+    def rfft(self, x, axis=-1):
+        return self.module.rfft(x, axis=axis, threads=self.threads)
+
+BACKENDS = {
+    'pyfftw': FFTWBackend,
+    'scipy': ScipyBackend,
+    'numpy': NumpyBackend,
+}
+
+_backend = None
+_plans = threading.local()
+
+def available_backends():
+    """Return the names of the backends whose modules can be imported"""
+    names = []
+
+    for name in BACKEND_NAMES:
+        try:
+            __import__(BACKENDS[name].requires)
+            names.append(name)
+        except ImportError:
+            pass
+
+    return names
+
+def select_backend(name=None, threads=1):
+    """Select the FFT backend by name, or the first available one if `name` is None"""
+    global _backend
+
+    if name is not None and name not in BACKENDS:
+        raise ValueError("unknown FFT backend '%s'" % name)
+
+    for candidate in ([name] if name is not None else BACKEND_NAMES):
+        try:
+            _backend = BACKENDS[candidate](threads)
+            break
+        except ImportError:
+            if name is not None:
+                raise
+
+    _plans.__dict__.clear()
+    return _backend
+
+def get_backend():
+    return _backend
+
+def plan(n, dtype=np.complex64, batch=None):
+    """Return a cached plan for transforming `batch` rows of `n` samples
+
+    The input is to be written into `plan.input`, calling the plan computes
+    the transform and returns `plan.output`.
+    """
+    cache = _plans.__dict__.setdefault('cache', {})
+    key = (_backend.name, _backend.threads, n, np.dtype(dtype), batch)
+
+    if key not in cache:
+        cache[key] = _backend.plan_class(n, dtype, batch, _backend.threads)
+
+    return cache[key]
+
+def new_plan(n, dtype=np.complex64, batch=None):
+    """Return a plan like `plan` does, but a new one, left to the caller to keep"""
+    return _backend.plan_class(n, dtype, batch, _backend.threads)
+
+def fft(x, axis=-1):
+    return _backend.fft(x, axis=axis)
+
+def rfft(x, axis=-1):
+    return _backend.rfft(x, axis=axis)
+
+select_backend()
@@ -1,4 +1,5 @@
 import math
+import ctypes
 import numpy as np
 
 from OpenGL.GL import *
@@ -50,9 +51,16 @@ class PlotLine:
         glDisableClientState(GL_VERTEX_ARRAY)
 
 class MultiTexture():
-    """Abstracting grid of textures"""
+    """Abstracting grid of textures
+
+    Rows can be inserted one at a time by `insert`, or in blocks by
+    `insert_block`, which stages the block in one of a ring of `pbo_count`
+    pixel buffer objects, so that the transfer to the textures proceeds
+    asynchronously. Without pixel buffer objects (OpenGL < 2.1), blocks are
+    uploaded from client memory.
+    """
     def __init__(self, unit_width, unit_height, units_x, units_y,
-                 format=GL_RGB, type=GL_BYTE):
+                 format=GL_RGB, type=GL_BYTE, pbo_count=3, internal_format=None):
         self.unit_width = unit_width
         self.unit_height = unit_height
 
@@ -74,9 +82,20 @@ class MultiTexture():
             glBindTexture(GL_TEXTURE_2D, self.textures[i])
             glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
             glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-            glTexImage2D(GL_TEXTURE_2D, 0, format, self.unit_width,
+            glTexImage2D(GL_TEXTURE_2D, 0, internal_format or format, self.unit_width,
                          self.unit_height, 0, format, type, init_image)
 
+        try:
+            self.pbos = glGenBuffers(pbo_count) if bool(glGenBuffers) else None
+        except GLError:
+            self.pbos = None
+
+        if self.pbos is not None and not isinstance(self.pbos, np.ndarray):
+            self.pbos = [self.pbos]
+
+        self.pbo_sizes = [0] * pbo_count
+        self.pbo_next = 0
+
     def get_width(self):
         return self.units_x * self.unit_width
 
@@ -86,6 +105,9 @@ class MultiTexture():
     def __del__(self):
         glDeleteTextures(self.textures)
 
+        if self.pbos is not None:
+            glDeleteBuffers(len(self.pbos), self.pbos)
+
     def insert(self, y, line, format=GL_RGBA, type=GL_UNSIGNED_INT_8_8_8_8):
         if y > self.units_y * self.unit_height:
             raise Error("out of bounds")
@@ -98,6 +120,95 @@ class MultiTexture():
             glTexSubImage2D(GL_TEXTURE_2D, 0, 0, offset_y, self.unit_width, 1, format, type,
                             line[x * self.unit_width:(x + 1) * self.unit_width])
 
+    def block_segments(self, y, nrows):
+        """Split `nrows` rows inserted at `y` into runs within a single unit row
+
+        Returns a list of (block offset, unit row, offset in unit, number of
+        rows), with the rows wrapping around the bottom edge to the top.
+        """
+        height = self.get_height()
+        segments = []
+        pos = 0
+
+        while pos < nrows:
+            y %= height
+            unit_y, offset_y = divmod(y, self.unit_height)
+            count = min(nrows - pos, self.unit_height - offset_y)
+            segments.append((pos, unit_y, offset_y, count))
+            pos += count
+            y += count
+
+        return segments
+
+    def unit_columns(self, x, rotate):
+        """Return the runs of block columns making up unit column `x`
+
+        Texture column c is taken from block column (c + rotate) modulo
+        the width, the runs are given as (column in unit, block column, count).
+        """
+        width = self.get_width()
+        start = (x * self.unit_width + rotate) % width
+        first = min(self.unit_width, width - start)
+        runs = [(0, start, first)]
+
+        if first < self.unit_width:
+            runs.append((first, 0, self.unit_width - first))
+
+        return runs
+
+    def insert_block(self, y, block, format=GL_RGBA, type=GL_UNSIGNED_INT_8_8_8_8, rotate=0):
+        """Insert the rows of the 2-D array `block` starting at row `y`
+
+        A block taller than the whole texture only has its last rows inserted.
+        With `rotate` given, the columns are rotated left by that many on the way,
+        e.g. by half of the width to turn FFT output order into centered
+        frequencies, at no extra cost.
+        """
+        if len(block) > self.get_height():
+            y += len(block) - self.get_height()
+            block = block[-self.get_height():]
+
+        block = np.ascontiguousarray(block)
+        segments = self.block_segments(y, len(block))
+        row_bytes = block.strides[0]
+
+        if self.pbos is None:
+            for pos, unit_y, offset_y, count in segments:
+                for x in xrange(self.units_x):
+                    glBindTexture(GL_TEXTURE_2D, self.textures[unit_y * self.units_x + x])
+
+                    for offset_x, column, ncols in self.unit_columns(x, rotate):
+                        glTexSubImage2D(GL_TEXTURE_2D, 0, offset_x, offset_y, ncols, count,
+                                        format, type, np.ascontiguousarray(
+                                            block[pos:pos + count, column:column + ncols]))
+            return
+
+        # stage the block in the next buffer of the ring, orphaning its old
+        # storage, which might be still in use by a previous transfer, the
+        # sub-image calls then read the units out of the buffer with
+        # GL_UNPACK_ROW_LENGTH skipping over the other units
+        i = self.pbo_next
+        self.pbo_next = (i + 1) % len(self.pbos)
+        self.pbo_sizes[i] = max(self.pbo_sizes[i], block.nbytes)
+
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, self.pbos[i])
+        glBufferData(GL_PIXEL_UNPACK_BUFFER, self.pbo_sizes[i], None, GL_STREAM_DRAW)
+        glBufferSubData(GL_PIXEL_UNPACK_BUFFER, 0, block.nbytes, block)
+
+        glPixelStorei(GL_UNPACK_ROW_LENGTH, block.shape[1])
+
+        for pos, unit_y, offset_y, count in segments:
+            for x in xrange(self.units_x):
+                glBindTexture(GL_TEXTURE_2D, self.textures[unit_y * self.units_x + x])
+
+                for offset_x, column, ncols in self.unit_columns(x, rotate):
+                    offset = pos * row_bytes + column * block.itemsize
+                    glTexSubImage2D(GL_TEXTURE_2D, 0, offset_x, offset_y, ncols, count,
+                                    format, type, ctypes.c_void_p(offset))
+
+        glPixelStorei(GL_UNPACK_ROW_LENGTH, 0)
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
+
     def draw(self):
         glEnable(GL_TEXTURE_2D)
         glColor3f(1.0, 1.0, 1.0)
@@ -121,6 +232,39 @@ class MultiTexture():
 
         glDisable(GL_TEXTURE_2D)
 
+    def draw_rows(self, a, b):
+        """Draw rows a...b of the texture, without wrapping, over the unit square"""
+        glEnable(GL_TEXTURE_2D)
+        glColor3f(1.0, 1.0, 1.0)
+
+        for y in xrange(self.units_y):
+            ua = max(a, y * self.unit_height)
+            ub = min(b, (y + 1) * self.unit_height)
+
+            if ua >= ub:
+                continue
+
+            tya = float(ua - y * self.unit_height) / self.unit_height
+            tyb = float(ub - y * self.unit_height) / self.unit_height
+            ya, yb = float(ua - a) / (b - a), float(ub - a) / (b - a)
+
+            for x in xrange(self.units_x):
+                glBindTexture(GL_TEXTURE_2D, self.textures[self.units_x * y + x])
+                xa, xb = (float(x) / self.units_x), (float(x + 1) / self.units_x)
+
+                glBegin(GL_QUADS)
+                glTexCoord2f(0, tya)
+                glVertex2f(xa, ya)
+                glTexCoord2f(0, tyb)
+                glVertex2f(xa, yb)
+                glTexCoord2f(1, tyb)
+                glVertex2f(xb, yb)
+                glTexCoord2f(1, tya)
+                glVertex2f(xb, ya)
+                glEnd()
+
+        glDisable(GL_TEXTURE_2D)
+
     def draw_row(self, edge, row):
         y = row - (edge / self.unit_height)
 
@@ -0,0 +1,318 @@
+#!/usr/bin/python
+
+"""Entry point of pysdr-waterfall and its headless mode
+
+With `--headless`, the signal is processed and handed to the detectors,
+the recorders and the other layers which don't draw anything, without opening
+a window. Neither this module nor the modules it imports depend on OpenGL,
+which is only imported by pysdr.waterfall once a window is asked for.
+"""
+
+import sys
+import time
+import signal
+import argparse
+
+from pysdr.input import RawSigInput, MmapSigInput, JackInput, RAW_FORMATS
+from pysdr.processor import SignalProcessor
+from pysdr.spectral import INTEGRATION_MODES
+from pysdr.detector import DetectorScript, DetectorProcess, MIDIEventGatherer
+from pysdr.rowqueue import POLICIES as QUEUE_POLICIES
+from pysdr.recording import SpectrogramRecorder
+from pysdr.snapshot import SnapshotRecorder, SNAPSHOT_FORMATS
+import pysdr.fft
+
+# the keys of pysdr.waterfall.TEXTURE_FORMATS
+TEXTURE_FORMAT_NAMES = ['r16f', 'r32f', 'r8']
+
+class EventPrinter:
+    """Layer printing the events on the standard output, one per line
+
+    Lines give the UTC time, the event id and the payload separated by
+    commas. The time is that of the first row of an `mlab.aabb_event.*`,
+    or the time of printing for other events.
+    """
+    def __init__(self, viewer):
+        self.viewer = viewer
+
+    def on_event(self, event_id, payload):
+        if event_id.startswith('mlab.aabb_event.'):
+            t = self.viewer.start_time + payload[0] * self.viewer.row_duration
+        else:
+            t = time.time()
+
+        print "%s.%03d %s %s" % (time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(t)),
+                                 int(t * 1000) % 1000, event_id,
+                                 ",".join(str(x) for x in payload))
+        sys.stdout.flush()
+
+class HeadlessProcessor(SignalProcessor):
+    def run(self, report=10.0):
+        """Process the input until it ends, or until the detector scripts have all
+        finished, reporting the throughput every `report` seconds"""
+        self.start()
+        last_time, last_row = time.time(), 0
+
+        while self.process_thread.is_alive():
+            # waiting with a timeout, so that signals get handled
+            self.process_thread.join(report or 1.0)
+
+            if self.detectors_finished():
+                return
+
+            if not report:
+                continue
+
+            now, row = time.time(), self.process_row
+            rate = (row - last_row) / (now - last_time)
+            sys.stderr.write("%s: %d rows, %.1f rows/s (%.2fx real-time)\n"
+                             % (self.sig_input, row, rate, rate * self.row_duration))
+
+            for text in self.layers_status():
+                sys.stderr.write("  %s\n" % text)
+            last_time, last_row = now, row
+
+    def detectors_finished(self):
+        detectors = [l for l in self.layers if isinstance(l, (DetectorScript, DetectorProcess))]
+        return bool(detectors) and all(d.finished for d in detectors)
+
+def make_parser():
+    parser = argparse.ArgumentParser(description='Plot live spectral waterfall of a quadrature signal.')
+    parser.add_argument('-b', '--bins', type=int, default=4096,
+                        help='number of FFT bins (default: %(default)s)')
+    parser.add_argument('-H', '--height', type=float, default=0,
+                        help='minimal height of the waterfall in seconds \
+                                (default corresponds to 1024 windows)')
+    parser.add_argument('-o', '--overlap', type=float,
+                        help='overlap between consecutive windows as a proportion \
+                                of the number of bins (default: 0.75, or 0 with --pfb)')
+    parser.add_argument('--pfb', metavar='TAPS', type=int, default=1,
+                        help='compute the spectra by a polyphase filter bank with \
+                                the given number of taps per bin instead of a Hann \
+                                window, for flat channels with less leakage \
+                                (default: %(default)s, i.e. no filter bank)')
+    parser.add_argument('--integrate', metavar='K', type=int, default=1,
+                        help='integrate K consecutive spectra into a single row \
+                                before display and detection, for weak signals \
+                                (default: %(default)s)')
+    parser.add_argument('--integrate-mode', choices=INTEGRATION_MODES, default='mean',
+                        help='how to integrate the spectra: mean power (mean), \
+                                exponential moving average of the power (ema), \
+                                maximum (max) or median (median) (default: %(default)s)')
+    parser.add_argument('-B', '--batch', metavar='N', type=int, default=1,
+                        help='number of consecutive windows to transform in a single \
+                                FFT call and hand over to the display as one block, \
+                                higher values lower the per-row overhead at high \
+                                sample-rates (default: %(default)s)')
+    parser.add_argument('-w', '--workers', metavar='N', type=int, default=1,
+                        help='number of threads computing the spectra, blocks of \
+                                windows are spread over the threads and put back \
+                                in order afterwards (default: %(default)s)')
+    parser.add_argument('--fft-backend', metavar='NAME', choices=pysdr.fft.BACKEND_NAMES,
+                        help='force the given FFT backend, one of %s \
+                                (by default, the fastest one available)'
+                                % ', '.join(pysdr.fft.BACKEND_NAMES))
+    parser.add_argument('--fft-threads', metavar='N', type=int, default=1,
+                        help='number of threads used by a single FFT, \
+                                if supported by the backend (default: %(default)s)')
+    parser.add_argument('--fps', type=float, default=60,
+                        help='maximal number of redraws per second, rows arriving \
+                                in between are displayed together, zero for no limit, \
+                                the delay of the rows shown is given in the status \
+                                line (default: %(default)s)')
+    parser.add_argument('--gpu-log', action='store_true',
+                        help='upload linear magnitudes and leave taking their \
+                                logarithm, scaling and reordering the bins to the GPU, \
+                                requires float textures (OpenGL 3.0)')
+    parser.add_argument('-T', '--texture-format', choices=TEXTURE_FORMAT_NAMES,
+                        default='r32f',
+                        help='storage of the waterfall in the GPU memory: 32-bit floats \
+                                (r32f), 16-bit floats (r16f) or 8-bit integers (r8), \
+                                the narrower formats allow for a higher --height \
+                                (default: %(default)s)')
+    parser.add_argument('--scrollback', metavar='SECONDS', type=float, default=0,
+                        help='keep this many seconds of the waterfall in a file, \
+                                so that it can be scrolled back to past the height \
+                                of the waterfall, as 16-bit floats or with r8 as \
+                                8-bit integers (default: %(default)s)')
+    parser.add_argument('--scrollback-file', metavar='FILENAME',
+                        help='file in which to keep the scrollback (by default, \
+                                a temporary file)')
+    parser.add_argument('--record', metavar='DIR',
+                        help='record the spectrogram into the given directory, \
+                                which can be opened by pysdr-recviewer; \
+                                an existing recording is appended to')
+    parser.add_argument('--record-limit', metavar='MB', type=int,
+                        help='size limit of the spectrogram recording in megabytes, \
+                                beyond which the oldest parts are deleted \
+                                (by default, no limit)')
+    parser.add_argument('--snapshots', metavar='DIR',
+                        help='keep the last --snapshot-buffer seconds of the signal \
+                                in memory and dump the part around each event \
+                                emitted by a detector into the given directory')
+    parser.add_argument('--snapshot-pre', metavar='SECONDS', type=float, default=2.0,
+                        help='length of the signal before an event to include \
+                                in its snapshot (default: %(default)s)')
+    parser.add_argument('--snapshot-post', metavar='SECONDS', type=float, default=5.0,
+                        help='length of the signal after an event to include \
+                                in its snapshot (default: %(default)s)')
+    parser.add_argument('--snapshot-buffer', metavar='SECONDS', type=float, default=10.0,
+                        help='length of the signal kept in memory, which bounds \
+                                how far back from its emission an event can reach, \
+                                at least --snapshot-pre plus --snapshot-post \
+                                (default: %(default)s)')
+    parser.add_argument('--snapshot-format', choices=SNAPSHOT_FORMATS, default='wav',
+                        help='format of the snapshots: WAV files (wav) or raw \
+                                interleaved 32-bit floats (cf32) (default: %(default)s)')
+    parser.add_argument('--snapshot-quota', metavar='MB', type=int,
+                        help='size limit of the snapshots in megabytes, beyond \
+                                which the oldest ones are deleted (by default, no limit)')
+    parser.add_argument('-q', '--queue-rows', metavar='N', type=int, default=4096,
+                        help='maximal number of rows waiting to be displayed \
+                                (default: %(default)s)')
+    parser.add_argument('--queue-policy', choices=QUEUE_POLICIES, default='block',
+                        help='what to do when the display falls behind by more \
+                                than --queue-rows rows: stall the signal processing \
+                                (block), drop the oldest rows (drop) or merge pending \
+                                rows in pairs by maximum (decimate) \
+                                (default: %(default)s)')
+    parser.add_argument('--headless', action='store_true',
+                        help='run without a window, only the detectors, recording \
+                                and snapshots, events are printed on the standard \
+                                output (doesn\'t need OpenGL)')
+    parser.add_argument('--report', metavar='SECONDS', type=float, default=10.0,
+                        help='in the headless mode, interval of reporting the number \
+                                of rows processed per second on the standard error, \
+                                zero for none (default: %(default)s)')
+    parser.add_argument('-j', '--jack', metavar='NAME', default='pysdr',
+                        help='feed signal from JACK and use the given client name \
+                                (by default, with name \'pysdr\')')
+    parser.add_argument('-r', '--raw', metavar='RATE', type=int,
+                        help='feed signal from the standard input, expects 2 channel \
+                                interleaved floats with the given sample-rate')
+    parser.add_argument('-i', '--input', metavar='FILENAME',
+                        help='replay a recording, either a WAV file or a raw file \
+                                of samples in the format given by --format, \
+                                for which the sample-rate has to be given by --raw')
+    parser.add_argument('-S', '--speed', type=float, default=1.0,
+                        help='speed of replaying a recording relative to real-time, \
+                                zero for as fast as possible (default: %(default)s)')
+    parser.add_argument('-f', '--format', choices=sorted(RAW_FORMATS.keys()), default='cf32',
+                        help='format of the samples on the standard input or in a raw recording: \
+                                interleaved 32-bit floats (cf32), signed 16-bit \
+                                or 8-bit integers (cs16, cs8) or unsigned 8-bit \
+                                integers (cu8) (default: %(default)s)')
+    parser.add_argument('-d', '--detector', metavar='ARGS', action='append',
+                        help='attach the given detector script, \
+                                expects to be given the script filename \
+                                followed by arguments for the script, \
+                                all joined by spaces and passed on the command-line \
+                                as one quoted argument')
+    parser.add_argument('--isolate-detectors', action='store_true',
+                        help='run each detector script in a process of its own, \
+                                so that a slow or failing script doesn\'t hold up \
+                                the rest, scripts which exit or get stuck are restarted')
+    parser.add_argument('--detector-timeout', metavar='SECONDS', type=float, default=10.0,
+                        help='with --isolate-detectors, time after which a script \
+                                which hasn\'t finished a block is considered stuck \
+                                (default: %(default)s)')
+    parser.add_argument('-p', '--persfn', metavar='FILENAME',
+                        help='a file in which to preserve the visualization parameters \
+                                that come from interactive manipulation, \
+                                i.e. the visible area of the waterfall \
+                                and the selected magnitude range \
+                                (save triggered by pressing \'p\')')
+
+    return parser
+
+def open_input(args):
+    """Check the arguments and open the input, returns (input, overlapping bins)"""
+    if args.overlap is None:
+        args.overlap = 0.75 if args.pfb == 1 else 0.0
+
+    overlap_bins = int(args.bins * args.overlap)
+
+    if not (overlap_bins >= 0 and overlap_bins < args.bins):
+        raise ValueError("number of overlapping bins is out of bounds")
+
+    if args.pfb < 1:
+        raise ValueError("number of filter bank taps must be at least 1")
+
+    if args.integrate < 1:
+        raise ValueError("number of integrated spectra must be at least 1")
+
+    if args.batch < 1:
+        raise ValueError("batch size must be at least 1")
+
+    if args.workers < 1:
+        raise ValueError("number of workers must be at least 1")
+
+    pysdr.fft.select_backend(args.fft_backend, threads=args.fft_threads)
+
+    if args.input is not None:
+        sig_input = MmapSigInput(args.input, sample_rate=args.raw, format=args.format,
+                                 speed=args.speed)
+    elif args.raw is not None:
+        sig_input = RawSigInput(args.raw, 2, RAW_FORMATS[args.format], sys.stdin)
+    else:
+        sig_input = JackInput(args.jack)
+
+    return (sig_input, overlap_bins)
+
+def attach_layers(processor, args, listeners, detector_class=DetectorScript,
+                  process_class=DetectorProcess):
+    """Attach the layers common to both modes, with events passed on to `listeners`
+
+    Detector scripts are run by `detector_class`, or by `process_class` with
+    --isolate-detectors.
+    """
+    listeners = list(listeners)
+
+    if args.snapshots:
+        snapshots = SnapshotRecorder(processor, args.snapshots, pre=args.snapshot_pre,
+                                     post=args.snapshot_post, buffer=args.snapshot_buffer,
+                                     format=args.snapshot_format,
+                                     quota=args.snapshot_quota and args.snapshot_quota << 20)
+        processor.layers.append(snapshots)
+        listeners.append(snapshots)
+
+    if args.detector and args.isolate_detectors:
+        detectors = [process_class(processor, listeners, a.split(),
+                                   timeout=args.detector_timeout)
+                     for a in args.detector]
+    else:
+        detectors = [detector_class(processor, listeners, a.split())
+                     for a in args.detector or []]
+
+    # scripts get each other's events, for their tasks waiting on them
+    processor.layers += detectors
+    listeners += [d for d in detectors if hasattr(d.__class__, 'on_event')]
+
+    if isinstance(processor.sig_input, JackInput):
+        processor.layers.append(MIDIEventGatherer(processor, listeners))
+
+    if args.record:
+        processor.layers.append(SpectrogramRecorder(processor, args.record,
+                                                    limit=args.record_limit and args.record_limit << 20))
+
+def main():
+    args = make_parser().parse_args()
+
+    if not args.headless:
+        from pysdr.waterfall import main as window_main
+        window_main(args)
+        return
+
+    signal.signal(signal.SIGINT, lambda a, b: sys.exit(0))
+
+    sig_input, overlap_bins = open_input(args)
+    processor = HeadlessProcessor(sig_input, args.bins, overlap=overlap_bins,
+                                  batch=args.batch, workers=args.workers, taps=args.pfb,
+                                  integrate=args.integrate, integrate_mode=args.integrate_mode)
+    printer = EventPrinter(processor)
+    processor.layers.append(printer)
+    attach_layers(processor, args, [printer])
+    processor.run(report=args.report)
+
+if __name__ == "__main__":
+    main()
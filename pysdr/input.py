@@ -1,10 +1,43 @@
 import numpy as np
 import time
 import sys
+import os.path
 
-import pysdr.ext as ext
+try:
+    import pysdr.ext as ext
+except ImportError:
+    # the binary extension is only needed for JACK input
+    ext = None
+
+# formats of raw interleaved I/Q samples, by the names used by rtl_sdr, hackrf and others
+RAW_FORMATS = {
+    'cf32': np.dtype(np.float32),
+    'cs16': np.dtype(np.int16),
+    'cs8': np.dtype(np.int8),
+    'cu8': np.dtype(np.uint8),
+}
+
+def convert_samples(samples, out):
+    """Convert samples into the float32 array `out`, scaling integers to [-1, 1)"""
+    dtype = samples.dtype
+
+    if dtype.kind == 'u':
+        offset = float(1 << (dtype.itemsize * 8 - 1)) - 0.5
+        scale = 1.0 / (offset + 0.5)
+    elif dtype.kind == 'i':
+        offset, scale = 0.0, 1.0 / (1 << (dtype.itemsize * 8 - 1))
+    else:
+        offset, scale = 0.0, 1.0
+
+    np.subtract(samples, np.float32(offset), out=out, casting='unsafe')
+
+    if scale != 1.0:
+        out *= np.float32(scale)
 
 class SigInput:
+    # whether read() returns real-valued samples instead of complex ones
+    is_real = False
+
     def __init__(self):
         self.sample_rate = 0
         self.no_channels = 0
@@ -12,29 +45,68 @@ class SigInput:
     def read(self, frames):
         raise NotImplementedError("read() method must be overrided")
 
+    def read_into(self, out):
+        """Fill `out` with the next `len(out)` frames"""
+        out[:] = self.read(len(out))
+
     def start(self):
         raise NotImplementedError("start() method must be overrided")
 
 class RawSigInput(SigInput):
     def __init__(self, sample_rate, no_channels, dtype, file):
+        if no_channels not in (1, 2):
+            raise NotImplementedError("unimplemented no of channels")
+
+        if dtype.kind not in 'iuf':
+            raise NotImplementedError("unimplemented sample type")
+
         self.sample_rate = sample_rate
         self.no_channels = no_channels
         self.dtype = dtype
         self.file = file
+        self.is_real = no_channels == 1
+        # integer samples are read into a scratch buffer and converted from there
+        self.scratch = np.zeros(0, dtype=np.uint8)
 
-    def read(self, frames):
-        read_len = frames * self.dtype.itemsize * self.no_channels
-        string = ""
+    def readinto_fully(self, buf):
+        """Fill the byte array `buf` from the file, retrying on short reads"""
+        pos, nbytes = 0, len(buf)
+        readinto = getattr(self.file, 'readinto', None)
 
-        while len(string) < read_len:
-            string += self.file.read(read_len - len(string))
+        while pos < nbytes:
+            if readinto is not None:
+                n = readinto(buf[pos:])
+            else:
+                chunk = self.file.read(nbytes - pos)
+                n = len(chunk)
+                buf[pos:pos + n] = np.frombuffer(chunk, dtype=np.uint8)
 
-        if self.no_channels == 1:
-            return np.fromstring(string, dtype=self.dtype).astype(np.float32)
-        elif self.no_channels == 2 and self.dtype == np.dtype(np.float32):
-            return np.fromstring(string, dtype=np.complex64)
-        else:
-            raise NotImplementedError("unimplemented no of channels and type combination")
+            if not n:
+                raise EOFError("end of input")
+
+            pos += n
+
+    def read_into(self, out):
+        if out.dtype != (np.float32 if self.is_real else np.complex64):
+            raise ValueError("unexpected output type %s" % out.dtype)
+
+        if self.dtype == np.dtype(np.float32):
+            self.readinto_fully(out.view(np.uint8))
+            return
+
+        nbytes = len(out) * self.dtype.itemsize * self.no_channels
+        if len(self.scratch) < nbytes:
+            self.scratch = np.zeros(nbytes, dtype=np.uint8)
+
+        raw = self.scratch[:nbytes]
+        self.readinto_fully(raw)
+
+        convert_samples(raw.view(self.dtype), out.view(np.float32))
+
+    def read(self, frames):
+        out = np.zeros(frames, dtype=np.float32 if self.is_real else np.complex64)
+        self.read_into(out)
+        return out
 
     def start(self):
         pass
@@ -42,8 +114,136 @@ class RawSigInput(SigInput):
     def __str__(self):
         return "raw input from '%s'" % self.file.name
 
+class MmapSigInput(SigInput):
+    """Input replayed from a recording which is memory-mapped instead of read
+
+    Raw files of interleaved I/Q samples in one of RAW_FORMATS, WAV files
+    (one channel for a real signal, two for I/Q) and FITS files as produced by
+    Radio Observer are supported. For 32-bit float recordings `read` returns
+    views into the mapping without copying.
+
+    Besides being read as a stream, the recording can be sliced as an array
+    of complex (or real) samples, e.g. `recording[a:b]`.
+
+    The replay is throttled to `speed` times real-time, with a `speed` of zero
+    it goes as fast as the consumer reads.
+    """
+    def __init__(self, filename, sample_rate=None, format='cf32', speed=1.0):
+        self.filename = filename
+        suffix = os.path.splitext(filename)[1].lower()
+
+        if suffix == ".wav":
+            import scipy.io.wavfile
+
+            self.sample_rate, data = scipy.io.wavfile.read(filename, mmap=True)
+
+            if data.ndim == 1:
+                self.no_channels = 1
+            elif data.shape[1] <= 2:
+                self.no_channels = data.shape[1]
+            else:
+                raise NotImplementedError("unimplemented no of channels")
+        elif suffix == ".fits":
+            import pyfits
+            img = pyfits.open(filename, memmap=True)[0]
+
+            if int(img.header["NAXIS"]) != 2:
+                raise Exception("expecting a two dimensional image")
+
+            size = [img.header["NAXIS%d" % (i,)] for i in [1, 2]]
+
+            if size[0] % 2 != 0:
+                raise Exception("width %d is not a multiple of 2" % (size[0],))
+
+            self.sample_rate = sample_rate or 48000
+            self.no_channels = 2
+            data = np.ravel(img.data)
+        else:
+            if sample_rate is None:
+                raise ValueError("sample rate of a raw recording must be given")
+
+            self.sample_rate = sample_rate
+            self.no_channels = 2
+            data = np.memmap(filename, dtype=RAW_FORMATS[format], mode='r')
+
+        self.is_real = self.no_channels == 1
+        self.samples = data.reshape(-1, self.no_channels)
+
+        if data.dtype == np.dtype(np.float32) and not self.is_real:
+            self.samples = self.samples.view(np.complex64).reshape(-1)
+        elif self.is_real:
+            self.samples = self.samples.reshape(-1)
+
+        self.speed = speed
+        self.seek(0)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def seek(self, sample):
+        self.pos = max(0, min(len(self.samples), int(sample)))
+        self.throttle_ref = (time.time(), self.pos)
+
+    def tell(self):
+        return self.pos
+
+    def throttle(self, until):
+        if not self.speed:
+            return
+
+        ref_time, ref_pos = self.throttle_ref
+        delay = ref_time + float(until - ref_pos) / (self.sample_rate * self.speed) - time.time()
+
+        if delay > 0:
+            time.sleep(delay)
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise TypeError("recordings can only be sliced contiguously")
+
+        samples = self.samples[key]
+
+        if samples.dtype in (np.dtype(np.float32), np.dtype(np.complex64)):
+            return samples
+
+        out = np.zeros(len(samples), dtype=np.float32 if self.is_real else np.complex64)
+        convert_samples(samples, out.view(np.float32).reshape(samples.shape))
+        return out
+
+    def advance(self, frames):
+        pos = self.pos
+
+        if pos + frames > len(self.samples):
+            raise EOFError("end of recording")
+
+        self.throttle(pos + frames)
+        self.pos = pos + frames
+        return pos
+
+    def read(self, frames):
+        pos = self.advance(frames)
+        return self[pos:pos + frames]
+
+    def read_into(self, out):
+        pos = self.advance(len(out))
+        samples = self.samples[pos:pos + len(out)]
+
+        if samples.dtype == out.dtype:
+            out[:] = samples
+        else:
+            convert_samples(samples, out.view(np.float32).reshape(samples.shape))
+
+    def start(self):
+        self.seek(self.pos)
+
+    def __str__(self):
+        return "recording '%s'" % self.filename
+
 class JackInput(SigInput):
     def __init__(self, name):
+        if ext is None:
+            raise ImportError("JACK input needs the pysdr.ext extension to be built")
+
         self.name = name
         self.handle = ext.jack_init(name)
         self.sample_rate = ext.jack_get_sample_rate(self.handle)
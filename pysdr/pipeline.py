@@ -0,0 +1,144 @@
+import threading
+import Queue
+import numpy as np
+
+from pysdr.spectral import SpectralEngine, frames_view
+
+class _Slot:
+    """Preallocated buffers for one block of rows in flight"""
+    def __init__(self, bins, history, batch, hop, dtype):
+        self.samples = np.zeros(history + hop * batch, dtype=dtype)
+        self.lin = np.zeros((batch, bins), dtype=np.float32)
+        self.log = np.zeros((batch, bins), dtype=np.float32)
+        self.seq = None
+
+class SpectralPipeline:
+    """Spectral processing spread over a pool of FFT worker threads
+
+    A reader thread cuts the input into hop-aligned blocks of `batch` rows
+    (plus the overlap, or the history of a polyphase filter bank of `taps`
+    taps, carried over from the previous block) and hands them to
+    `workers` threads, each with its own SpectralEngine. The numpy ufuncs and
+    the FFT backends release the GIL, so the workers run in parallel. Finished
+    blocks are put back in order and passed to `consumer(lin, log)` from
+    a single dispatch thread, i.e. the consumer sees the rows in the same order
+    and from one thread as it would with serial processing.
+
+    If given, `sample_consumer(samples)` is called from the dispatch thread
+    with the samples read for each block, just before the block's spectra.
+
+    With `log` unset, the consumer gets None in place of the log spectra and
+    `shift` is passed on to the engines.
+
+    The number of blocks in flight is bounded by a pool of preallocated slots,
+    if the consumer falls behind the reader stalls.
+    """
+    def __init__(self, sig_input, bins, overlap, batch, workers, window, consumer,
+                 shift=True, log=True, sample_consumer=None, taps=1):
+        self.sig_input = sig_input
+        self.bins = bins
+        self.overlap = overlap
+        self.taps = taps
+        self.history = overlap + (taps - 1) * bins
+        self.batch = batch
+        self.hop = bins - overlap
+        self.window = window
+        self.consumer = consumer
+        self.sample_consumer = sample_consumer
+        self.shift = shift
+        self.log = log
+
+        dtype = np.float32 if sig_input.is_real else np.complex64
+        self.nslots = 2 * workers + 1
+        self.free_slots = Queue.Queue()
+        for i in xrange(self.nslots):
+            self.free_slots.put(_Slot(bins, self.history, batch, self.hop, dtype))
+
+        self.jobs = Queue.Queue()
+        self.results = Queue.Queue()
+        self.running = True
+
+        self.threads = [threading.Thread(target=self.work) for i in xrange(workers)]
+        self.threads.append(threading.Thread(target=self.dispatch))
+
+        for thread in self.threads:
+            thread.setDaemon(True)
+
+    def work(self):
+        engine = SpectralEngine(self.bins, self.window, batch=self.batch,
+                                real=self.sig_input.is_real, shift=self.shift,
+                                taps=self.taps)
+
+        while True:
+            slot = self.jobs.get()
+
+            if slot is None:
+                return
+
+            frames = frames_view(slot.samples, self.taps * self.bins, self.hop, self.batch)
+            engine.process_block(frames, out=slot.lin)
+
+            if self.log:
+                engine.log_spectrum_block(out=slot.log)
+            self.results.put(slot)
+
+    def dispatch(self):
+        pending = dict()
+        next_seq = 0
+
+        while True:
+            slot = self.results.get()
+
+            if slot is None:
+                return
+
+            pending[slot.seq] = slot
+
+            while next_seq in pending:
+                slot = pending.pop(next_seq)
+
+                if self.sample_consumer is not None:
+                    self.sample_consumer(slot.samples[self.history:])
+
+                self.consumer(slot.lin, slot.log if self.log else None)
+                self.free_slots.put(slot)
+                next_seq += 1
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        """Read the input and feed the workers until `stop` is called or the input ends"""
+        for thread in self.threads:
+            thread.start()
+
+        tail = np.zeros(self.history, dtype=np.float32 if self.sig_input.is_real
+                                                   else np.complex64)
+        seq = 0
+
+        while self.running:
+            slot = self.free_slots.get()
+            slot.samples[0:self.history] = tail
+
+            try:
+                self.sig_input.read_into(slot.samples[self.history:])
+            except EOFError:
+                self.free_slots.put(slot)
+                break
+
+            tail[:] = slot.samples[len(slot.samples) - self.history:]
+
+            slot.seq = seq
+            seq += 1
+            self.jobs.put(slot)
+
+        # wait for the blocks in flight to be dispatched, then shut down
+        for i in xrange(self.nslots):
+            self.free_slots.get()
+
+        for i in xrange(len(self.threads) - 1):
+            self.jobs.put(None)
+        self.results.put(None)
+
+        for thread in self.threads:
+            thread.join()
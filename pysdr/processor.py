@@ -0,0 +1,199 @@
+import threading
+import time
+import numpy as np
+
+from pysdr.spectral import SpectralEngine, SpectralIntegrator, BandReducer, hann_window, \
+                           pfb_window, frames_view
+from pysdr.pipeline import SpectralPipeline
+
+class SignalProcessor:
+    """Signal processing shared by the waterfall and the headless mode
+
+    The input is read, cut into windows and transformed on the processing
+    thread (or by a SpectralPipeline with more than one worker), and the
+    samples and spectra are handed to the layers:
+
+     - `on_samples(samples)` with the samples read,
+     - `on_raw_spectrum`, `on_lin_spectrum` and `on_log_spectrum` with each
+       spectrum, or with blocks of them in the `_block` variants,
+
+    with `process_row` being the number of the (first) row at hand. Layers
+    tell each other about events through `on_event(event_id, payload)`.
+
+    With `taps` above one, the spectra come from a polyphase filter bank,
+    see SpectralEngine, each row then also covers `taps - 1` frames of `bins`
+    samples before its usual window.
+
+    With `integrate` above one, groups of that many consecutive spectra are
+    integrated into single rows as given by `integrate_mode`, see
+    SpectralIntegrator, before they reach the layers. Rows are then counted
+    after the integration, as is `row_duration`, and `row_hop` is the number
+    of samples between consecutive rows.
+
+    With `shift` unset, the bins of complex signals are left in the FFT order
+    and with `log` unset, no logarithm is taken, in which case the centered
+    and logarithmic spectra are only computed if some layer asks for them.
+    This module doesn't depend on OpenGL.
+    """
+    def __init__(self, sig_input, bins, overlap=0, start_time=None, batch=1, workers=1,
+                 shift=True, log=True, taps=1, integrate=1, integrate_mode='mean'):
+        self.sig_input = sig_input
+        self.bins = bins
+        self.taps = taps
+        self.window = hann_window(bins) if taps == 1 else pfb_window(bins, taps)
+        self.overlap = overlap
+        # samples of the previous rows needed by the next one
+        self.history = overlap + (taps - 1) * bins
+        self.batch = batch
+        self.workers = workers
+        self.engine = None
+        self.integrate = integrate
+        self.row_hop = (bins - overlap) * integrate
+        self.row_duration = float(self.row_hop) / sig_input.sample_rate
+        self.start_time = time.time() if start_time is None else start_time
+
+        self.shift = shift
+        self.log = log
+        self.rotate = bins / 2 if not shift and not sig_input.is_real else 0
+        self.shift_index = np.concatenate((np.arange(bins / 2, bins), np.arange(0, bins / 2)))
+
+        self.layers = [self]
+        self.process_row = 0
+
+        if integrate > 1:
+            self.integrator = SpectralIntegrator(bins, integrate, integrate_mode, batch)
+        else:
+            self.integrator = None
+        # with the integration, the log spectra are taken of the integrated rows
+        self.engine_log = log and self.integrator is None
+        # bands of bins whose statistics the layers share, see BandReducer
+        self.bands = BandReducer()
+
+        self.process_thread = threading.Thread(target=self.process)
+        self.process_thread.setDaemon(True)
+
+    def start(self):
+        self.sig_input.start()
+        self.process_thread.start()
+
+    def call_layers(self, method, args=()):
+        for layer in list(self.layers):
+            if hasattr(layer.__class__, method):
+                getattr(layer, method)(*args)
+
+    def get_layer(self, type):
+        l = [l for l in self.layers if isinstance(l, type)]
+        return l[0] if len(l) else None
+
+    def layers_status(self):
+        """Return the status lines of the other layers which have any"""
+        return [layer.status() for layer in self.layers
+                if layer is not self and hasattr(layer.__class__, 'status')]
+
+    def freq_to_bin(self, freq):
+        return int(freq * self.bins / self.sig_input.sample_rate + self.bins / 2)
+
+    def bin_to_freq(self, bin):
+        return float(bin - self.bins / 2) / self.bins * self.sig_input.sample_rate
+
+    def call_layers_block(self, method, block):
+        """Hand a block of spectra to the layers
+
+        Layers implementing `<method>_block` get the whole block at once, the
+        others get it replayed row by row through `<method>` with `process_row`
+        advanced accordingly.
+        """
+        base_row = self.process_row
+
+        for layer in list(self.layers):
+            if hasattr(layer.__class__, method + '_block'):
+                getattr(layer, method + '_block')(block)
+            elif hasattr(layer.__class__, method):
+                for i in xrange(len(block)):
+                    self.process_row = base_row + i
+                    getattr(layer, method)(block[i])
+                self.process_row = base_row
+
+    def layers_want(self, method):
+        return any(hasattr(layer.__class__, method) or hasattr(layer.__class__, method + '_block')
+                   for layer in self.layers)
+
+    def dispatch_samples(self, samples):
+        """Hand the samples read to the layers, before the spectra computed from them"""
+        self.call_layers('on_samples', (samples,))
+
+    def dispatch_spectra(self, lin, log):
+        """Hand a block of spectra to the layers, then to `emit_rows`
+
+        Without `log`, `log` is None and `lin` might be in the FFT order.
+        Layers indifferent to the order of bins can implement `on_raw_spectrum`
+        to get `lin` as it is.
+
+        With the integration, the block is first integrated, which may leave
+        no rows to hand over.
+        """
+        if self.integrator is not None:
+            lin = self.integrator.push(lin)
+
+            if not len(lin):
+                return
+
+            log = self.integrator.log_spectrum_block() if self.log else None
+
+        self.call_layers_block('on_raw_spectrum', lin)
+        raw = lin
+
+        if log is None:
+            if self.layers_want('on_lin_spectrum') or self.layers_want('on_log_spectrum'):
+                lin = np.take(raw, self.shift_index, axis=1) if self.rotate else raw
+                log = np.log10(lin)
+                log *= 10
+                self.call_layers_block('on_lin_spectrum', lin)
+                self.call_layers_block('on_log_spectrum', log)
+        else:
+            self.call_layers_block('on_lin_spectrum', lin)
+            self.call_layers_block('on_log_spectrum', log)
+
+        self.emit_rows(raw, log)
+        self.process_row = self.process_row + len(raw)
+
+    def emit_rows(self, raw, log):
+        """Called with every block of spectra once the layers are done with it"""
+        pass
+
+    def process(self):
+        if self.workers > 1:
+            SpectralPipeline(self.sig_input, self.bins, self.overlap, self.batch,
+                             self.workers, self.window, self.dispatch_spectra,
+                             shift=self.shift, log=self.engine_log, taps=self.taps,
+                             sample_consumer=self.dispatch_samples).run()
+            return
+
+        self.engine = SpectralEngine(self.bins, self.window, batch=self.batch,
+                                     real=self.sig_input.is_real, shift=self.shift,
+                                     taps=self.taps)
+        hop = self.bins - self.overlap
+        readsize = hop * self.batch
+        history = self.history
+        ringbuf = np.zeros(max(self.bins * 4, history + readsize * 2),
+                           dtype=np.float32 if self.sig_input.is_real else np.complex64)
+        ringbuf_edge = max(self.bins, history)
+
+        while True:
+            if (ringbuf_edge + readsize > len(ringbuf)):
+                ringbuf[0:history] = ringbuf[ringbuf_edge - history:ringbuf_edge]
+                ringbuf_edge = history
+
+            try:
+                self.sig_input.read_into(ringbuf[ringbuf_edge:ringbuf_edge + readsize])
+            except EOFError:
+                return
+            ringbuf_edge += readsize
+            self.dispatch_samples(ringbuf[ringbuf_edge - readsize:ringbuf_edge])
+
+            frames = frames_view(ringbuf[ringbuf_edge - readsize - history:ringbuf_edge],
+                                 self.taps * self.bins, hop, self.batch)
+
+            lin = self.engine.process_block(frames)
+            log = self.engine.log_spectrum_block() if self.engine_log else None
+            self.dispatch_spectra(lin, log)
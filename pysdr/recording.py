@@ -0,0 +1,258 @@
+"""Spectrogram recordings, made of compressed chunks of rows with a time index
+
+A recording is a directory holding
+
+ - `meta.json` with the number of bins, the sample-rate, the duration
+   of a row, the number of samples between rows (`row_hop`) and how many
+   samples the window of a row reaches back before its first new sample
+   (`history`, covering the overlap and the frames of a polyphase filter
+   bank),
+ - chunks of consecutive rows of the log spectrum in dB, stored as float16
+   in compressed .npz files along with the UTC timestamps of the rows, which
+   are those of their first new samples,
+ - `index.npy`, listing the chunks with their first row, number of rows and
+   the timestamps of their first and last row.
+
+Rows are numbered across the chunks of the recording, a recording made over
+several runs continues the numbering, while the timestamps can jump.
+"""
+
+import os
+import json
+import atexit
+import threading
+import Queue
+import numpy as np
+
+INDEX_DTYPE = np.dtype([('first_row', np.int64), ('rows', np.int64),
+                        ('start', np.float64), ('end', np.float64)])
+
+def _chunk_name(first_row):
+    return "%012d.npz" % first_row
+
+def _save_atomically(path, save):
+    with open(path + ".tmp", "wb") as f:
+        save(f)
+    os.rename(path + ".tmp", path)
+
+def _read_index(path):
+    try:
+        return np.load(os.path.join(path, "index.npy"))
+    except IOError:
+        return np.zeros(0, dtype=INDEX_DTYPE)
+
+class SpectrogramRecorder:
+    """Layer appending the log spectra shown by the waterfall to a recording
+
+    Rows are collected into chunks of `chunk_rows` rows, which are compressed
+    and written by a thread of their own. Once the chunks take more than
+    `limit` bytes, the oldest ones are deleted. An existing recording is
+    appended to only if its rows have the same bins and timing, otherwise
+    ValueError is raised.
+    """
+    def __init__(self, viewer, path, chunk_rows=1024, limit=None):
+        self.viewer = viewer
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.limit = limit
+
+        meta = {
+            'bins': viewer.bins,
+            'sample_rate': viewer.sig_input.sample_rate,
+            'row_duration': viewer.row_duration,
+            'row_hop': viewer.row_hop,
+            'history': viewer.history,
+        }
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        meta_path = os.path.join(path, "meta.json")
+
+        if os.path.exists(meta_path):
+            old_meta = json.load(open(meta_path))
+
+            # rows appended have to keep the timing of those recorded,
+            # recordings of older versions don't have all of the keys
+            for key in ('bins', 'sample_rate', 'row_duration', 'row_hop', 'history'):
+                if key in old_meta and old_meta[key] != meta[key]:
+                    raise ValueError("recording '%s' has %s of %s, not %s"
+                                     % (path, key, old_meta[key], meta[key]))
+        else:
+            _save_atomically(meta_path, lambda f: json.dump(meta, f, indent=4))
+
+        self.index = _read_index(path)
+        self.next_row = int(self.index['first_row'][-1] + self.index['rows'][-1]) \
+                            if len(self.index) else 0
+
+        self.new_chunk()
+        self.chunks = Queue.Queue()
+        self.thread = threading.Thread(target=self.write_chunks)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def new_chunk(self):
+        self.rows = np.zeros((self.chunk_rows, self.viewer.bins), dtype=np.float16)
+        self.times = np.zeros(self.chunk_rows, dtype=np.float64)
+        self.filled = 0
+
+    def on_log_spectrum_block(self, block):
+        viewer = self.viewer
+        pos = 0
+
+        while pos < len(block):
+            n = min(len(block) - pos, self.chunk_rows - self.filled)
+            row = viewer.process_row + pos
+            self.rows[self.filled:self.filled + n] = block[pos:pos + n]
+            self.times[self.filled:self.filled + n] = viewer.start_time \
+                + (row + np.arange(n)) * viewer.row_duration
+            self.filled += n
+            pos += n
+
+            if self.filled == self.chunk_rows:
+                self.flush()
+
+    def flush(self):
+        """Hand the rows collected so far over to the writer thread"""
+        if self.filled:
+            self.chunks.put((self.next_row, self.rows[:self.filled], self.times[:self.filled]))
+            self.next_row += self.filled
+            self.new_chunk()
+
+    def close(self):
+        """Write out the rows collected so far and stop the writer thread"""
+        self.flush()
+        self.chunks.put(None)
+        self.thread.join()
+
+    def write_chunks(self):
+        while True:
+            chunk = self.chunks.get()
+
+            if chunk is None:
+                return
+
+            first_row, rows, times = chunk
+
+            _save_atomically(os.path.join(self.path, _chunk_name(first_row)),
+                             lambda f: np.savez_compressed(f, rows=rows, times=times))
+
+            entry = np.array([(first_row, len(rows), times[0], times[-1])], dtype=INDEX_DTYPE)
+            self.index = np.concatenate((self.index, entry))
+            removed = self.apply_limit()
+
+            # the index is rewritten before any chunks go
+            _save_atomically(os.path.join(self.path, "index.npy"),
+                             lambda f: np.save(f, self.index))
+
+            for first_row in removed:
+                try:
+                    os.remove(os.path.join(self.path, _chunk_name(first_row)))
+                except OSError:
+                    pass
+
+    def apply_limit(self):
+        """Drop the oldest chunks over the size limit from the index and return them"""
+        if self.limit is None:
+            return []
+
+        sizes = [os.path.getsize(os.path.join(self.path, _chunk_name(r)))
+                 for r in self.index['first_row']]
+        drop = 0
+
+        while drop < len(sizes) - 1 and sum(sizes[drop:]) > self.limit:
+            drop += 1
+
+        removed, self.index = self.index['first_row'][:drop], self.index[drop:]
+        return removed
+
+class SpectrogramReader:
+    """Read access to a recording made by SpectrogramRecorder
+
+    Rows can be looked up by their number, relative to the first row still
+    in the recording, or by time.
+    """
+    def __init__(self, path):
+        self.path = path
+        meta = json.load(open(os.path.join(path, "meta.json")))
+        self.bins = meta['bins']
+        self.sample_rate = meta['sample_rate']
+        self.row_duration = meta['row_duration']
+        self.index = _read_index(path)
+        self.base_row = int(self.index['first_row'][0]) if len(self.index) else 0
+        self.cached = (None, None)
+
+    def __len__(self):
+        if not len(self.index):
+            return 0
+
+        return int(self.index['first_row'][-1] + self.index['rows'][-1]) - self.base_row
+
+    def chunk(self, i):
+        """Return (rows, times) of the i-th chunk"""
+        if self.cached[0] != i:
+            data = np.load(os.path.join(self.path, _chunk_name(self.index['first_row'][i])))
+            self.cached = (i, (data['rows'], data['times']))
+
+        return self.cached[1]
+
+    def rows(self, a, b):
+        """Return the rows a...b as float32 in dB, along with their timestamps"""
+        a, b = max(0, a), min(len(self), b)
+        first_rows = self.index['first_row'] - self.base_row
+        rows, times = [], []
+
+        for i in xrange(max(0, np.searchsorted(first_rows, a, side='right') - 1), len(self.index)):
+            if first_rows[i] >= b:
+                break
+
+            chunk_rows, chunk_times = self.chunk(i)
+            ca, cb = max(0, a - first_rows[i]), min(len(chunk_rows), b - first_rows[i])
+            rows.append(chunk_rows[ca:cb])
+            times.append(chunk_times[ca:cb])
+
+        if not rows:
+            return (np.zeros((0, self.bins), dtype=np.float32), np.zeros(0))
+
+        return (np.concatenate(rows).astype(np.float32), np.concatenate(times))
+
+    def time_to_row(self, t):
+        """Return the number of the first row at or after the UTC timestamp `t`"""
+        i = np.searchsorted(self.index['end'], t)
+
+        if i == len(self.index):
+            return len(self)
+
+        first_row = int(self.index['first_row'][i]) - self.base_row
+
+        if t <= self.index['start'][i]:
+            return first_row
+
+        _, times = self.chunk(i)
+        return first_row + int(np.searchsorted(times, t))
+
+    def read(self, t0, t1):
+        """Return the rows within the UTC interval t0...t1 and their timestamps"""
+        return self.rows(self.time_to_row(t0), self.time_to_row(t1))
+
+    def max_hold(self, level, rows):
+        """Return the maximum over groups of 2 ** `level` rows in the range `rows`"""
+        a, b = rows
+        group = 1 << level
+        out = np.zeros(((b - a + group - 1) / group, self.bins), dtype=np.float32)
+
+        # in steps of whole groups, of a few thousand rows
+        step = max(group, 4096 / group * group)
+
+        for pos in xrange(a, b, step):
+            block, _ = self.rows(pos, min(b, pos + step))
+
+            if not len(block):
+                break
+
+            ra = (pos - a) / group
+            out[ra:ra + (len(block) + group - 1) / group] = \
+                np.maximum.reduceat(block, np.arange(0, len(block), group), axis=0)
+
+        return out
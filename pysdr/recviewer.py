@@ -3,56 +3,255 @@
 import numpy as np
 import Queue as queue
 import threading
-import scipy.io.wavfile
 import sys
+import math
+import os
 import os.path
+import argparse
+from collections import OrderedDict
 
 from OpenGL.GL import *
 from OpenGL.GLUT import *
 
 from pysdr.waterfall import *
 from pysdr.overlay import *
-import pysdr.ext as ext
+from pysdr.input import MmapSigInput
+from pysdr.spectral import SpectralEngine, frames_view
+from pysdr.recording import SpectrogramReader
 
 class AsyncWorker(threading.Thread):
+    """Background thread running one job at a time
+
+    A job is a generator function, the worker steps through the generator
+    and abandons it as soon as another job is set or `cancel` is called,
+    so that a job should yield after every unit of work.
+    """
     def __init__(self):
         threading.Thread.__init__(self)
-        self.daemon = False
+        self.daemon = True
         self.working = False
+        self.generation = 0
+        self.lock = threading.Lock()
         self.event = threading.Event()
         self.start()
 
     def set_work(self, func, args):
-        self.work = (func, args)
+        with self.lock:
+            self.generation += 1
+            self.work = (func, args)
         self.event.set()
 
+    def cancel(self):
+        with self.lock:
+            self.generation += 1
+            self.work = None
+
     def run(self):
         while True:
             self.event.wait()
             self.event.clear()
+
+            with self.lock:
+                work, generation = self.work, self.generation
+
+            if work is None:
+                continue
+
             self.working = True
-            (func, args) = self.work
-            func(*args)
+            (func, args) = work
+
+            for _ in func(*args):
+                if self.generation != generation:
+                    break
+
             self.working = False
 
-def waterfallize(signal, bins):
-    window = 0.5 * (1.0 - np.cos((2 * math.pi * np.arange(bins)) / bins))
-    segment = bins / 2
-    nsegments = int(len(signal) / segment)
-    m = np.repeat(np.reshape(signal[0:segment * nsegments], (nsegments, segment)), 2, axis=0)
-    t = np.reshape(m[1:len(m) - 1], (nsegments - 1, bins))
-    img = np.multiply(t, window)
-    wf = np.log(np.abs(np.fft.fft(img)))
-    return np.concatenate((wf[:, bins / 2:bins], wf[:, 0:bins / 2]), axis=1)
+_pool_signal = None
+
+def _init_pool(signal):
+    global _pool_signal
+    _pool_signal = signal
+
+def _pool_waterfallize(bins, level, frames, taps):
+    return waterfallize(_pool_signal, bins, level, frames, taps)
+
+def make_pool(signal, processes):
+    """Return a process pool computing bands of the spectrogram of `signal`
+
+    The pool has to be created before any other threads are started. The
+    signal is inherited by the forked processes, not pickled.
+    """
+    import multiprocessing
+    return multiprocessing.Pool(processes, initializer=_init_pool, initargs=(signal,))
+
+# number of samples transformed at once by waterfallize
+CHUNK_SAMPLES = 1 << 20
+
+# number of samples covered by a band of rows streamed to the display
+BAND_SAMPLES = 1 << 18
+
+def nframes(nsamples, bins):
+    return max(0, (nsamples - bins) / (bins / 2) + 1)
+
+def waterfallize(signal, bins, level=0, frames=None, taps=1):
+    """Return the spectrogram of `signal` in dB, with windows overlapping by half
+
+    With `taps` above one, the spectra are computed by a polyphase filter bank
+    whose frames end where the windows would, the signal before the first
+    sample counting as zeros.
+
+    Each output row holds the maximum over 2 ** `level` consecutive windows.
+    Only the windows in the range `frames` (all of them by default) are
+    computed, in chunks of about CHUNK_SAMPLES samples, so that `signal` can be
+    a memory-mapped recording much larger than the memory.
+    """
+    hop = bins / 2
+    group = 1 << level
+    fa, fb = frames if frames is not None else (0, nframes(len(signal), bins))
+    out = np.zeros(((fb - fa + group - 1) / group, bins), dtype=np.float32)
+
+    chunk = 1 << int(math.log(max(1, CHUNK_SAMPLES / hop), 2))
+    real = signal.is_real if hasattr(signal, 'is_real') else not np.iscomplexobj(signal)
+    engine = SpectralEngine(bins, batch=chunk, real=real, taps=taps)
+    history = (taps - 1) * bins
+
+    for a in xrange(fa, fb, chunk):
+        b = min(fb, a + chunk)
+        samples = signal[max(0, a * hop - history):(b - 1) * hop + bins]
+
+        if a * hop < history:
+            samples = np.concatenate((np.zeros(history - a * hop, dtype=samples.dtype), samples))
+
+        lin = engine.process_block(frames_view(samples, taps * bins, hop, b - a))
+
+        ra, rb = (a - fa) / group, (b - 1 - fa) / group + 1
+
+        if group == 1:
+            out[ra:rb] = lin
+        else:
+            starts = [0] + [fa + r * group - a for r in xrange(ra + 1, rb)]
+            np.maximum(out[ra:rb], np.maximum.reduceat(lin, starts, axis=0), out=out[ra:rb])
+
+    np.log10(out, out=out)
+    out *= 10
+    return out
+
+class TileCache:
+    """LRU cache of spectrogram tiles within a memory budget of `budget` bytes
+
+    If `directory` is given, tiles are also stored there as .npy files and
+    looked up on a miss, so that they survive between runs. Tiles older than
+    the recording (as given by `mtime`) are considered stale. The cache is
+    shared by the GUI thread and the worker, hence the lock.
+    """
+    def __init__(self, budget, directory=None, mtime=0):
+        self.budget = budget
+        self.size = 0
+        self.tiles = OrderedDict()
+        self.lock = threading.Lock()
+        self.directory = directory
+        self.mtime = mtime
+
+    def path(self, key):
+        return os.path.join(self.directory, "%d-%d-%d.npy" % key)
+
+    def get(self, key, disk=True):
+        with self.lock:
+            tile = self.tiles.pop(key, None)
+
+            if tile is not None:
+                self.tiles[key] = tile
+                return tile
+
+        if not disk or self.directory is None:
+            return None
+
+        try:
+            path = self.path(key)
+
+            if os.path.getmtime(path) < self.mtime:
+                return None
+
+            tile = np.load(path)
+        except (IOError, OSError, ValueError):
+            return None
+
+        self.put(key, tile, store=False)
+        return tile
+
+    def put(self, key, tile, store=True):
+        with self.lock:
+            if key in self.tiles:
+                self.size -= self.tiles.pop(key).nbytes
+
+            self.tiles[key] = tile
+            self.size += tile.nbytes
+
+            while self.size > self.budget and len(self.tiles) > 1:
+                self.size -= self.tiles.popitem(last=False)[1].nbytes
+
+        if store and self.directory is not None:
+            self.store(key, tile)
+
+    def store(self, key, tile):
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+
+            # write under a temporary name so that a partial file is never loaded
+            path = self.path(key)
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, tile)
+            os.rename(path + ".tmp", path)
+        except (IOError, OSError) as e:
+            sys.stderr.write("disabling the on-disk tile store: %s\n" % e)
+            self.directory = None
+
+class _Tile:
+    """Texture of a tile being filled in by bands of rows from the top"""
+    def __init__(self, texture, ya, yb, rows):
+        self.texture = texture
+        self.ya, self.yb = ya, yb
+        self.rows = rows
+        self.filled = 0
+
+    def complete(self):
+        return self.filled == self.rows
+
+    def draw(self):
+        fraction = float(self.filled) / self.rows
+
+        glPushMatrix()
+        glTranslatef(0.0, self.yb - fraction * (self.yb - self.ya), 0.0)
+        glScalef(1.0, fraction * (self.yb - self.ya), 1.0)
+        self.texture.draw(fraction)
+        glPopMatrix()
 
 class RecordViewer(Viewer):
-    def __init__(self, signal, sample_rate=None):
+    # number of rows in a tile of the spectrogram
+    TILE_ROWS = 256
+
+    def __init__(self, signal, sample_rate=None, cache=None, pool=None, taps=1,
+                 texture_format='r32f'):
+        """Display `signal`, either a recording of samples or a SpectrogramReader
+
+        The spectrogram recordings have a fixed number of bins, their rows are
+        displayed as they are, without any FFT. Recordings of samples are
+        transformed by a polyphase filter bank of `taps` taps if above one.
+        Tiles are stored in textures of `texture_format`, one of
+        TEXTURE_FORMATS.
+        """
         Viewer.__init__(self, "Record Viewer")
+        self.spectrogram = isinstance(signal, SpectrogramReader)
 
-        if sample_rate is not None:
+        if self.spectrogram:
+            duration = len(signal) * signal.row_duration
+        elif sample_rate is not None:
             # TODO: cutting off trailing frames in waterfallize
             #       probably causes time axis to be a bit off
             duration = float(len(signal)) / sample_rate
+
+        if sample_rate is not None:
             self.layers.append(PlotAxes(self, static_axis(UNIT_HZ, sample_rate / 2,
                                                           cutoff=(-1.0, 1.0)),
                                         static_axis(UNIT_SEC, -duration, offset=duration)))
@@ -60,10 +259,23 @@ class RecordViewer(Viewer):
         glutIdleFunc(self.cb_idle)
         self.signal = signal
         self.bins = None
-        self.texture = None
-        self.new_data_event = threading.Event()
-        self.new_data = None
+        self.mag_range = None
+        self.shader = ColorMappingShader()
+
+        # tiles are keyed by (bins, level, index)
+        self.tiles = dict()
+        self.wanted = set()
+        self.shown = set()
+        self.new_tiles = queue.Queue()
+        self.cache = cache if cache is not None else TileCache(256 << 20)
+        self.pool = pool
+        self.taps = taps
+        (self.internal_format, self.texture_type,
+            self.texture_dtype) = TEXTURE_FORMATS[texture_format]
+
         self.worker = AsyncWorker()
+        # the view at the last press of a mouse button
+        self.pressed_view = None
         self.update_texture()
 
     def init(self):
@@ -71,47 +283,245 @@ class RecordViewer(Viewer):
         glEnable(GL_BLEND)
         glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
 
+    def tile_frames(self, key):
+        bins, level, index = key
+        span = self.TILE_ROWS << level
+        return (index * span, min(self.total_frames(bins), (index + 1) * span))
+
+    def total_frames(self, bins):
+        if self.spectrogram:
+            return len(self.signal)
+
+        return nframes(len(self.signal), bins)
+
+    def tile_rows(self, key):
+        bins, level, index = key
+        fa, fb = self.tile_frames(key)
+        return (fb - fa + (1 << level) - 1) >> level
+
+    def visible_tiles(self, bins):
+        """Return the keys of the tiles covering the visible part of the recording"""
+        w, h = getattr(self, 'screen_size', (640, 480))
+        total = self.total_frames(bins)
+
+        if total == 0:
+            return []
+
+        ya = min(max(self.view.from_screen(0, 0)[1], 0.0), 1.0)
+        yb = min(max(self.view.from_screen(w, h)[1], 0.0), 1.0)
+        fa = int((1.0 - yb) * total)
+        fb = max(fa + 1, min(total, int(math.ceil((1.0 - ya) * total))))
+
+        level = int(math.ceil(math.log(max(1.0, float(fb - fa) / max(h, 1)), 2)))
+        span = self.TILE_ROWS << level
+
+        return [(bins, level, i) for i in xrange(fa / span, (fb - 1) / span + 1)]
+
     def update_texture(self):
-        bins = int(int(np.sqrt(len(self.signal) / self.view.scale_y * self.view.scale_x)) / 16) * 16
-        bins = min(max(bins, 16), glGetIntegerv(GL_MAX_TEXTURE_SIZE))
+        if self.spectrogram:
+            bins = self.signal.bins
+        else:
+            bins = int(int(np.sqrt(len(self.signal) / self.view.scale_y
+                                   * self.view.scale_x)) / 16) * 16
+            bins = min(max(bins, 16), glGetIntegerv(GL_MAX_TEXTURE_SIZE))
+        self.bins = bins
+
+        wanted = self.visible_tiles(bins)
+        self.wanted = set(wanted)
+
+        for key in self.tiles.keys():
+            if key not in self.wanted and key not in self.shown:
+                del self.tiles[key]
+
+        # tiles held by the cache in memory are uploaded right away
+        for key in wanted:
+            if key not in self.tiles:
+                tile = self.cache.get(key, disk=False)
+
+                if tile is not None:
+                    self.insert_band(key, 0, tile)
+
+        self.check_complete()
+        missing = [k for k in wanted if k not in self.tiles or not self.tiles[k].complete()]
+
+        if not missing:
+            self.worker.cancel()
+            glutPostRedisplay()
+            return
+
+        self.worker.set_work(self.texture_work, (missing,))
+
+    def compute_bands(self, key):
+        """Compute the rows of a tile in bands, yielding (row, band) in order"""
+        bins, level, index = key
+        fa, fb = self.tile_frames(key)
+        # rows of a spectrogram recording count as hops of bins / 2 samples
+        hop = bins / 2
+        band_frames = max(1, BAND_SAMPLES / hop >> level) << level
+        bands = [(f, min(fb, f + band_frames)) for f in xrange(fa, fb, band_frames)]
+
+        if self.spectrogram:
+            for frames in bands:
+                yield ((frames[0] - fa) >> level, self.signal.max_hold(level, frames))
+            return
+
+        if self.pool is None:
+            for frames in bands:
+                yield ((frames[0] - fa) >> level,
+                       waterfallize(self.signal, bins, level, frames, self.taps))
+            return
+
+        # keep a few bands in flight per process, bands already submitted
+        # to the pool cannot be withdrawn when the job is cancelled
+        window = 2 * len(self.pool._pool)
+        pending = []
+
+        for frames in bands + [None] * window:
+            if frames is not None:
+                pending.append((frames, self.pool.apply_async(_pool_waterfallize,
+                                                              (bins, level, frames,
+                                                               self.taps))))
 
-        if bins == self.bins:
+            if len(pending) == window or (frames is None and pending):
+                frames, result = pending.pop(0)
+                yield ((frames[0] - fa) >> level, result.get())
+
+    def texture_work(self, keys):
+        for key in keys:
+            if key not in self.wanted:
+                continue
+
+            tile = self.cache.get(key)
+
+            if tile is None:
+                tile = self.derive_tile(key)
+
+            if tile is not None:
+                self.new_tiles.put((key, 0, tile))
+                yield
+                continue
+
+            tile = np.zeros((self.tile_rows(key), key[0]), dtype=np.float32)
+
+            for row, band in self.compute_bands(key):
+                tile[row:row + len(band)] = band
+                self.new_tiles.put((key, row, band))
+                yield
+
+            self.cache.put(key, tile)
+
+    def derive_tile(self, key):
+        """Assemble a tile from the two cached tiles of the level below, if present"""
+        bins, level, index = key
+
+        if level == 0:
+            return None
+
+        children = [(bins, level - 1, i) for i in (2 * index, 2 * index + 1)]
+        children = [k for k in children if self.tile_frames(k)[0] < self.tile_frames(k)[1]]
+        tiles = [self.cache.get(k, disk=False) for k in children]
+
+        if any(t is None for t in tiles):
+            return None
+
+        rows = np.concatenate(tiles)
+        return np.maximum.reduceat(rows, np.arange(0, len(rows), 2), axis=0)
+
+    def set_mag_range(self, tile):
+        finite = tile[np.isfinite(tile)]
+
+        if not len(finite):
             return
 
-        def texture_work(self, bins):
-            waterfall = waterfallize(self.signal, bins)
-            waterfall[np.isneginf(waterfall)] = np.nan
-            wmin, wmax = np.nanmin(waterfall), np.nanmax(waterfall)
-            waterfall = ((waterfall - wmin) / (wmax - wmin)) * 5.5 - 4.5
-            self.new_data = ext.mag2col(waterfall.astype('f'))
-            self.new_data_event.set()
+        # map the range of the tile to -4.5...1.0 on the color scale
+        wmin, wmax = np.min(finite), np.max(finite)
+        m2c_range = ColorMappingShader.M2C_RANGE
+        span = (wmax - wmin) / 5.5 * (m2c_range[1] - m2c_range[0])
+        low = wmin - (-4.5 - m2c_range[0]) / (m2c_range[1] - m2c_range[0]) * span
+        self.mag_range = (low, low + span)
 
-        self.worker.set_work(texture_work, (self, bins))
+    def view_state(self):
+        view = self.view
+        return (view.scale_x, view.scale_y, view.origin_x, view.origin_y)
 
     def on_mouse_button(self, button, state, x, y):
-        if state == GLUT_UP and button == GLUT_RIGHT_BUTTON:
-            self.update_texture()
+        # only drags which zoomed or panned the view ask for other tiles
+        if state == GLUT_DOWN:
+            self.pressed_view = self.view_state()
+        elif state == GLUT_UP and button in (GLUT_LEFT_BUTTON, GLUT_RIGHT_BUTTON):
+            if self.pressed_view != self.view_state():
+                self.update_texture()
+
+    def on_resize(self, w, h):
+        self.update_texture()
 
-    def cb_idle(self):
-        if self.new_data_event.wait(0.01):
-            self.new_data_event.clear()
+    def insert_band(self, key, row, band):
+        if self.mag_range is None:
+            self.set_mag_range(band)
+
+        if key not in self.tiles:
+            bins, level, index = key
+            fa, fb = self.tile_frames(key)
+            rows = self.tile_rows(key)
+            total = float(self.total_frames(bins))
+            fb = fa + (rows << level)
 
             try:
-                self.texture = Texture(self.new_data)
+                texture = Texture(np.zeros((rows, bins), dtype=self.texture_dtype),
+                                  internal_format=self.internal_format, format=GL_RED,
+                                  type=self.texture_type)
             except GLError:
-                pass
+                return
 
-            self.new_data = None
-            glutPostRedisplay()
+            self.tiles[key] = _Tile(texture, 1.0 - fb / total, 1.0 - fa / total, rows)
+
+        tile = self.tiles[key]
+        tile.texture.update(row, convert_texture_rows(self.shader.texture_insert_prep(band),
+                                                      self.texture_dtype))
+        tile.filled = max(tile.filled, row + len(band))
+
+    def check_complete(self):
+        if all(k in self.tiles and self.tiles[k].complete() for k in self.wanted):
+            self.shown = self.wanted
+
+            for key in self.tiles.keys():
+                if key not in self.wanted:
+                    del self.tiles[key]
+
+    def cb_idle(self):
+        try:
+            bands = [self.new_tiles.get(block=True, timeout=0.01)]
+        except queue.Empty:
+            return
+
+        try:
+            while True:
+                bands.append(self.new_tiles.get_nowait())
+        except queue.Empty:
+            pass
+
+        for key, row, band in bands:
+            if key in self.wanted:
+                self.insert_band(key, row, band)
+
+        self.check_complete()
+        glutPostRedisplay()
 
     def draw_content(self):
-        if self.texture != None:
-            glPushMatrix()
-            glTranslatef(-1.0, 0, 0)
-            glScalef(2.0, 1.0, 1.0)
-            glColor4f(1.0, 1.0, 1.0, 1.0)
-            self.texture.draw()
-            glPopMatrix()
+        if self.mag_range is None:
+            return
+
+        glPushMatrix()
+        glTranslatef(-1.0, 0, 0)
+        glScalef(2.0, 1.0, 1.0)
+        self.shader.setup(self.mag_range)
+
+        # tiles of the previous zoom level go underneath until replaced
+        for key, tile in sorted(self.tiles.items(), key=lambda a: a[0] in self.wanted):
+            tile.draw()
+
+        shaders.glUseProgram(0)
+        glPopMatrix()
 
     def draw_screen(self):
         if self.worker.working:
@@ -123,47 +533,78 @@ class RecordViewer(Viewer):
             glVertex2i(10, 20)
             glEnd()
 
-def view(signal, sample_rate=None):
+def view(signal, sample_rate=None, cache=None, pool=None, taps=1, texture_format='r32f'):
     glutInit()
     glutInitWindowSize(640, 480)
     glutInitDisplayMode(GLUT_DOUBLE | GLUT_RGBA)
 
-    record_viewer = RecordViewer(signal, sample_rate=sample_rate)
+    record_viewer = RecordViewer(signal, sample_rate=sample_rate, cache=cache, pool=pool,
+                                 taps=taps, texture_format=texture_format)
 
     glutMainLoop()
 
 def read_file(filename):
     ext = os.path.splitext(filename)[1]
 
-    if ext == ".wav":
-        import scipy.io.wavfile
-
-        (sample_rate, audio) = scipy.io.wavfile.read(filename)
-        return (sample_rate, audio[:,0] + 1j * audio[:,1])
-    elif ext == ".fits":
-        import pyfits
-        img = pyfits.open(filename)[0]
-
-        if int(img.header["NAXIS"]) != 2:
-            raise Exception("expecting a two dimensional image")
-
-        size = [img.header["NAXIS%d" % (i,)] for i in [1, 2]]
-
-        if size[0] % 2 != 0:
-            raise Exception("width %d is not a multiple of 2" % (size[0],))
-
-        flat_data = np.ravel(img.data)
-        return (48000, flat_data[0::2] + 1j * flat_data[1::2])
+    if os.path.isdir(filename):
+        recording = SpectrogramReader(filename)
+        return (recording.sample_rate, recording)
+    elif ext in (".wav", ".fits"):
+        recording = MmapSigInput(filename, speed=0)
+        return (recording.sample_rate, recording)
     else:
         raise Exception("unknown filename extension: %s" % (ext,))
 
 def main():
-    if len(sys.argv) != 2:
-        sys.stderr.write("usage: pysdr-recviewer FILENAME\n")
-        exit(1)
+    parser = argparse.ArgumentParser(description='Display the spectral waterfall of a recording.')
+    parser.add_argument('filename', metavar='FILENAME',
+                        help='recording to display, a WAV or FITS file or a directory \
+                                with a spectrogram recorded by pysdr-waterfall --record')
+    parser.add_argument('--cache-size', metavar='MB', type=int, default=256,
+                        help='memory budget of the spectrogram tile cache in megabytes \
+                                (default: %(default)s)')
+    parser.add_argument('--tile-dir', metavar='DIR',
+                        help='directory in which the computed tiles are stored for reuse \
+                                (default: FILENAME.tiles)')
+    parser.add_argument('--no-tile-store', action='store_true',
+                        help='do not store the computed tiles on disk')
+    parser.add_argument('-p', '--processes', metavar='N', type=int, default=1,
+                        help='number of processes computing the spectrogram \
+                                (default: %(default)s)')
+    parser.add_argument('--pfb', metavar='TAPS', type=int, default=1,
+                        help='compute the spectrogram by a polyphase filter bank with \
+                                the given number of taps per bin instead of a Hann \
+                                window (default: %(default)s, i.e. no filter bank)')
+    parser.add_argument('-T', '--texture-format', choices=sorted(TEXTURE_FORMATS),
+                        default='r32f',
+                        help='storage of the tiles in the GPU memory: 32-bit floats \
+                                (r32f), 16-bit floats (r16f) or 8-bit integers (r8) \
+                                (default: %(default)s)')
+
+    args = parser.parse_args()
+
+    if args.pfb < 1:
+        raise ValueError("number of filter bank taps must be at least 1")
+
+    sample_rate, signal = read_file(args.filename)
+
+    if args.no_tile_store or os.path.isdir(args.filename):
+        tile_dir = None
+    else:
+        tile_dir = args.tile_dir or args.filename + ".tiles"
+
+        # tiles of the filter bank are kept apart from those of the Hann window
+        if args.pfb > 1:
+            tile_dir = os.path.join(tile_dir, "pfb%d" % args.pfb)
+
+    cache = TileCache(args.cache_size << 20, tile_dir, os.path.getmtime(args.filename))
+    if args.processes > 1 and not isinstance(signal, SpectrogramReader):
+        pool = make_pool(signal, args.processes)
+    else:
+        pool = None
 
-    sample_rate, signal = read_file(sys.argv[1])
-    view(signal, sample_rate=sample_rate)
+    view(signal, sample_rate=sample_rate, cache=cache, pool=pool, taps=args.pfb,
+         texture_format=args.texture_format)
 
 if __name__ == "__main__":
     main()
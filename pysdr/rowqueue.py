@@ -0,0 +1,148 @@
+import threading
+import time
+import numpy as np
+
+POLICIES = ['block', 'drop', 'decimate']
+
+class RowQueue:
+    """Bounded queue of blocks of rows passed from signal processing to display
+
+    At most `max_rows` rows are held. When a block doesn't fit, depending on
+    `policy` the producer either waits for the consumer ('block'), the oldest
+    rows are discarded ('drop') or the pending rows are merged in pairs by
+    taking their maximum, halving their number as many times as needed
+    ('decimate').
+
+    Every row taken out still accounts for the rows it stands for, so that the
+    consumer can keep its row count in step with the producer: dropped rows
+    come out as a gap of zeros and merged rows are repeated. The totals of
+    dropped and merged rows are kept in `dropped` and `merged`.
+
+    Once the consumer is gone, `close` releases a producer waiting in `put`
+    and further rows are discarded.
+    """
+    def __init__(self, max_rows, policy='block'):
+        if policy not in POLICIES:
+            raise ValueError("unknown queue policy '%s'" % policy)
+
+        self.max_rows = max_rows
+        self.policy = policy
+        self.cond = threading.Condition()
+        # items are [ingest time, rows, counts of rows stood for by each row]
+        self.items = []
+        self.rows = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.merged = 0
+        self.row_shape = None
+        self.closed = False
+
+    def __len__(self):
+        return self.rows
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.items, self.rows, self.skipped = [], 0, 0
+            self.cond.notify_all()
+
+    def put(self, ingest, lines):
+        with self.cond:
+            if self.policy == 'block':
+                while self.rows and self.rows + len(lines) > self.max_rows and not self.closed:
+                    self.cond.wait()
+
+            if self.closed:
+                return
+
+            self.row_shape = (lines.shape[1:], lines.dtype)
+            self.items.append([ingest, lines, np.ones(len(lines), dtype=np.int64)])
+            self.rows += len(lines)
+
+            if self.rows > self.max_rows:
+                if self.policy == 'drop':
+                    self.drop_oldest(self.rows - self.max_rows)
+                elif self.policy == 'decimate':
+                    self.decimate()
+
+            self.cond.notify_all()
+
+    def drop_oldest(self, nrows):
+        while nrows > 0:
+            item = self.items[0]
+            n = min(nrows, len(item[1]))
+            source = int(np.sum(item[2][:n]))
+
+            if n == len(item[1]):
+                self.items.pop(0)
+            else:
+                item[1], item[2] = item[1][n:], item[2][n:]
+
+            self.rows -= n
+            self.skipped += source
+            self.dropped += source
+            nrows -= n
+
+    def decimate(self):
+        ingest = self.items[0][0]
+        lines = np.concatenate([item[1] for item in self.items])
+        counts = np.concatenate([item[2] for item in self.items])
+
+        while len(lines) > self.max_rows and len(lines) > 1:
+            pairs = np.arange(0, len(lines), 2)
+            lines = np.maximum.reduceat(lines, pairs, axis=0)
+            counts = np.add.reduceat(counts, pairs)
+
+        self.merged += self.rows - len(lines)
+        self.items = [[ingest, lines, counts]]
+        self.rows = len(lines)
+
+    def get_block(self, timeout, max_rows):
+        """Take out everything pending as a single block of rows
+
+        Returns (ingest time of the oldest row, block, number of rows stood for)
+        or None if nothing arrived within `timeout` seconds. Since it's always
+        the last rows which matter to a scrolling display, the block is cut
+        down to the last `max_rows` rows.
+        """
+        with self.cond:
+            if not self.items and not self.skipped:
+                self.cond.wait(timeout)
+
+                if not self.items and not self.skipped:
+                    return None
+
+            items, skipped = self.items, self.skipped
+            self.items, self.rows, self.skipped = [], 0, 0
+            self.cond.notify_all()
+
+        ingest = items[0][0] if items else time.time()
+        nsource = skipped + sum(int(np.sum(counts)) for (_, _, counts) in items)
+        blocks = []
+        nrows = 0
+
+        # walk from the newest rows back, expanding merged rows, until enough
+        for (_, lines, counts) in reversed(items):
+            if nrows >= max_rows:
+                break
+
+            need = max_rows - nrows
+
+            if np.any(counts != 1):
+                # only as many of the last rows as needed, cut short on the first
+                covered = np.cumsum(counts[::-1])
+                k = min(len(counts), np.searchsorted(covered, need) + 1)
+                counts = counts[len(counts) - k:].copy()
+                counts[0] -= max(0, covered[k - 1] - need)
+                lines = np.repeat(lines[len(lines) - k:], counts, axis=0)
+
+            blocks.append(lines[max(0, len(lines) - need):])
+            nrows += len(blocks[-1])
+
+        if nrows < max_rows and skipped:
+            shape, dtype = self.row_shape
+            blocks.append(np.zeros((min(skipped, max_rows - nrows),) + shape, dtype=dtype))
+
+        blocks.reverse()
+        block = np.concatenate(blocks) if len(blocks) > 1 else blocks[0]
+        return (ingest, block, nsource)
@@ -0,0 +1,66 @@
+import threading
+import tempfile
+import numpy as np
+
+class RowStore:
+    """Ring of the last `capacity` rows of the waterfall kept in a mapped file
+
+    Rows are numbered from zero by the order of appending. The file is either
+    `filename` or, by default, an anonymous temporary file, in either case it's
+    the page cache that holds the rows rather than the process memory. Rows
+    appended are converted to `dtype`.
+
+    Appending is meant for the producer thread and reading for any other,
+    a read racing with the ring wrapping over the rows being read returns
+    only the rows which survived.
+    """
+    def __init__(self, capacity, width, dtype, filename=None):
+        if filename is None:
+            self.file = tempfile.TemporaryFile(prefix='pysdr-rows-')
+            filename = self.file
+
+        self.capacity = capacity
+        self.rows = np.memmap(filename, dtype=dtype, mode='w+', shape=(capacity, width))
+        # rows up to `written` are complete, up to `head` are being written
+        self.written = 0
+        self.head = 0
+        self.lock = threading.Lock()
+
+    def available(self):
+        """Return the range of rows held, as (first, end)"""
+        with self.lock:
+            return (max(0, self.head - self.capacity), self.written)
+
+    def append(self, block):
+        with self.lock:
+            if len(block) > self.capacity:
+                self.written += len(block) - self.capacity
+                block = block[len(block) - self.capacity:]
+
+            self.head = self.written + len(block)
+
+        pos = self.written % self.capacity
+        first = min(len(block), self.capacity - pos)
+        self.rows[pos:pos + first] = block[:first]
+        self.rows[0:len(block) - first] = block[first:]
+
+        with self.lock:
+            self.written = self.head
+
+    def read(self, a, b):
+        """Return (first row, rows) for the rows held within the range a...b"""
+        first, end = self.available()
+        a, b = max(a, first), min(b, end)
+
+        if a >= b:
+            return (a, self.rows[0:0].copy())
+
+        pos = a % self.capacity
+        count = b - a
+        part = min(count, self.capacity - pos)
+        out = np.concatenate((self.rows[pos:pos + part], self.rows[0:count - part]))
+
+        # drop the rows overwritten in the meantime
+        first, end = self.available()
+        skip = max(0, first - a)
+        return (a + skip, out[skip:])
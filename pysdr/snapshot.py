@@ -0,0 +1,228 @@
+"""Snapshots of the raw signal around events, cut out of an in-memory ring
+
+The last few seconds of samples are kept in an IQRing. When an event such as
+`mlab.aabb_event.*` arrives, the samples from some time before its first row
+to some time after its last row are dumped into a file, once they have all
+been read. Files are named by the UTC time of their first sample and come
+with a .json file describing the event.
+"""
+
+import os
+import json
+import time
+import atexit
+import threading
+import Queue
+import numpy as np
+
+SNAPSHOT_FORMATS = ['wav', 'cf32']
+
+class IQRing:
+    """Ring of the last `capacity` samples of the signal
+
+    Samples are numbered from zero by the order of appending.
+    """
+    def __init__(self, capacity, dtype):
+        self.capacity = capacity
+        self.samples = np.zeros(capacity, dtype=dtype)
+        self.written = 0
+
+    def append(self, samples):
+        if len(samples) > self.capacity:
+            self.written += len(samples) - self.capacity
+            samples = samples[len(samples) - self.capacity:]
+
+        pos = self.written % self.capacity
+        first = min(len(samples), self.capacity - pos)
+        self.samples[pos:pos + first] = samples[:first]
+        self.samples[0:len(samples) - first] = samples[first:]
+        self.written += len(samples)
+
+    def read(self, a, b):
+        """Return (first sample, copy of the samples held within the range a...b)"""
+        a, b = max(a, self.written - self.capacity, 0), min(b, self.written)
+
+        if a >= b:
+            return (a, self.samples[0:0].copy())
+
+        pos = a % self.capacity
+        part = min(b - a, self.capacity - pos)
+        return (a, np.concatenate((self.samples[pos:pos + part],
+                                   self.samples[0:b - a - part])))
+
+class SnapshotRecorder:
+    """Layer dumping the raw signal around events into `path`
+
+    Samples handed to `on_samples` are kept in a ring of `buffer` seconds.
+    An event covering rows a...b is dumped with `pre` seconds before row a
+    and `post` seconds after row b, the part which already left the ring
+    is missing from the snapshot. Repeated events with the same id and first
+    row, which detectors emit as the event grows, only extend the pending
+    snapshot.
+
+    The snapshot is copied out of the ring by the signal processing thread
+    and written by a thread of its own, with up to QUEUE_SNAPSHOTS waiting
+    for the disk before new ones are discarded. Once the snapshots take
+    more than `quota` bytes, the oldest ones are deleted. At exit, the pending
+    snapshots are dumped as far as the signal goes.
+    """
+    QUEUE_SNAPSHOTS = 8
+
+    def __init__(self, viewer, path, pre=2.0, post=5.0, buffer=10.0, format='wav', quota=None):
+        if format not in SNAPSHOT_FORMATS:
+            raise ValueError("unknown snapshot format '%s'" % format)
+
+        self.viewer = viewer
+        self.path = path
+        self.format = format
+        self.quota = quota
+
+        if format == 'wav':
+            # imported here, not to import from the writer thread
+            import scipy.io.wavfile
+            self.wavfile = scipy.io.wavfile
+
+        sig_input = viewer.sig_input
+        self.sample_rate = sig_input.sample_rate
+        self.pre = int(pre * self.sample_rate)
+        self.post = int(post * self.sample_rate)
+        self.ring = IQRing(max(int(buffer * self.sample_rate), self.pre + self.post),
+                           np.float32 if sig_input.is_real else np.complex64)
+
+        # snapshots waiting for their last sample, by (event id, first row),
+        # as [first sample, end sample, payload]
+        self.pending = dict()
+        self.dumped = []
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        self.snapshots = Queue.Queue(self.QUEUE_SNAPSHOTS)
+        self.thread = threading.Thread(target=self.write_snapshots)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def row_to_sample(self, row):
+        """Return the number of the first sample in the window of `row`
+
+        The window reaches `history` samples back from the first new sample
+        of the row, which with a polyphase filter bank includes the frames
+        before the usual window.
+        """
+        viewer = self.viewer
+        return int(row) * viewer.row_hop - viewer.history
+
+    def on_samples(self, samples):
+        self.ring.append(samples)
+
+        if self.pending:
+            self.dump_ready()
+
+    def on_event(self, event_id, payload):
+        if not event_id.startswith('mlab.aabb_event.'):
+            return
+
+        key = (event_id, payload[0])
+
+        if key in self.dumped:
+            return
+
+        a = self.row_to_sample(payload[0]) - self.pre
+        # the last sample of row b is the one before the first new sample of row b + 1
+        b = self.row_to_sample(payload[1] + 1) + self.viewer.history + self.post
+
+        if key in self.pending:
+            self.pending[key][1] = max(self.pending[key][1], b)
+            self.pending[key][2] = payload
+        else:
+            self.pending[key] = [a, b, payload]
+
+        self.dump_ready()
+
+    def dump_ready(self, final=False):
+        for key, (a, b, payload) in self.pending.items():
+            if b > self.ring.written and not final:
+                continue
+
+            del self.pending[key]
+            self.dumped = self.dumped[-63:] + [key]
+            first, samples = self.ring.read(a, b)
+
+            if not len(samples):
+                continue
+
+            try:
+                self.snapshots.put((key[0], payload, first, samples), block=final)
+            except Queue.Full:
+                print "snapshot of %s discarded, writing falls behind" % key[0]
+
+    def close(self):
+        """Dump the pending snapshots as they are and stop the writer thread"""
+        self.dump_ready(final=True)
+        self.snapshots.put(None)
+        self.thread.join()
+
+    def write_snapshots(self):
+        while True:
+            snapshot = self.snapshots.get()
+
+            if snapshot is None:
+                return
+
+            event_id, payload, first, samples = snapshot
+
+            start = self.viewer.start_time + float(first) / self.sample_rate
+            name = "%s.%03d-%s" % (time.strftime("%Y%m%d-%H%M%S", time.gmtime(start)),
+                                   int(start * 1000) % 1000,
+                                   event_id[len('mlab.aabb_event.'):].replace(os.sep, '_'))
+            base = os.path.join(self.path, name)
+
+            try:
+                if self.format == 'wav':
+                    data = samples.view(np.float32).reshape(len(samples), -1)
+                    self.wavfile.write(base + ".wav", self.sample_rate, data)
+                else:
+                    samples.tofile(base + ".cf32")
+
+                meta = {
+                    'event_id': event_id,
+                    'payload': list(payload),
+                    'sample_rate': self.sample_rate,
+                    'first_sample': first,
+                    'start': start,
+                }
+                with open(base + ".json", "w") as f:
+                    # rows and bins computed by detectors may be numpy scalars
+                    json.dump(meta, f, indent=4, default=lambda x: x.item())
+
+                self.apply_quota()
+            except (IOError, OSError) as e:
+                print "failed to write snapshot '%s': %s" % (name, e)
+
+    def apply_quota(self):
+        """Delete the oldest snapshots over the quota, keeping at least the newest one"""
+        if self.quota is None:
+            return
+
+        # names start with the time, so they sort from the oldest
+        snapshots = dict()
+
+        for f in os.listdir(self.path):
+            if os.path.splitext(f)[1] not in ('.wav', '.cf32', '.json'):
+                continue
+
+            snapshots.setdefault(os.path.splitext(f)[0], []).append(f)
+
+        names = sorted(snapshots.keys())
+        sizes = [sum(os.path.getsize(os.path.join(self.path, f)) for f in snapshots[name])
+                 for name in names]
+        total = sum(sizes)
+
+        for name, size in zip(names, sizes)[:-1]:
+            if total <= self.quota:
+                break
+
+            for f in snapshots[name]:
+                os.remove(os.path.join(self.path, f))
+            total -= size
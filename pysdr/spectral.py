@@ -0,0 +1,315 @@
+import math
+import numpy as np
+
+import pysdr.fft
+
+def hann_window(bins):
+    return 0.5 * (1.0 - np.cos((2 * math.pi * np.arange(bins)) / bins))
+
+def pfb_window(bins, taps):
+    """Return the window of a polyphase filter bank of `taps` taps per bin
+
+    It's a sinc with the width of a bin tapered by a Hann window over `taps`
+    frames of `bins` samples, scaled to the DC gain of `hann_window(bins)`.
+    Folded into a single frame by summing up the weighted frames, it gives
+    channels with a flat top and steep edges.
+    """
+    x = np.arange(taps * bins, dtype=np.float64) / bins - taps / 2.0
+    window = np.sinc(x) * hann_window(taps * bins)
+    return window * (bins / 2.0 / np.sum(window))
+
+def frames_view(signal, bins, hop, nframes=None):
+    """Return a 2-D view of overlapping frames of `signal` without copying it"""
+    if nframes is None:
+        nframes = (len(signal) - bins) // hop + 1
+
+    if nframes < 0 or (nframes - 1) * hop + bins > len(signal):
+        raise ValueError("signal too short for %d frames" % nframes)
+
+    return np.lib.stride_tricks.as_strided(signal, shape=(nframes, bins),
+                                           strides=(hop * signal.strides[0], signal.strides[0]))
+
+class SpectralEngine:
+    """Windowed FFT magnitude spectra computed in preallocated buffers
+
+    Spectra are computed in blocks of up to `batch` rows. The arrays returned
+    by `process`, `process_block` and `log_spectrum` are owned by the engine
+    and are overwritten on the next call, callers which need to keep
+    a spectrum around have to copy it.
+
+    With `real` set, the input is expected to be real-valued and is transformed
+    with a real-input FFT, the negative frequencies are then mirrored from
+    the positive ones.
+
+    With `shift` unset, the spectra of complex input are left in the FFT order,
+    i.e. starting with the zero frequency, for the caller to rotate them later
+    (e.g. while uploading them to a texture). Real input is always mirrored.
+
+    With `taps` above one, the engine is the front end of a polyphase filter
+    bank: the frames are `taps * bins` samples long, they are weighted by
+    the window (by default `pfb_window`) and folded into `bins` samples
+    by summing up the `taps` parts before the FFT.
+
+    The transform goes through a `pysdr.fft` plan, which is cached per thread,
+    so an engine should be created in the thread which is going to use it.
+    """
+    def __init__(self, bins, window=None, batch=1, real=False, shift=True, taps=1):
+        self.bins = bins
+        self.batch = batch
+        self.real = real
+        self.shift = shift or real
+        self.taps = taps
+
+        if window is None:
+            window = hann_window(bins) if taps == 1 else pfb_window(bins, taps)
+        self.window = window.astype(np.float32)
+
+        if len(self.window) != taps * bins:
+            raise ValueError("window of %d samples doesn't span %d taps of %d bins"
+                             % (len(self.window), taps, bins))
+
+        self.plan = pysdr.fft.plan(bins, np.float32 if real else np.complex64, batch)
+
+        if taps > 1:
+            self.weighted = np.zeros((batch, taps * bins), dtype=self.plan.input.dtype)
+        self.magnitude = np.zeros(self.plan.output.shape, dtype=np.float32)
+        self.lin = np.zeros((batch, bins), dtype=np.float32)
+        self.log = np.zeros((batch, bins), dtype=np.float32)
+        self.last_lin = self.lin[:0]
+
+        # fftshift as a permutation of the FFT output, applied by np.take,
+        # for real input it also mirrors bin k to -k
+        if real:
+            self.shift_index = np.abs(np.arange(bins) - bins // 2)
+        else:
+            self.shift_index = np.concatenate((np.arange(bins // 2, bins),
+                                               np.arange(0, bins // 2)))
+
+    def process_block(self, frames, out=None):
+        """Compute the magnitude spectra of a block of frames
+
+        The spectra are written into `out` if given, and are kept as the input
+        of a following `log_spectrum_block` call.
+        """
+        n = len(frames)
+
+        if n > self.batch:
+            raise ValueError("block of %d rows exceeds the batch size of %d" % (n, self.batch))
+
+        if out is None:
+            out = self.lin
+
+        if self.taps == 1:
+            np.multiply(frames, self.window, out=self.plan.input[:n])
+        else:
+            np.multiply(frames, self.window, out=self.weighted[:n])
+            np.sum(self.weighted[:n].reshape(n, self.taps, self.bins), axis=1,
+                   out=self.plan.input[:n])
+
+        fft_out = self.plan()
+
+        if self.shift:
+            np.absolute(fft_out[:n], out=self.magnitude[:n])
+            np.take(self.magnitude[:n], self.shift_index, axis=1, out=out[:n])
+        else:
+            np.absolute(fft_out[:n], out=out[:n])
+
+        self.last_lin = out[:n]
+        return self.last_lin
+
+    def process(self, signal):
+        return self.process_block(signal[np.newaxis, :])[0]
+
+    def log_spectrum_block(self, out=None):
+        if out is None:
+            out = self.log
+
+        log = out[:len(self.last_lin)]
+        np.log10(self.last_lin, out=log)
+        log *= 10
+        return log
+
+    def log_spectrum(self):
+        return self.log_spectrum_block()[0]
+
+INTEGRATION_MODES = ['mean', 'ema', 'max', 'median']
+
+class SpectralIntegrator:
+    """Integration of groups of `k` consecutive magnitude spectra into single rows
+
+    The modes are
+
+     - 'mean', the mean power of the group,
+     - 'ema', the exponential moving average of the power, with the weight
+       `alpha` (by default `1 / k`) of the newest row, taken at the end
+       of the group,
+     - 'max', the maximum of the group (max-hold),
+     - 'median', the median of the group (the upper one for even `k`),
+
+    the results being magnitudes again. Blocks of up to `batch` rows are
+    pushed by `push`, which returns the rows completed by the block, possibly
+    none. Groups carry over between blocks. Like with SpectralEngine, the
+    returned arrays are overwritten on the next call. The accumulators and
+    scratch buffers are allocated upfront.
+    """
+    def __init__(self, bins, k, mode='mean', batch=1, alpha=None):
+        if mode not in INTEGRATION_MODES:
+            raise ValueError("unknown integration mode '%s'" % mode)
+
+        if k < 1:
+            raise ValueError("number of integrated rows must be at least 1")
+
+        self.bins = bins
+        self.k = k
+        self.mode = mode
+        self.alpha = 1.0 / k if alpha is None else alpha
+
+        self.acc = np.zeros(bins, dtype=np.float32)
+        self.partial = np.zeros(bins, dtype=np.float32)
+        self.scratch = np.zeros((batch, bins), dtype=np.float32)
+        self.group = np.zeros((k, bins), dtype=np.float32) if mode == 'median' else None
+        self.filled = 0
+        self.started = False
+
+        self.lin = np.zeros(((batch + k - 1) // k, bins), dtype=np.float32)
+        self.log = np.zeros_like(self.lin)
+        self.last_lin = self.lin[:0]
+
+    def push(self, block):
+        """Add a block of rows, returns the rows completed in the meantime"""
+        pos = nout = 0
+
+        while pos < len(block):
+            m = min(len(block) - pos, self.k - self.filled)
+            self.accumulate(block[pos:pos + m])
+            self.filled += m
+            pos += m
+
+            if self.filled == self.k:
+                self.finish(self.lin[nout])
+                self.filled = 0
+                nout += 1
+
+        self.last_lin = self.lin[:nout]
+        return self.last_lin
+
+    def accumulate(self, part):
+        m = len(part)
+
+        if self.mode == 'mean':
+            power = np.multiply(part, part, out=self.scratch[:m])
+            self.acc += np.sum(power, axis=0, out=self.partial)
+        elif self.mode == 'max':
+            np.maximum(self.acc, np.amax(part, axis=0, out=self.partial), out=self.acc)
+        elif self.mode == 'median':
+            self.group[self.filled:self.filled + m] = part
+        else:
+            power = np.multiply(part, part, out=self.scratch[:m])
+
+            if not self.started:
+                self.acc[:] = power[0]
+                self.started = True
+
+            for row in power:
+                self.acc *= 1.0 - self.alpha
+                row *= self.alpha
+                self.acc += row
+
+    def finish(self, out):
+        if self.mode == 'mean':
+            np.multiply(self.acc, 1.0 / self.k, out=out)
+            np.sqrt(out, out=out)
+            self.acc[:] = 0
+        elif self.mode == 'max':
+            out[:] = self.acc
+            self.acc[:] = 0
+        elif self.mode == 'median':
+            # partitioned in place, the order of the group doesn't matter
+            self.group.partition(self.k // 2, axis=0)
+            out[:] = self.group[self.k // 2]
+        else:
+            np.sqrt(self.acc, out=out)
+
+    def log_spectrum_block(self):
+        log = self.log[:len(self.last_lin)]
+        np.log10(self.last_lin, out=log)
+        log *= 10
+        return log
+
+BAND_STATS = ['peak', 'argpeak', 'mean', 'sum']
+
+class BandReducer:
+    """Reductions of fixed bands of bins, shared by everyone interested
+
+    Bands are registered once as ranges of bins along with the statistics
+    wanted of them: 'peak' (maximum), 'argpeak' (bin of the maximum),
+    'mean', 'sum' and 'qNN', the NN-th percentile as taken by `np.partition`.
+    A band registered again, with the same spectrum and range, is the same
+    band, its statistics are computed once for all who asked.
+
+    `reduce` returns the statistics of a block of spectra, as arrays with one
+    value per row. The result for the last block of each spectrum is cached,
+    so that everyone can ask for it and get it computed once.
+    """
+    def __init__(self):
+        # stats wanted of each band, by (spectrum, first bin, end bin)
+        self.bands = dict()
+        self.cached = dict()
+
+    def register(self, spectrum, a, b, stats):
+        """Register the bins a...b of `spectrum` for `stats`, returns the band's key"""
+        if a >= b:
+            raise ValueError("empty band of bins %d...%d" % (a, b))
+
+        for stat in stats:
+            if stat not in BAND_STATS and not (stat[0] == 'q' and stat[1:].isdigit()
+                                               and int(stat[1:]) < 100):
+                raise ValueError("unknown band statistic '%s'" % stat)
+
+        key = (spectrum, a, b)
+        self.bands.setdefault(key, set()).update(stats)
+        self.cached.pop(spectrum, None)
+        return key
+
+    def reduce(self, spectrum, row, block):
+        """Return the statistics of the bands of `spectrum` for the block starting at `row`
+
+        The result maps band keys to dicts of statistics.
+        """
+        cached = self.cached.get(spectrum)
+
+        if cached is not None and cached[0] == (row, len(block)):
+            return cached[1]
+
+        result = dict()
+
+        for key, stats in self.bands.iteritems():
+            if key[0] != spectrum:
+                continue
+
+            a, b = key[1:]
+            part = block[:, a:b]
+            values = result[key] = dict()
+
+            if 'peak' in stats:
+                values['peak'] = np.amax(part, axis=1)
+
+            if 'argpeak' in stats:
+                values['argpeak'] = np.argmax(part, axis=1) + a
+
+            if 'sum' in stats or 'mean' in stats:
+                values['sum'] = np.sum(part, axis=1)
+                values['mean'] = values['sum'] / (b - a)
+
+            quantiles = [stat for stat in stats if stat[0] == 'q']
+
+            if quantiles:
+                # a single partition for all the percentiles of the band
+                kth = [(b - a) * int(stat[1:]) / 100 for stat in quantiles]
+                parted = np.partition(part, kth, axis=1)
+
+                for stat, k in zip(quantiles, kth):
+                    values[stat] = parted[:, k]
+
+        self.cached[spectrum] = ((row, len(block)), result)
+        return result
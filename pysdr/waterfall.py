@@ -5,7 +5,6 @@ import sys
 import Queue
 import threading
 import numpy as np
-import argparse
 import signal
 import time
 
@@ -15,17 +14,21 @@ from OpenGL.GLUT import *
 from OpenGL.GLU import *
 
 from pysdr.graph import MultiTexture, PlotLine
-from pysdr.input import RawSigInput, JackInput
 from pysdr.overlay import View, PlotAxes, static_axis, UNIT_HZ, UNIT_SEC, _axis, time_of_day_axis
 from pysdr.console import Console
 from pysdr.commands import make_commands_layer
-from pysdr.events import EventMarker, DetectorScript, MIDIEventGatherer
+from pysdr.events import EventMarker, DetectorScript, DetectorProcess
 from pysdr.persistence import pers_load, pers_save
+from pysdr.processor import SignalProcessor
+from pysdr.headless import make_parser, open_input, attach_layers
+from pysdr.rowqueue import RowQueue
+from pysdr.rowstore import RowStore
+from pysdr.zoom import ZoomInput
 import pysdr.ext as ext
 
 class Viewer:
     def __init__(self, window_name):
-        glutCreateWindow(window_name)
+        self.window_id = glutCreateWindow(window_name)
         glutDisplayFunc(self.cb_display)
         glutMouseFunc(self.cb_mouse)
         glutMotionFunc(self.cb_motion)
@@ -109,8 +112,11 @@ class Viewer:
         return a[0] if len(a) else None
 
 class Texture():
-    def __init__(self, image):
+    def __init__(self, image, internal_format=GL_RGB, format=GL_RGBA,
+                 type=GL_UNSIGNED_INT_8_8_8_8):
         self.texture = glGenTextures(1)
+        self.format = format
+        self.type = type
 
         glEnable(GL_TEXTURE_2D)
 
@@ -119,23 +125,30 @@ class Texture():
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
 
-        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGB, image.shape[1], image.shape[0], 0,
-                        GL_RGBA, GL_UNSIGNED_INT_8_8_8_8, image)
+        glTexImage2D(GL_TEXTURE_2D, 0, internal_format, image.shape[1], image.shape[0], 0,
+                        format, type, image)
 
         glDisable(GL_TEXTURE_2D)
 
     def __del__(self):
         glDeleteTextures(self.texture)
 
-    def draw(self):
+    def update(self, row, image):
+        """Overwrite the rows of the texture starting at `row` with `image`"""
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        glTexSubImage2D(GL_TEXTURE_2D, 0, 0, row, image.shape[1], image.shape[0],
+                        self.format, self.type, image)
+
+    def draw(self, fraction=1.0):
+        """Draw the texture over the unit square, or its top `fraction` of rows only"""
         glEnable(GL_TEXTURE_2D)
         glBindTexture(GL_TEXTURE_2D, self.texture)
         glColor3f(1.0, 1.0, 1.0)
 
         glBegin(GL_QUADS)
-        glTexCoord2i(0, 1)
+        glTexCoord2f(0, fraction)
         glVertex2i(0, 0)
-        glTexCoord2i(1, 1)
+        glTexCoord2f(1, fraction)
         glVertex2i(1, 0)
         glTexCoord2i(1, 0)
         glVertex2i(1, 1)
@@ -152,6 +165,8 @@ class RangeSelector():
         self.viewer = viewer
         self.histogram = PlotLine(90)
         self.hist_range = (-60, 20)
+        # bin edges as linear magnitudes, to spare taking the logarithm
+        self.hist_edges = 10 ** (np.linspace(self.hist_range[0], self.hist_range[1], 91) / 10)
         self.dragging = None
 
     def mag_to_pixel(self, mag):
@@ -207,8 +222,8 @@ class RangeSelector():
 
         glPopMatrix()
 
-    def on_log_spectrum(self, spectrum):
-        (self.histogram.data[:], _) = np.histogram(spectrum, bins=90, range=self.hist_range)
+    def on_raw_spectrum_block(self, block):
+        (self.histogram.data[:], _) = np.histogram(block[-1], bins=self.hist_edges)
 
     def on_mouse_button(self, button, state, x, y):
         if button != GLUT_LEFT_BUTTON:
@@ -288,8 +303,25 @@ class ColorMappingShader:
                         mag2col_base2_blue(a - 1.0));
         }
 
+        %s
+
         void main() {
-            gl_FragColor = vec4(mag2col((texture2D(sampler, gl_TexCoord[0].xy).x + shift) * scale), 1);
+            gl_FragColor = vec4(mag2col((tex_value(gl_TexCoord[0].xy) + shift) * scale), 1);
+        }
+    """
+
+    TEX_VALUE_CODE = """
+        float tex_value(vec2 pos) {
+            return texture2D(sampler, pos).x;
+        }
+    """
+
+    # with linear magnitudes in the texture, the conversion to dB and
+    # the scaling of texture_insert_prep are done here instead
+    LIN_TEX_VALUE_CODE = """
+        float tex_value(vec2 pos) {
+            float db = 4.3429448 * log(max(texture2D(sampler, pos).x, 1e-30));
+            return (db - (%f)) / %f;
         }
     """
 
@@ -307,34 +339,108 @@ class ColorMappingShader:
         glUniform1f(glGetUniformLocation(self.program, "shift"), shift)
         glActiveTexture(GL_TEXTURE0)
 
-    def texture_insert_prep(self, line):
-        return (line - self.TEX_RANGE[0]) / (self.TEX_RANGE[1] - self.TEX_RANGE[0])
+    def texture_insert_prep(self, line, out=None):
+        if self.linear:
+            if out is None:
+                return np.copy(line)
+
+            out[...] = line
+            return out
+
+        out = np.subtract(line, self.TEX_RANGE[0], out=out)
+        out /= self.TEX_RANGE[1] - self.TEX_RANGE[0]
+        return out
+
+    def __init__(self, linear=False):
+        """Compile the shader, with `linear` set for textures of linear magnitudes"""
+        self.linear = linear
+
+        if linear:
+            tex_value = self.LIN_TEX_VALUE_CODE % (self.TEX_RANGE[0],
+                                                   self.TEX_RANGE[1] - self.TEX_RANGE[0])
+        else:
+            tex_value = self.TEX_VALUE_CODE
 
-    def __init__(self):
         vert_shader = shaders.compileShader(self.VERT_SHADER_CODE, GL_VERTEX_SHADER)
-        frag_shader = shaders.compileShader(self.FRAG_SHADER_CODE, GL_FRAGMENT_SHADER)
+        frag_shader = shaders.compileShader(self.FRAG_SHADER_CODE % tex_value, GL_FRAGMENT_SHADER)
         self.program = shaders.compileProgram(vert_shader, frag_shader)
 
 
-class WaterfallWindow(Viewer):
-    def __init__(self, sig_input, bins, overlap=0, start_time=None):
+# internal formats of the waterfall texture, with the type and dtype of
+# the uploaded rows; with 'r8' the logarithmic magnitudes are quantized
+# to 8 bits over TEX_RANGE
+TEXTURE_FORMATS = {
+    'r32f': (GL_R32F, GL_FLOAT, np.float32),
+    'r16f': (GL_R16F, GL_HALF_FLOAT, np.float16),
+    'r8': (GL_R8, GL_UNSIGNED_BYTE, np.uint8),
+}
+
+def convert_texture_rows(lines, dtype):
+    """Convert rows prepared for upload (floats in 0...1 if logarithmic) to `dtype`"""
+    if dtype == np.float32:
+        return lines
+
+    if dtype == np.uint8:
+        lines *= 255
+        np.clip(lines, 0, 255, out=lines)
+        return np.rint(lines, out=lines).astype(np.uint8)
+
+    return lines.astype(dtype)
+
+# waterfall windows sharing the GLUT idle callback, which is global
+idle_viewers = []
+
+def cb_idle_all():
+    for viewer in list(idle_viewers):
+        glutSetWindow(viewer.window_id)
+        viewer.cb_idle()
+
+class WaterfallWindow(Viewer, SignalProcessor):
+    # weight of the latest frame in the smoothed latency
+    LATENCY_SMOOTHING = 0.1
+
+    def __init__(self, sig_input, bins, overlap=0, start_time=None, batch=1, workers=1, fps=60,
+                 queue_rows=4096, queue_policy='block', gpu_log=False,
+                 texture_format='r32f', history_rows=1024, scrollback_rows=0,
+                 scrollback_file=None, taps=1, integrate=1, integrate_mode='mean',
+                 title="PySDR"):
         if bins % 1024 != 0:
             raise NotImplementedError("number of bins must be a multiple of 1024")
 
-        Viewer.__init__(self, "PySDR")
-        glutIdleFunc(self.cb_idle)
+        if gpu_log and texture_format == 'r8':
+            raise ValueError("linear magnitudes need a float texture format")
 
-        self.mag_range = (-45, 5)
+        # with gpu_log, linear magnitudes in the FFT order are uploaded and
+        # the shader takes the logarithm, the bins are rotated on upload
+        SignalProcessor.__init__(self, sig_input, bins, overlap=overlap, start_time=start_time,
+                                 batch=batch, workers=workers, shift=not gpu_log,
+                                 log=not gpu_log, taps=taps, integrate=integrate,
+                                 integrate_mode=integrate_mode)
+        self.gpu_log = gpu_log
 
-        self.sig_input = sig_input
-        self.bins = bins
-        self.window = 0.5 * (1.0 - np.cos((2 * math.pi * np.arange(self.bins)) / self.bins))
-        self.overlap = overlap
-        self.row_duration = float(bins - overlap) / sig_input.sample_rate
-        # TODO: can we be sure the texture will be stored as floats internally?
-        self.multitexture = MultiTexture(1024, 1024, self.bins / 1024, 1, format=GL_RED, type=GL_FLOAT)
+        Viewer.__init__(self, title)
+        idle_viewers.append(self)
+        glutIdleFunc(cb_idle_all)
 
-        self.start_time = time.time() if start_time is None else start_time
+        self.mag_range = (-45, 5)
+
+        # the history is rounded up to whole units of 1024 rows
+        (self.internal_format, self.texture_type,
+            self.texture_dtype) = TEXTURE_FORMATS[texture_format]
+        self.multitexture = MultiTexture(1024, 1024, self.bins / 1024,
+                                         max(1, (history_rows + 1023) / 1024),
+                                         format=GL_RED, type=GL_FLOAT,
+                                         internal_format=self.internal_format)
+
+        # rows as uploaded to the texture are also kept in the row store,
+        # from which the Scrollback layer pages in the older ones; the store
+        # keeps them as 16-bit floats, or as 8-bit integers with 'r8'
+        if scrollback_rows:
+            store_dtype = np.uint8 if self.texture_dtype == np.uint8 else np.float16
+            self.row_store = RowStore(scrollback_rows, bins, store_dtype,
+                                      filename=scrollback_file)
+        else:
+            self.row_store = None
 
         def time_axis(a, b):
             scale = self.row_duration * self.multitexture.get_height()
@@ -345,20 +451,22 @@ class WaterfallWindow(Viewer):
                                                   cutoff=(-1.0, 1.0)), time_axis)
         self.layers.append(self.overlay)
 
-        self.texture_inserts = Queue.Queue()
+        self.texture_inserts = RowQueue(queue_rows, queue_policy)
         self.texture_edge = 0
 
         self.texture_row = 0
-        self.process_row = 0
 
-        self.process_thread = threading.Thread(target=self.process)
-        self.process_thread.setDaemon(True)
+        # redraws are capped at `fps` per second, rows arriving in between
+        # are uploaded together before the next frame
+        self.frame_interval = 1.0 / fps if fps else 0.0
+        self.last_frame = 0.0
+        self.pending_ingest = None
+        # time in seconds between a row leaving the signal processing and
+        # the frame showing it, for the oldest row of a frame, smoothed over
+        # the last frames
+        self.latency = 0.0
 
-        self.shader = ColorMappingShader()
-
-    def start(self):
-        self.sig_input.start()
-        self.process_thread.start()
+        self.shader = ColorMappingShader(linear=gpu_log)
 
     def init(self):
         glLineWidth(1.0)
@@ -375,11 +483,18 @@ class WaterfallWindow(Viewer):
         shaders.glUseProgram(0)
         glPopMatrix()
 
-    def freq_to_bin(self, freq):
-        return int(freq * self.bins / self.sig_input.sample_rate + self.bins / 2)
+    def status(self):
+        text = str(self.sig_input)
+        queue = self.texture_inserts
+
+        text += " (latency %.0f ms" % (self.latency * 1000)
 
-    def bin_to_freq(self, bin):
-        return float(bin - self.bins / 2) / self.bins * self.sig_input.sample_rate
+        if queue.dropped or queue.merged:
+            text += ", rows dropped: %d, merged: %d" % (queue.dropped, queue.merged)
+
+        text += ")"
+
+        return "; ".join([text] + self.layers_status())
 
     def bin_to_x(self, bin):
         return float(bin) / self.bins * 2 - 1
@@ -387,53 +502,167 @@ class WaterfallWindow(Viewer):
     def row_to_y(self, row):
         return float(row - self.texture_row) / self.multitexture.get_height() + 1.0
 
+    def y_to_row(self, y):
+        return int(math.floor((y - 1.0) * self.multitexture.get_height())) + self.texture_row
+
+    def cb_display(self):
+        Viewer.cb_display(self)
+        self.last_frame = time.time()
+
+        if self.pending_ingest is not None:
+            self.latency += self.LATENCY_SMOOTHING * (self.last_frame - self.pending_ingest
+                                                      - self.latency)
+            self.pending_ingest = None
+
     def cb_idle(self):
-        try:
-            while True:
-                rec = self.texture_inserts.get(block=True, timeout=0.01)
-                self.multitexture.insert(self.texture_edge, rec, format=GL_RED, type=GL_FLOAT)
-                self.texture_row = self.texture_row + 1
-                self.texture_edge = self.texture_row % self.multitexture.get_height()
+        wait = self.last_frame + self.frame_interval - time.time()
 
-                self.call_layers('on_texture_insert')
+        if wait > 0:
+            time.sleep(min(wait, 0.01))
+            return
 
-                glutPostRedisplay()
-        except Queue.Empty:
+        item = self.texture_inserts.get_block(0.01, self.multitexture.get_height())
+
+        if item is None:
             return
 
-    def process(self):
-        ringbuf = np.zeros(self.bins * 4, dtype=np.complex64)
-        ringbuf_edge = self.bins
-        readsize = self.bins - self.overlap
+        # rows dropped or merged by the queue still count, so that the rows
+        # in the texture stay in step with process_row
+        ingest, block, nrows = item
+        self.multitexture.insert_block(self.texture_edge + nrows - len(block), block,
+                                       format=GL_RED, type=self.texture_type, rotate=self.rotate)
+
+        self.texture_row = self.texture_row + nrows
+        self.texture_edge = self.texture_row % self.multitexture.get_height()
+        self.call_layers('on_texture_insert', (nrows,))
+
+        if self.pending_ingest is None:
+            self.pending_ingest = ingest
+
+        glutPostRedisplay()
+
+    def emit_rows(self, raw, log):
+        # with gpu_log, the texture takes the linear magnitudes as they are
+        rows = raw if self.gpu_log else log
+
+        #try:
+        #    scale = 3.75 / (self.mag_range[1] - self.mag_range[0])
+        #except ZeroDivisionError:
+        #    scale = 3.75 / 0.00001
+
+        #shift = -self.mag_range[0] * scale - 1.75
+
+        #line = ext.mag2col((spectrum * scale + shift).astype('f'))
+        lines = convert_texture_rows(self.shader.texture_insert_prep(rows), self.texture_dtype)
+
+        if self.row_store is not None:
+            self.row_store.append(lines)
+
+        self.texture_inserts.put(time.time(), lines)
+
+class Scrollback:
+    """Rows older than the live texture, paged in from the viewer's row store
 
+    When the view is panned below the live waterfall, the page of rows in view
+    is read from the store on a separate thread and uploaded into a spare
+    texture of the same size in slices of UPLOAD_ROWS rows per frame, so that
+    the live waterfall isn't held up. Pages start at multiples of half
+    the texture height, so that a page serves for a while when panning.
+    """
+    UPLOAD_ROWS = 256
+
+    def __init__(self, viewer):
+        self.viewer = viewer
+        self.store = viewer.row_store
+        live = viewer.multitexture
+        self.texture = MultiTexture(live.unit_width, live.unit_height, live.units_x,
+                                    live.units_y, format=GL_RED, type=GL_FLOAT,
+                                    internal_format=viewer.internal_format)
+        self.page_rows = self.texture.get_height()
+
+        # the page shown as (start, first row, end row), the page being
+        # uploaded as [start, first row, rows, rows uploaded] and the page
+        # read by the thread as (start, first row, rows)
+        self.page = None
+        self.uploading = None
+        self.loaded = None
+        self.wanted = None
+
+        self.read_event = threading.Event()
+        thread = threading.Thread(target=self.read_pages)
+        thread.setDaemon(True)
+        thread.start()
+
+    def read_pages(self):
         while True:
-            if (ringbuf_edge + readsize > len(ringbuf)):
-                ringbuf[0:self.overlap] = ringbuf[ringbuf_edge - self.overlap:ringbuf_edge]
-                ringbuf_edge = self.overlap
+            self.read_event.wait()
+            self.read_event.clear()
+
+            start = self.wanted
+            first, rows = self.store.read(start, start + self.page_rows)
+            self.loaded = (start, first, rows)
+
+    def upload(self):
+        loaded = self.loaded
+
+        if self.uploading is not None and self.uploading[0] != self.wanted:
+            self.uploading = None
+
+        if loaded is not None and loaded[0] == self.wanted:
+            self.loaded = None
+            self.page = None
+            self.uploading = list(loaded) + [0]
+
+        if self.uploading is None:
+            if self.page is None or self.page[0] != self.wanted:
+                # poll for the page being read
+                glutPostRedisplay()
+            return
+
+        start, first, rows, done = self.uploading
+        n = min(self.UPLOAD_ROWS, len(rows) - done)
+
+        if n:
+            block = rows[done:done + n].astype(self.viewer.texture_dtype)
+            self.texture.insert_block(first - start + done, block, format=GL_RED,
+                                      type=self.viewer.texture_type, rotate=self.viewer.rotate)
+        self.uploading[3] += n
+
+        if self.uploading[3] == len(rows):
+            self.page = (start, first, first + len(rows))
+            self.uploading = None
+        else:
+            glutPostRedisplay()
 
-            ringbuf[ringbuf_edge:ringbuf_edge + readsize] = self.sig_input.read(readsize)
-            ringbuf_edge += readsize
+    def draw_content(self):
+        viewer = self.viewer
+        row_a = viewer.y_to_row(viewer.view.from_screen(0, 0)[1])
+        live_first = viewer.texture_row - viewer.multitexture.get_height()
 
-            signal = ringbuf[ringbuf_edge - self.bins:ringbuf_edge]
+        if row_a >= live_first or self.store.available()[0] >= live_first:
+            return
 
-            spectrum = np.absolute(np.fft.fft(np.multiply(signal, self.window)))
-            spectrum = np.concatenate((spectrum[self.bins/2:self.bins], spectrum[0:self.bins/2]))
+        step = self.page_rows / 2
+        start = max(0, row_a / step * step)
 
-            self.call_layers('on_lin_spectrum', (spectrum,))
-            spectrum = np.log10(spectrum) * 10
-            self.call_layers('on_log_spectrum', (spectrum,))
+        if start != self.wanted:
+            self.wanted = start
+            self.read_event.set()
 
-            #try:
-            #    scale = 3.75 / (self.mag_range[1] - self.mag_range[0])
-            #except ZeroDivisionError:
-            #    scale = 3.75 / 0.00001
+        self.upload()
 
-            #shift = -self.mag_range[0] * scale - 1.75
+        if self.page is None or self.page[1] == self.page[2]:
+            return
 
-            #line = ext.mag2col((spectrum * scale + shift).astype('f'))
-            line = self.shader.texture_insert_prep(spectrum).astype('f')
-            self.process_row = self.process_row + 1
-            self.texture_inserts.put(line)
+        start, first, end = self.page
+
+        glPushMatrix()
+        glTranslated(-1.0, viewer.row_to_y(first), 0.0)
+        glScalef(2.0, viewer.row_to_y(end) - viewer.row_to_y(first), 1.0)
+        viewer.shader.setup(viewer.mag_range)
+        self.texture.draw_rows(first - start, end - start)
+        shaders.glUseProgram(0)
+        glPopMatrix()
 
 class Label:
     @staticmethod
@@ -457,11 +686,83 @@ class Label:
         w, h = self.viewer.screen_size
         x, y = 10, h - Console.CHAR_HEIGHT - 10
 
-        self.draw_bg(x, y - 2, Console.CHAR_WIDTH * len(self.content),
+        content = self.content() if callable(self.content) else self.content
+
+        self.draw_bg(x, y - 2, Console.CHAR_WIDTH * len(content),
                      Console.CHAR_HEIGHT, padding=3)
 
         glColor4f(1.0, 1.0, 1.0, 0.75)
-        Console.draw_string(x, y, self.content)
+        Console.draw_string(x, y, content)
+
+class ZoomControl:
+    """Layer opening a zoomed-in waterfall of the band in view on 'z'
+
+    The band is down-converted and decimated by a ZoomInput and shown by
+    a second WaterfallWindow of ZOOM_BINS bins, which runs along with the main
+    one on a processing thread of its own. Pressing 'z' again retunes
+    the zoom to the center of the view, keeping its width, 'Z' closes it,
+    so that it can be opened again with another width.
+    """
+    ZOOM_BINS = 1024
+
+    def __init__(self, viewer, args):
+        self.viewer = viewer
+        self.args = args
+        self.zoom = None
+
+    def visible_band(self):
+        """Return the frequencies at the edges of the view, relative to the center"""
+        viewer = self.viewer
+        w, h = viewer.screen_size
+        half_rate = viewer.sig_input.sample_rate / 2.0
+
+        return tuple(min(max(viewer.view.from_screen(x, 0)[0], -1.0), 1.0) * half_rate
+                     for x in (0, w))
+
+    def on_key_press(self, key):
+        if key == 'z' and self.zoom is None:
+            self.open()
+        elif key == 'z':
+            a, b = self.visible_band()
+            self.zoom.sig_input.tune((a + b) / 2)
+        elif key == 'Z' and self.zoom is not None:
+            self.close()
+        else:
+            return False
+
+        return True
+
+    def open(self):
+        viewer, args = self.viewer, self.args
+        a, b = self.visible_band()
+        decimation = max(1, int(viewer.sig_input.sample_rate / max(b - a, 1.0)))
+
+        zoom_input = ZoomInput(viewer, (a + b) / 2, decimation)
+        zoom = WaterfallWindow(zoom_input, self.ZOOM_BINS,
+                               overlap=int(self.ZOOM_BINS * args.overlap), fps=args.fps,
+                               queue_rows=args.queue_rows, queue_policy=args.queue_policy,
+                               texture_format=args.texture_format, title="PySDR zoom")
+        zoom.layers += [make_commands_layer(zoom), RangeSelector(zoom),
+                        Label(zoom, zoom.status)]
+
+        viewer.layers.append(zoom_input)
+        zoom.start()
+        glutSetWindow(viewer.window_id)
+        self.zoom = zoom
+
+    def close(self):
+        zoom, self.zoom = self.zoom, None
+
+        # the zoom's processing thread ends with its input, or is let go
+        # of the rows it waits to queue for display
+        self.viewer.layers.remove(zoom.sig_input)
+        zoom.sig_input.close()
+        zoom.texture_inserts.close()
+        zoom.process_thread.join()
+
+        idle_viewers.remove(zoom)
+        glutDestroyWindow(zoom.window_id)
+        glutSetWindow(self.viewer.window_id)
 
 class DateLabel:
     def __init__(self, viewer):
@@ -478,68 +779,47 @@ class DateLabel:
         glColor4f(1.0, 1.0, 1.0, 1.0)
         Console.draw_string(x, y, d)
 
-def main():
+def main(args=None):
     global viewer # so that it can be accessed from the embedded console
 
     signal.signal(signal.SIGINT, lambda a, b: sys.exit(0))
 
-    parser = argparse.ArgumentParser(description='Plot live spectral waterfall of a quadrature signal.')
-    parser.add_argument('-b', '--bins', type=int, default=4096,
-                        help='number of FFT bins (default: %(default)s)')
-    parser.add_argument('-H', '--height', type=float, default=0,
-                        help='minimal height of the waterfall in seconds \
-                                (default corresponds to 1024 windows)')
-    parser.add_argument('-o', '--overlap', type=float, default=0.75,
-                        help='overlap between consecutive windows as a proportion \
-                                of the number of bins (default: %(default)s)')
-    parser.add_argument('-j', '--jack', metavar='NAME', default='pysdr',
-                        help='feed signal from JACK and use the given client name \
-                                (by default, with name \'pysdr\')')
-    parser.add_argument('-r', '--raw', metavar='RATE', type=int,
-                        help='feed signal from the standard input, expects 2 channel \
-                                interleaved floats with the given sample-rate')
-    parser.add_argument('-d', '--detector', metavar='ARGS', action='append',
-                        help='attach the given detector script, \
-                                expects to be given the script filename \
-                                followed by arguments for the script, \
-                                all joined by spaces and passed on the command-line \
-                                as one quoted argument')
-    parser.add_argument('-p', '--persfn', metavar='FILENAME',
-                        help='a file in which to preserve the visualization parameters \
-                                that come from interactive manipulation, \
-                                i.e. the visible area of the waterfall \
-                                and the selected magnitude range \
-                                (save triggered by pressing \'p\')')
-
-    args = parser.parse_args()
-
-    overlap_bins = int(args.bins * args.overlap)
-
-    if not (overlap_bins >= 0 and overlap_bins < args.bins):
-        raise ValueError("number of overlapping bins is out of bounds")
-
-    if args.raw is not None:
-        sig_input = RawSigInput(args.raw, 2, np.dtype(np.float32), sys.stdin)
-    else:
-        sig_input = JackInput(args.jack)
+    if args is None:
+        args = make_parser().parse_args()
+
+    sig_input, overlap_bins = open_input(args)
 
     glutInit()
     glutInitWindowSize(640, 480)
     glutInitDisplayMode(GLUT_DOUBLE | GLUT_RGBA)
 
-    viewer = WaterfallWindow(sig_input, args.bins, overlap=overlap_bins)
+    if args.queue_rows < 1:
+        raise ValueError("queue length must be at least 1")
+
+    # the default height of 1024 rows corresponds to --height 0
+    row_hop = (args.bins - overlap_bins) * args.integrate
+    history_rows = int(math.ceil(args.height * sig_input.sample_rate / row_hop))
+
+    viewer = WaterfallWindow(sig_input, args.bins, overlap=overlap_bins, batch=args.batch,
+                             workers=args.workers, fps=args.fps, queue_rows=args.queue_rows,
+                             queue_policy=args.queue_policy, gpu_log=args.gpu_log,
+                             texture_format=args.texture_format,
+                             history_rows=max(1024, history_rows),
+                             scrollback_rows=int(args.scrollback * sig_input.sample_rate
+                                                 / row_hop),
+                             scrollback_file=args.scrollback_file, taps=args.pfb,
+                             integrate=args.integrate, integrate_mode=args.integrate_mode)
 
-    if args.detector:
-        detector_em = EventMarker(viewer)
-        viewer.layers.append(detector_em)
-        viewer.layers += [DetectorScript(viewer, [detector_em], a.split()) for a in args.detector]
+    event_marker = EventMarker(viewer)
+    viewer.layers.append(event_marker)
+    attach_layers(viewer, args, [event_marker], detector_class=DetectorScript,
+                  process_class=DetectorProcess)
 
-    if isinstance(sig_input, JackInput):
-        midi_em = EventMarker(viewer)
-        viewer.layers += [midi_em, MIDIEventGatherer(viewer, [midi_em])]
+    if viewer.row_store is not None:
+        viewer.layers.insert(viewer.layers.index(viewer.overlay), Scrollback(viewer))
 
     viewer.layers += [make_commands_layer(viewer), RangeSelector(viewer),
-                      Label(viewer, str(viewer.sig_input)),
+                      Label(viewer, viewer.status), ZoomControl(viewer, args),
 # TODO
 #                      DateLabel(viewer),
                       Console(viewer, globals())]
@@ -0,0 +1,100 @@
+"""Input of a zoomed-in waterfall, down-converted from the signal of another one
+
+A ZoomInput is attached as a layer to the processor of the full band, where
+it takes copies of the samples read, and is the input of a second processor
+(usually a second waterfall window). The down-conversion and decimation run
+on the thread of the second processor, the first one only hands the samples
+over.
+"""
+
+import Queue
+import numpy as np
+
+from pysdr.input import SigInput
+from pysdr.dsp import DDC
+
+class ZoomInput(SigInput):
+    """Input of the band of `processor`'s signal around `freq`, decimated by `decimation`
+
+    The frequency is relative to the center of the full band and can be
+    changed by `tune` while running. If the zoomed-in processor falls behind
+    by more than QUEUE_BLOCKS blocks of samples, further blocks are dropped,
+    so the full band is never held up. After `close`, reading ends with
+    EOFError.
+    """
+    QUEUE_BLOCKS = 64
+
+    def __init__(self, processor, freq, decimation, taps_per_phase=16):
+        SigInput.__init__(self)
+        self.source_rate = processor.sig_input.sample_rate
+        self.sample_rate = float(self.source_rate) / decimation
+        self.no_channels = 2
+        self.decimation = decimation
+        self.ddc = DDC(self.source_rate, freq, decimation, taps_per_phase)
+
+        self.blocks = Queue.Queue(self.QUEUE_BLOCKS)
+        self.dropped = 0
+        self.closed = False
+        # decimated samples of the last block and how many of them were read
+        self.pending = np.zeros(0, dtype=np.complex64)
+        self.pending_pos = 0
+
+    @property
+    def freq(self):
+        return self.ddc.nco.freq
+
+    def tune(self, freq):
+        self.ddc.tune(freq)
+
+    def close(self):
+        self.closed = True
+
+    def on_samples(self, samples):
+        if self.closed:
+            return
+
+        try:
+            self.blocks.put_nowait(samples.copy())
+        except Queue.Full:
+            self.dropped += len(samples)
+
+    def next_block(self):
+        while True:
+            if self.closed:
+                raise EOFError
+
+            try:
+                return self.blocks.get(timeout=0.1)
+            except Queue.Empty:
+                pass
+
+    def read_into(self, out):
+        pos = 0
+
+        while pos < len(out):
+            if self.pending_pos == len(self.pending):
+                # the decimator's output stays valid until the next block
+                self.pending = self.ddc.process(self.next_block())
+                self.pending_pos = 0
+                continue
+
+            n = min(len(out) - pos, len(self.pending) - self.pending_pos)
+            out[pos:pos + n] = self.pending[self.pending_pos:self.pending_pos + n]
+            pos += n
+            self.pending_pos += n
+
+    def read(self, frames):
+        out = np.zeros(frames, dtype=np.complex64)
+        self.read_into(out)
+        return out
+
+    def start(self):
+        pass
+
+    def __str__(self):
+        text = "zoom at %+.1f kHz, %.1f kHz wide" % (self.freq / 1e3, self.sample_rate / 1e3)
+
+        if self.dropped:
+            text += " (samples dropped: %d)" % self.dropped
+
+        return text
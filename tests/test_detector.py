@@ -0,0 +1,155 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from pysdr.processor import SignalProcessor
+from pysdr.detector import DetectorScript, DetectorProcess
+
+class FakeInput:
+    sample_rate = 48000
+    is_real = False
+
+TASK = """
+resumed = []
+
+def task(n):
+    row, spectrum = yield wait_rows(n)
+    resumed.append(row)
+"""
+
+ROW_PASS_SCRIPT = TASK + """
+def lin_spectrum_pass(row, spectrum):
+    if row in (50, 62):
+        spawn(task(3 if row == 50 else 5), spectrum='lin')
+"""
+
+BLOCK_PASS_SCRIPT = TASK + """
+def lin_spectrum_block_pass(row, block, bands):
+    if row in (48, 64):
+        spawn(task(3 if row == 48 else 20), spectrum='lin')
+"""
+
+FINISH_SCRIPT = TASK + """
+def measure():
+    yield wait_rows(20)
+    finish()
+
+spawn(measure(), spectrum='lin')
+
+def lin_spectrum_pass(row, spectrum):
+    resumed.append(row)
+"""
+
+USAGE_SCRIPT = """
+if len(args) != 1:
+    raise Exception("usage: -d 'script.py ARG'")
+"""
+
+EVENT_SCRIPT = """
+def waiter():
+    event_id, payload = yield wait_event('test.ping')
+    row, spectrum = yield wait_rows(1)
+    emit_event('test.pong', (event_id, payload))
+
+spawn(waiter(), spectrum='lin')
+"""
+
+class EventGatherer:
+    def __init__(self):
+        self.events = []
+
+    def on_event(self, event_id, payload):
+        self.events.append((event_id, payload))
+
+class TaskRuntimeTest(unittest.TestCase):
+    """Tasks spawned by a script count rows from the row they were spawned at"""
+    BINS = 64
+    BLOCK_ROWS = 16
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='pysdr-test-')
+        self.processor = SignalProcessor(FakeInput(), self.BINS, log=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def load_script(self, source):
+        filename = os.path.join(self.path, 'script.py')
+
+        with open(filename, 'w') as f:
+            f.write(source)
+
+        script = DetectorScript(self.processor, [], [filename])
+        self.processor.layers.append(script)
+        return script
+
+    def dispatch(self, rows):
+        for i in xrange(rows / self.BLOCK_ROWS):
+            block = np.ones((self.BLOCK_ROWS, self.BINS), dtype=np.float32)
+            self.processor.dispatch_spectra(block, None)
+
+    def run_script(self, source, rows):
+        script = self.load_script(source)
+        self.dispatch(rows)
+        self.assertFalse(script.disabled)
+        return script.namespace
+
+    def test_spawn_from_row_pass(self):
+        # the first task is spawned and resumed within a block,
+        # the second one across the boundary of two blocks
+        namespace = self.run_script(ROW_PASS_SCRIPT, 128)
+        self.assertEqual(namespace['resumed'], [53, 67])
+
+    def test_spawn_from_block_pass(self):
+        # tasks spawned by a block pass count from the first row of the block
+        namespace = self.run_script(BLOCK_PASS_SCRIPT, 128)
+        self.assertEqual(namespace['resumed'], [51, 84])
+
+    def test_finish(self):
+        # the script stops after the row its task finishes it at
+        script = self.load_script(FINISH_SCRIPT)
+        self.dispatch(64)
+        self.assertTrue(script.finished)
+        self.assertTrue(script.disabled)
+        self.assertEqual(script.namespace['resumed'], range(21))
+
+    def test_load_failure(self):
+        # a script failing to load is disabled instead of raising
+        script = self.load_script(USAGE_SCRIPT)
+        self.assertTrue(script.disabled)
+        self.assertFalse(script.finished)
+        self.dispatch(32)
+
+    def test_wait_event_isolated(self):
+        # events reach the tasks of a script run in a process of its own
+        filename = os.path.join(self.path, 'script.py')
+
+        with open(filename, 'w') as f:
+            f.write(EVENT_SCRIPT)
+
+        gatherer = EventGatherer()
+        listeners = [gatherer]
+        detector = DetectorProcess(self.processor, listeners, [filename])
+        listeners.append(detector)
+        self.processor.layers.append(detector)
+
+        try:
+            self.dispatch(self.BLOCK_ROWS)
+            detector.on_event('test.other', (1,))
+            detector.on_event('test.ping', (2,))
+            deadline = time.time() + 10.0
+
+            while not gatherer.events and time.time() < deadline:
+                self.dispatch(self.BLOCK_ROWS)
+                time.sleep(0.01)
+        finally:
+            detector.process.stdin.close()
+            detector.process.wait()
+
+        self.assertEqual(gatherer.events, [('test.pong', ('test.ping', (2,)))])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from pysdr.processor import SignalProcessor
+from pysdr.recording import SpectrogramRecorder, SpectrogramReader
+
+class FakeInput:
+    sample_rate = 48000
+    is_real = False
+
+class RecordingAppendTest(unittest.TestCase):
+    """Rows are appended only to recordings of the same bins and timing"""
+    BINS = 64
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(prefix='pysdr-test-'), 'rec')
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.path))
+
+    def record(self, rows, **kwargs):
+        processor = SignalProcessor(FakeInput(), self.BINS, **kwargs)
+        recorder = SpectrogramRecorder(processor, self.path, chunk_rows=16)
+        recorder.on_log_spectrum_block(np.zeros((rows, self.BINS), dtype=np.float32))
+        recorder.close()
+
+    def test_append(self):
+        self.record(40, overlap=32)
+        self.record(24, overlap=32)
+        self.assertEqual(len(SpectrogramReader(self.path)), 64)
+
+    def test_append_other_timing(self):
+        self.record(40, overlap=32)
+
+        for kwargs in [dict(overlap=16), dict(overlap=32, integrate=2)]:
+            self.assertRaises(ValueError, self.record, 24, **kwargs)
+
+        self.assertEqual(len(SpectrogramReader(self.path)), 40)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from pysdr.input import MmapSigInput
+from pysdr.processor import SignalProcessor
+from pysdr.snapshot import SnapshotRecorder
+
+class SnapshotAlignmentTest(unittest.TestCase):
+    """Snapshots cover the samples of the windows of the rows of the event"""
+    BINS = 64
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='pysdr-test-')
+
+        # each sample holds its own number
+        filename = os.path.join(self.path, 'ramp.cf32')
+        np.arange(16384, dtype=np.complex64).tofile(filename)
+        self.sig_input = MmapSigInput(filename, sample_rate=48000, speed=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def snapshot(self, overlap, taps, rows):
+        processor = SignalProcessor(self.sig_input, self.BINS, overlap=overlap, taps=taps)
+        recorder = SnapshotRecorder(processor, os.path.join(self.path, 'snapshots'),
+                                    pre=0, post=0, buffer=1.0, format='cf32')
+        processor.layers.append(recorder)
+        processor.process()
+
+        recorder.on_event('mlab.aabb_event.test', (rows[0], rows[1], 0, self.BINS))
+        recorder.close()
+
+        base = os.path.join(self.path, 'snapshots',
+                            [f for f in os.listdir(recorder.path) if f.endswith('.json')][0])
+        meta = json.load(open(base))
+        samples = np.fromfile(base[:-len('.json')] + '.cf32', dtype=np.complex64)
+        return meta['first_sample'], samples.real.astype(np.int64)
+
+    def test_pfb(self):
+        taps, hop = 4, self.BINS
+        first, samples = self.snapshot(0, taps, (20, 22))
+
+        # the window of row 20 starts with the taps - 1 frames before it
+        self.assertEqual(first, 20 * hop - (taps - 1) * self.BINS)
+        self.assertEqual(samples[0], first)
+        self.assertEqual(samples[-1], 23 * hop - 1)
+
+    def test_overlap(self):
+        overlap = self.BINS / 2
+        hop = self.BINS - overlap
+        first, samples = self.snapshot(overlap, 1, (20, 22))
+
+        self.assertEqual(first, 20 * hop - overlap)
+        self.assertEqual(samples[-1], 23 * hop - 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,6 +12,7 @@ import numpy as np
 
 import os
 os.environ['PYSDL2_DLL_PATH'] = '.'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
 import sdl2
 import sdl2.ext
@@ -29,6 +30,8 @@ from OpenGL.arrays import vbo, GLOBAL_REGISTRY
 
 import threading
 
+from pysdr.spectral import SpectralEngine
+from pysdr.dsp import lowpass, FIRInterpolator, NCO
 
 if np.float32 not in GLOBAL_REGISTRY:
     from OpenGL.arrays.numpymodule import NumpyHandler
@@ -476,44 +479,6 @@ class WFViewer:
             return
 
 
-class interp_fir_filter:
-    def __init__(self, taps, interp):
-        self.interp = interp
-        self.nhistory = (len(taps) - 1) // interp
-        padlen = (self.nhistory + 1) * interp - len(taps)
-        self.taps = np.concatenate((np.zeros(padlen, dtype=taps.dtype), taps))
-
-    def __call__(self, inp):
-        interp = self.interp
-        res = np.zeros((len(inp) - self.nhistory) * interp, dtype=inp.dtype)
-
-        for i in range(interp):
-            res[i::interp] = np.convolve(inp, self.taps[i::interp], mode='valid')
-
-        return res
-
-
-class freq_translator:
-    def __init__(self, phase_inc):
-        self.phase_inc = phase_inc
-        self.phase = 1.0
-
-    def __call__(self, inp):
-        shift = np.exp(1j * self.phase_inc * np.arange(len(inp), dtype=np.float32)) * self.phase
-        self.phase = shift[-1] * np.exp(1j * self.phase_inc)
-        return inp * shift
-
-
-def lowpass(w_c, N, start=None):
-    a = np.arange(N) - (float(N - 1) / 2)
-    taps = np.sin(a * w_c) / a / np.pi
-
-    if N % 2 == 1:
-        taps[N/2] = w_c / np.pi
-
-    return taps
-
-
 class RingBuf:
     def __init__(self, headlen, buf):
         self.headlen = headlen
@@ -543,7 +508,7 @@ UPDATE_EVENT.type = UPDATE_EVENT_TYPE
 
 
 def input_thread(readfunc, ringbuf, nbins, overlap, viewer):
-    window = 0.5 * (1.0 - np.cos((2 * math.pi * np.arange(nbins)) / nbins))
+    engine = SpectralEngine(nbins)
 
     #ringbuf.append(np.fromfile(fil, count=ringbuf.headlen, dtype=np.complex64))
     ringbuf.append(np.frombuffer(readfunc(ringbuf.headlen * 8), dtype=np.complex64))
@@ -553,10 +518,8 @@ def input_thread(readfunc, ringbuf, nbins, overlap, viewer):
         ringbuf.append(np.frombuffer(readfunc((nbins - overlap) * 8), dtype=np.complex64))
 
         frame = ringbuf.slice(ringbuf.fill_edge - nbins, ringbuf.fill_edge)
-        spectrum = np.absolute(np.fft.fft(np.multiply(frame, window)))
-        spectrum = np.concatenate((spectrum[nbins//2:nbins], spectrum[0:nbins//2]))
-        spectrum = np.log10(spectrum) * 10
-        viewer.inserts.put(spectrum / 20.0)
+        engine.process(frame)
+        viewer.inserts.put(engine.log_spectrum() / 20.0)
 
         sdl2.SDL_PushEvent(UPDATE_EVENT)
 
@@ -583,10 +546,12 @@ def main():
     wf.init(800, 600)
     wf.shift = 0
 
-    filt = interp_fir_filter(lowpass(np.pi / 4, 512) * np.hamming(512), 4)
-    freqx = freq_translator((0.8/8.0) * np.pi)
+    # at a quarter of the unity gain, as the filter had before
+    filt = FIRInterpolator(lowpass(512, 1 / 8.0) / 4, 4)
+    # shifts up by 0.1 pi per output sample
+    freqx = NCO(1.0, -0.05)
 
-    headlen = max(filt.nhistory, overlap)
+    headlen = overlap
     ringbuf = RingBuf(headlen, np.zeros(headlen + (nbins - overlap) * 512, dtype=np.complex64))
 
     # FIXME
@@ -598,8 +563,8 @@ def main():
         bufbuf = pybuf_from_memory(buf, buflen, 0x200) # PyBUF_WRITE
         array = np.frombuffer(bufbuf, np.float32)
 
-        assert len(array) % filt.interp == 0 # TODO
-        nreqframes = len(array) // filt.interp
+        assert len(array) % filt.factor == 0 # TODO
+        nreqframes = len(array) // filt.factor
 
         loc_ringbuf_edge = ringbuf.fill_edge
         if loc_ringbuf_edge < 0 or (loc_ringbuf_edge - audio_edge) % len(ringbuf) < nreqframes:
@@ -611,8 +576,9 @@ def main():
         if audio_edge + nreqframes > len(ringbuf):
             audio_edge = 0
 
-        slic = ringbuf.slice(audio_edge - filt.nhistory, audio_edge + nreqframes)
-        array[:] = np.real(freqx(filt(slic))) * wf.volume
+        # the filters carry their history over from the previous callback
+        slic = ringbuf.slice(audio_edge, audio_edge + nreqframes)
+        array[:] = np.real(freqx.process(filt.process(slic))) * wf.volume
         audio_edge += nreqframes
         sdl2.SDL_PushEvent(UPDATE_EVENT)
 